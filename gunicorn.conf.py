@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+""" gunicorn settings, see the Procfile
+"""
+import os
+import sys
+
+
+def on_starting(server):
+    # Metrics files left by the workers of an earlier server would keep
+    # adding to the totals of this one, see webapp.metrics
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rhub.settings')
+    from webapp import metrics
+    metrics.clear()
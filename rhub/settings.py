@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'webapp.timing.RequestTimingMiddleware',
+    'webapp.routers.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,11 +52,24 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-request query count, DB time, template time and total time in a
+# Server-Timing header and the webapp.timing log, see webapp.timing
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '') == '1'
+
+# Request latency and query count metrics per URL name, served with the
+# booking and cache counters at /internal/metrics/, see webapp.metrics.
+# Worker processes share them through files in METRICS_DIR.
+METRICS = os.environ.get('METRICS', '') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 ROOT_URLCONF = 'rhub.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates timing its renders for webapp.timing
+        'BACKEND': 'webapp.timing.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -64,6 +79,9 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # No loaders given: with DEBUG off Django wraps them in the
+            # cached loader, templates are compiled once per process. With
+            # DEBUG on edits show up without a restart.
         },
     },
 ]
@@ -82,6 +100,48 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# Invalidation works through version stamps stored in the cache, so every
+# process serving the site must share it (memcached, redis or database)
+# in production: set CACHE_BACKEND and CACHE_LOCATION.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'rhub'),
+    }
+}
+
+# Length of the booking slots seats are counted in, see webapp.booking
+BOOKING_SLOT_MINUTES = 30
+# Hours (in TIME_ZONE) between which slots are offered, see /availability/
+BOOKING_OPENING_HOURS = (10, 22)
+# Days ahead of today /availability/ can start at
+BOOKING_HORIZON_DAYS = 365
+# Bookings older than this many days are moved out by archive_bookings
+BOOKING_ARCHIVE_DAYS = 365
+# Leave submitted bookings to the process_booking_requests worker
+BOOKING_QUEUE = os.environ.get('BOOKING_QUEUE', '') == '1'
+
+# Restaurant form selects with more types or cuisines than this load them
+# as the user types instead of listing them all
+TAXONOMY_INLINE_CHOICES = 500
+
+# Upper bound of the in-process autocomplete index (webapp.autocomplete),
+# roughly 200 bytes per entry and one entry per word of each name
+AUTOCOMPLETE_MAX_ENTRIES = 100000
+
+
+# Permission checks are answered from the cache, see webapp.authz. Logins
+# go through the first backend; ModelBackend stays listed for the sessions
+# opened before, which name it as their backend.
+AUTHENTICATION_BACKENDS = [
+    'webapp.authz.CachedPermissionBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -101,6 +161,25 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Logging
+# https://docs.djangoproject.com/en/1.11/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'webapp': {
+            'handlers': ['console'],
+            'level': os.environ.get('WEBAPP_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.11/topics/i18n/
 
@@ -120,6 +199,9 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+# Content hashed names with gzip and brotli variants written by
+# collectstatic, served by WhiteNoise (rhub/wsgi.py) as immutable
+STATICFILES_STORAGE = 'webapp.storage.StaticFilesStorage'
 
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/restaurant/'
@@ -128,6 +210,23 @@ import dj_database_url
 
 DATABASES['default'] = dj_database_url.config()
 
+# SQLite tests run against a file rather than the in-memory default, which
+# is private to its connection: the concurrent booking tests need their
+# threads to share the test database.
+if DATABASES['default'].get('ENGINE') == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('TEST', {}).setdefault('NAME', os.path.join(BASE_DIR, 'test_db.sqlite3'))
+
+# Read replicas, comma separated database URLs. Reads go to a replica
+# unless the client wrote in the last READ_YOUR_WRITES_SECONDS, see
+# webapp.routers. Tests run the replicas against the test primary.
+DATABASE_REPLICAS = []
+for i, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(','))):
+    alias = 'replica%d' % (i + 1)
+    DATABASES[alias] = dict(dj_database_url.parse(url.strip()), TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['webapp.routers.PrimaryReplicaRouter']
+READ_YOUR_WRITES_SECONDS = 10
+
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
 ALLOWED_HOSTS = ['*']
@@ -6,3 +6,7 @@ from django.apps import AppConfig
 
 class WebappConfig(AppConfig):
     name = 'webapp'
+
+    def ready(self):
+        from . import signals  # noqa: registers the signal receivers
+        from . import checks  # noqa: registers the system checks
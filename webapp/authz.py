@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from . import caching, metrics
+from .routers import primary_reads
+from .models import Restaurant
+
+# Versions shared by all users (group permissions) and of each user
+CACHE_NAMESPACE = 'authz'
+USER_NAMESPACE = 'authz:%s'
+ENTRY_KEY = 'webapp:authz:%s'
+CACHE_TIMEOUT = 3600
+
+
+LOADERS = {
+    'perms': lambda user: frozenset(ModelBackend().get_all_permissions(user)),
+    'customer': lambda user: user.groups.filter(name__icontains='customer').exists(),
+    'restaurants': lambda user: frozenset(Restaurant.users.through.objects.filter(user_id=user.pk)
+                                          .values_list('restaurant_id', flat=True)),
+}
+
+
+def lookup(user, name):
+    """ Permissions ('perms'), customer flag ('customer') or owned restaurant
+    ids ('restaurants') of the user. Each is loaded on first use and cached
+    until it may have changed (see webapp.signals), the cached entry is kept
+    on the user object for the rest of the request.
+    """
+    entry = getattr(user, '_authz', None)
+    if entry is None:
+        version = (caching.get_version(CACHE_NAMESPACE), caching.get_version(USER_NAMESPACE % user.pk))
+        cached = cache.get(ENTRY_KEY % user.pk)
+        hit = cached is not None and cached['version'] == version
+        metrics.cache_lookup('authz', hit)
+        entry = cached if hit else {'version': version}
+        user._authz = entry
+    if name not in entry:
+        with primary_reads():
+            entry[name] = LOADERS[name](user)
+        cache.set(ENTRY_KEY % user.pk, entry, CACHE_TIMEOUT)
+    return entry[name]
+
+def forget_user(user_id):
+    caching.bump_version(USER_NAMESPACE % user_id)
+
+def forget_all():
+    caching.bump_version(CACHE_NAMESPACE)
+
+def is_customer(user):
+    return user.is_authenticated and lookup(user, 'customer')
+
+def owns_restaurant(user, restaurant_id):
+    return user.is_authenticated and int(restaurant_id) in lookup(user, 'restaurants')
+
+def owns_any_restaurant(user):
+    return user.is_authenticated and bool(lookup(user, 'restaurants'))
+
+def can_manage_booking(user, booking):
+    """ Bookings are changed by whoever made them or an owner of the restaurant
+    """
+    return booking.user_id == user.pk or owns_restaurant(user, booking.restaurant_id)
+
+
+class CachedPermissionBackend(ModelBackend):
+    """ ModelBackend answering permission checks (has_perm, the perms
+    template variable, permission_required) from the cached user entry
+    """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        perms = set(lookup(user_obj, 'perms'))
+        # Checks this backend denies go on to the ModelBackend listed after
+        # it, which answers from _perm_cache instead of querying again
+        user_obj._perm_cache = perms
+        return perms
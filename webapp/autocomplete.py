@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import bisect
+import threading
+
+from django.conf import settings
+
+from . import caching, metrics
+from .routers import primary_reads
+from .models import Restaurant, Type, Cuisine
+
+# Version namespace shared by all processes: a process whose index was built
+# at an older version rebuilds it on the next lookup
+CACHE_NAMESPACE = 'autocomplete'
+# Taxonomy first: when the index is full the oldest restaurants are left out
+KINDS = (('type', Type), ('cuisine', Cuisine), ('restaurant', Restaurant))
+MAX_LABEL_LENGTH = 100
+# Entries examined per lookup, keeps short prefixes as fast as long ones
+MAX_SCAN = 500
+
+
+def _keys(label):
+    """ Lowercased label from the start of each word, so "Joe's Pizza" is
+    found by "jo" and by "pi"
+    """
+    label = label.lower()
+    keys = []
+    for i, char in enumerate(label):
+        if char.isalnum() and (i == 0 or not label[i - 1].isalnum()):
+            keys.append(label[i:])
+    return keys
+
+
+class PrefixIndex(object):
+    """ Sorted list of (key, kind, id, label) entries answering prefix queries
+    with a binary search. Holds at most max_entries entries, further
+    additions are dropped until something is removed. Changes are made to a
+    copy of the list swapped in when done, lookups running meanwhile without
+    the lock keep reading the list they started with.
+    """
+
+    def __init__(self, max_entries, version=None):
+        self.max_entries = max_entries
+        self.version = version
+        self.entries = []
+        self.keys = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self, rows):
+        """ Fills an empty index from (kind, id, label) rows, faster than
+        adding them one by one
+        """
+        for kind, pk, label in rows:
+            label = label[:MAX_LABEL_LENGTH]
+            keys = _keys(label)
+            if len(self.entries) + len(keys) > self.max_entries:
+                break
+            self.entries.extend((key, kind, pk, label) for key in keys)
+            self.keys[(kind, pk)] = (keys, label)
+        self.entries.sort()
+
+    def add(self, kind, pk, label):
+        entries = self._without(kind, pk)
+        label = label[:MAX_LABEL_LENGTH]
+        keys = _keys(label)
+        if len(entries) + len(keys) > self.max_entries:
+            self.entries = entries
+            return False
+        for key in keys:
+            bisect.insort(entries, (key, kind, pk, label))
+        self.keys[(kind, pk)] = (keys, label)
+        self.entries = entries
+        return True
+
+    def label(self, kind, pk):
+        return self.keys.get((kind, pk), ((), None))[1]
+
+    def remove(self, kind, pk):
+        self.entries = self._without(kind, pk)
+
+    def _without(self, kind, pk):
+        # Copy of the entries without those of (kind, pk)
+        entries = list(self.entries)
+        keys, label = self.keys.pop((kind, pk), ((), None))
+        for key in keys:
+            i = bisect.bisect_left(entries, (key, kind, pk, label))
+            if i < len(entries) and entries[i] == (key, kind, pk, label):
+                del entries[i]
+        return entries
+
+    def lookup(self, prefix, limit=10):
+        """ Distinct (kind, id, label) of the entries whose key starts with
+        the prefix, shortest keys (closest matches) first
+        """
+        prefix = prefix.lower().strip()
+        if not prefix:
+            return []
+        entries = self.entries
+        i = bisect.bisect_left(entries, (prefix,))
+        end = min(i + MAX_SCAN, len(entries))
+        matches = []
+        seen = set()
+        while i < end and entries[i][0].startswith(prefix):
+            key, kind, pk, label = entries[i]
+            if (kind, pk) not in seen:
+                seen.add((kind, pk))
+                matches.append((len(key), label, kind, pk))
+            i += 1
+        matches.sort()
+        return [(kind, pk, label) for _, label, kind, pk in matches[:limit]]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def _rows():
+    for kind, model in KINDS:
+        for pk, label in model.objects.order_by('-id').values_list('pk', 'name').iterator():
+            yield kind, pk, label
+
+def build_index(version):
+    index = PrefixIndex(getattr(settings, 'AUTOCOMPLETE_MAX_ENTRIES', 100000), version)
+    with primary_reads():
+        index.load(_rows())
+    return index
+
+def get_index():
+    """ Index of this process, rebuilt when another process changed the data
+    """
+    global _index
+    version = caching.get_version(CACHE_NAMESPACE)
+    index = _index
+    metrics.cache_lookup('autocomplete', index is not None and index.version == version)
+    if index is None or index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = build_index(version)
+            index = _index
+    return index
+
+def _update(change):
+    """ Applies a change to this process' index and announces it to the
+    others through the version stamp
+    """
+    global _index
+    with _lock:
+        index = _index
+        version = caching.bump_version(CACHE_NAMESPACE)
+        if index is None:
+            return
+        if index.version is not None and version == index.version + 1:
+            change(index)
+            index.version = version
+        else:
+            # Missed changes made elsewhere, rebuild on the next lookup
+            _index = None
+
+def add(kind, pk, label):
+    # Saves not touching the name leave every process' index as it is
+    index = _index
+    if index is not None and index.label(kind, pk) == label[:MAX_LABEL_LENGTH] \
+            and index.version == caching.get_version(CACHE_NAMESPACE):
+        return
+    _update(lambda index: index.add(kind, pk, label))
+
+def remove(kind, pk):
+    _update(lambda index: index.remove(kind, pk))
+
+def suggest(prefix, limit=10):
+    return get_index().lookup(prefix, limit)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .models import Booking, BookingArchive, BookingRequest, BookingSlot
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+SLOT_FULL_MESSAGE = "Not enough free seats at that time."
+
+
+class SlotFull(Exception):
+    """ Not enough free seats left in the slot
+    """
+
+
+def slot_minutes():
+    return getattr(settings, 'BOOKING_SLOT_MINUTES', 30)
+
+def opening_hours():
+    return getattr(settings, 'BOOKING_OPENING_HOURS', (10, 22))
+
+def horizon_days():
+    return getattr(settings, 'BOOKING_HORIZON_DAYS', 365)
+
+def slot_start(when):
+    """ Start of the slot the time falls in, slots are aligned on UTC
+    """
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    length = slot_minutes() * 60
+    seconds = int((when - EPOCH).total_seconds())
+    return EPOCH + datetime.timedelta(seconds=seconds - seconds % length)
+
+def get_slot(restaurant, start):
+    """ Slot row of the restaurant starting at start, created on first use
+    """
+    try:
+        return BookingSlot.objects.get(restaurant=restaurant, start=start)
+    except BookingSlot.DoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            return BookingSlot.objects.create(restaurant=restaurant, start=start, capacity=restaurant.capacity)
+    except IntegrityError:
+        # Created by a concurrent request in the meantime
+        return BookingSlot.objects.get(restaurant=restaurant, start=start)
+
+def reserve(slot_id, seats):
+    """ Takes seats in the slot or raises SlotFull. A single conditional
+    UPDATE: the database checks and takes the seats atomically, concurrent
+    reservations of the same slot cannot both see the same free seats.
+    """
+    taken = (BookingSlot.objects.filter(pk=slot_id, booked__lte=F('capacity') - seats)
+             .update(booked=F('booked') + seats))
+    if not taken:
+        raise SlotFull(slot_id)
+
+def release(slot_id, seats):
+    if slot_id is not None:
+        BookingSlot.objects.filter(pk=slot_id, booked__gte=seats).update(booked=F('booked') - seats)
+
+def place_booking(booking):
+    """ Saves a new booking after taking its seats, raises SlotFull and saves
+    nothing when the slot has not enough free seats
+    """
+    try:
+        with transaction.atomic():
+            slot = get_slot(booking.restaurant, slot_start(booking.booking_date))
+            reserve(slot.pk, booking.number_of_people)
+            booking.slot = slot
+            booking.save()
+    except SlotFull:
+        metrics.BOOKINGS.inc(action='create', outcome='full')
+        raise
+    metrics.BOOKINGS.inc(action='create', outcome='ok')
+
+def change_booking(booking, old_slot_id, old_seats):
+    """ Saves a changed booking, moving its seats from the slot it held
+    """
+    try:
+        with transaction.atomic():
+            release(old_slot_id, old_seats)
+            slot = get_slot(booking.restaurant, slot_start(booking.booking_date))
+            reserve(slot.pk, booking.number_of_people)
+            booking.slot = slot
+            booking.save()
+    except SlotFull:
+        metrics.BOOKINGS.inc(action='update', outcome='full')
+        raise
+    metrics.BOOKINGS.inc(action='update', outcome='ok')
+
+def cancel_booking(booking):
+    with transaction.atomic():
+        release(booking.slot_id, booking.number_of_people)
+        booking.delete()
+    metrics.BOOKINGS.inc(action='delete', outcome='ok')
+
+def queued():
+    return getattr(settings, 'BOOKING_QUEUE', False)
+
+def submit_booking(booking, key):
+    """ Records the unsaved booking as a request under the user's idempotency
+    key and returns (request, created). The booking is placed right away, or
+    left pending for the worker when BOOKING_QUEUE is set. A key that was
+    submitted before returns the first request unchanged.
+    """
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                booking_request = BookingRequest.objects.create(
+                    user=booking.user, key=key, restaurant=booking.restaurant,
+                    booking_date=booking.booking_date, number_of_people=booking.number_of_people,
+                    special_message=booking.special_message)
+        except IntegrityError:
+            # Duplicate submit, a concurrent one waits here for the first to commit
+            return BookingRequest.objects.get(user=booking.user, key=key), False
+        if not queued():
+            process_request(booking_request, booking)
+    return booking_request, True
+
+def process_request(booking_request, booking=None):
+    """ Places the booking of a pending request and records the outcome
+    """
+    if booking is None:
+        booking = Booking(user_id=booking_request.user_id, restaurant_id=booking_request.restaurant_id,
+                          booking_date=booking_request.booking_date,
+                          number_of_people=booking_request.number_of_people,
+                          special_message=booking_request.special_message)
+        booking.name = "Booking on " + str(timezone.now())
+    try:
+        place_booking(booking)
+    except SlotFull:
+        booking_request.status = BookingRequest.FAILED
+        booking_request.error = SLOT_FULL_MESSAGE
+    else:
+        booking_request.status = BookingRequest.DONE
+        booking_request.booking = booking
+    booking_request.save()
+
+def process_pending(batch_size=100):
+    """ Processes up to batch_size pending requests oldest first, returns how
+    many were processed. Each runs in its own transaction; rows locked by
+    another worker are skipped where the database supports it.
+    """
+    connection = transaction.get_connection()
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    processed = 0
+    while processed < batch_size:
+        with transaction.atomic():
+            booking_request = (BookingRequest.objects.select_for_update(skip_locked=skip_locked)
+                               .filter(status=BookingRequest.PENDING).order_by('id').first())
+            if booking_request is None:
+                break
+            process_request(booking_request)
+        processed += 1
+    return processed
+
+ARCHIVED_FIELDS = ('id', 'name', 'user_id', 'restaurant_id', 'booking_date', 'number_of_people',
+                   'special_message', 'created_at', 'updated_at')
+
+def archive_bookings(before, batch_size=1000):
+    """ Moves bookings dated before the given time to BookingArchive, one
+    transaction per batch so an interrupted run loses nothing, and drops the
+    slot rows they no longer need. Returns the number of bookings moved.
+    """
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(Booking.objects.filter(booking_date__lt=before).order_by('id')
+                        .values(*ARCHIVED_FIELDS)[:batch_size])
+            if not rows:
+                break
+            BookingArchive.objects.bulk_create(BookingArchive(**row) for row in rows)
+            Booking.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        moved += len(rows)
+    # By pk in batches too, Booking.slot is SET_NULL so a queryset delete
+    # would load every slot row at once
+    expired = BookingSlot.objects.filter(start__lt=slot_start(before)).order_by('pk')
+    while True:
+        pks = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        BookingSlot.objects.filter(pk__in=pks).delete()
+    return moved
+
+def availability(restaurant, first_day, days):
+    """ Free seats of every slot within opening hours for the days starting
+    at first_day, as {date: [free seats of each slot]}. Taken seats come from
+    one range query over the restaurant's slot rows, served by their
+    (restaurant, start) unique index.
+    """
+    opening, closing = opening_hours()
+    length = datetime.timedelta(minutes=slot_minutes())
+    range_start = timezone.make_aware(datetime.datetime.combine(first_day, datetime.time()))
+    range_end = range_start + datetime.timedelta(days=days)
+    taken = dict((start, (capacity, booked)) for start, capacity, booked in
+                 BookingSlot.objects.filter(restaurant=restaurant, start__gte=range_start, start__lt=range_end)
+                 .values_list('start', 'capacity', 'booked'))
+    result = []
+    for day in range(days):
+        start = range_start + datetime.timedelta(days=day, hours=opening)
+        end = range_start + datetime.timedelta(days=day, hours=closing)
+        free = []
+        while start < end:
+            capacity, booked = taken.get(start, (restaurant.capacity, 0))
+            free.append(max(capacity - booked, 0))
+            start += length
+        result.append(((range_start + datetime.timedelta(days=day)).date(), free))
+    return result
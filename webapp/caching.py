@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import re
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.encoding import force_bytes
+from django.utils.http import urlencode
+
+from . import metrics
+from .routers import primary_reads
+
+VERSION_KEY = 'webapp:version:%s'
+# Namespace of everything rendered from the restaurant list (index page)
+RESTAURANTS_NAMESPACE = 'restaurants'
+PAGE_KEY = 'webapp:page:%s:%s'
+CSRF_INPUT_RE = re.compile(br"""(name=['"]csrfmiddlewaretoken['"] value=['"])[A-Za-z0-9]+""")
+CSRF_PLACEHOLDER = b'__csrf_token__'
+
+
+def _new_stamp():
+    # Time based so a stamp handed out before a cache flush is never reused
+    return int(time.time() * 1000000)
+
+def get_version(namespace):
+    """ Current version stamp of a namespace of cached data. Entries stored
+    with an older stamp are stale.
+    """
+    key = VERSION_KEY % namespace
+    version = cache.get(key)
+    if version is None:
+        version = _new_stamp()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+def bump_version(namespace):
+    """ Invalidates everything cached under the namespace
+    """
+    key = VERSION_KEY % namespace
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _new_stamp()
+        cache.set(key, version, None)
+        return version
+
+def page_key(namespace, request, params):
+    """ Cache key of the page at the request's path, told apart only by the
+    query parameters the view reads: any other query string is served the
+    same entry instead of adding one
+    """
+    query = urlencode([(name, value) for name in sorted(params) for value in request.GET.getlist(name)])
+    return PAGE_KEY % (namespace, hashlib.md5(force_bytes(request.path + '?' + query)).hexdigest())
+
+def cache_anonymous_page(namespace, timeout, params=()):
+    """ Caches the full page served to anonymous GET requests until the
+    namespace version changes, one entry per value of the query parameters
+    in params. Requests carrying flash messages bypass the cache, the CSRF
+    token of cached forms is replaced by the visitor's own.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated or 'messages' in request.COOKIES:
+                return view(request, *args, **kwargs)
+            key = page_key(namespace, request, params)
+            version = get_version(namespace)
+            cached = cache.get(key)
+            hit = cached is not None and cached['version'] == version
+            metrics.cache_lookup('page', hit)
+            if hit:
+                token = force_bytes(get_token(request))
+                content = cached['content'].replace(CSRF_PLACEHOLDER, token)
+                return HttpResponse(content, content_type=cached['content_type'])
+            with primary_reads():
+                response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, {'version': version,
+                                'content': CSRF_INPUT_RE.sub(br'\1' + CSRF_PLACEHOLDER, response.content),
+                                'content_type': response['Content-Type']}, timeout)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.checks import Error, register
+
+STATIC_TAG_RE = re.compile(r"""{%\s*static\s+(['"])(?P<name>[^'"]+)\1""")
+# src="...", href="..." and url(...) values
+ASSET_RE = re.compile(r"""(?:(?:src|href)\s*=\s*(['"])(?P<attribute>[^'"]*)\1|url\(\s*['"]?(?P<url>[^'")]*))""")
+
+
+def template_files(app_configs=None):
+    """ Template files of the project's apps, Django's own are left out
+    """
+    for app_config in app_configs or apps.get_app_configs():
+        if app_config.name.startswith('django.'):
+            continue
+        directory = os.path.join(app_config.path, 'templates')
+        for root, _, names in os.walk(directory):
+            for name in sorted(names):
+                if name.endswith(('.html', '.txt', '.xml')):
+                    yield os.path.join(root, name)
+
+def static_problems(text):
+    """ (line, message) of the static file references of a template that
+    are not resolved through the manifest: URLs under STATIC_URL written
+    out instead of using {% static %}, and {% static %} names of files
+    collectstatic would not find
+    """
+    problems = []
+    for number, line in enumerate(text.splitlines(), 1):
+        for match in ASSET_RE.finditer(line):
+            url = match.group('attribute') or match.group('url') or ''
+            if url.startswith(settings.STATIC_URL) or 'STATIC_URL' in url:
+                problems.append((number, '%s is not resolved by {%% static %%}' % url))
+        for match in STATIC_TAG_RE.finditer(line):
+            if not finders.find(match.group('name')):
+                problems.append((number, 'static file %s does not exist' % match.group('name')))
+    return problems
+
+@register('staticfiles', 'templates')
+def check_static_references(app_configs=None, **kwargs):
+    """ Templates must only link static files by {% static %} names that
+    collectstatic puts in the manifest, or their URLs miss the content hash
+    (and the far-future cache headers) or fail to render in production
+    """
+    errors = []
+    for path in template_files(app_configs):
+        with io.open(path, encoding='utf-8') as template:
+            problems = static_problems(template.read())
+        for line, message in problems:
+            errors.append(Error('%s:%d: %s' % (path, line, message),
+                                hint='Load the file with {% static "app/path" %}.', id='webapp.E001'))
+    return errors
+
+@register('staticfiles', deploy=True)
+def check_static_manifest(app_configs=None, **kwargs):
+    """ Without the manifest collectstatic writes, StaticFilesStorage serves
+    every name unhashed, which is only meant for development and tests
+    """
+    if settings.DEBUG:
+        return []
+    manifest_name = getattr(staticfiles_storage, 'manifest_name', None)
+    if manifest_name is None or staticfiles_storage.exists(manifest_name):
+        return []
+    return [Error('%s has no %s, static URLs are served without content hashes' % (
+        settings.STATIC_ROOT, manifest_name), hint='Run collectstatic before starting the server.',
+        id='webapp.E002')]
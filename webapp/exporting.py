@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import six
+
+from .models import Restaurant, Booking, BookingArchive
+
+# Restaurant chunks go into an IN clause, SQLite takes at most 999 values
+CHUNK_SIZE = 500
+BOOKING_FIELDS = ('id', 'restaurant_id', 'user_id', 'booking_date', 'number_of_people',
+                  'special_message', 'created_at', 'updated_at')
+# Same columns as webapp.importing reads, an export can be imported again
+RESTAURANT_FIELDS = ('id', 'name', 'description', 'state', 'city', 'street', 'longitude', 'latitude',
+                     'telephone', 'website', 'capacity')
+RESTAURANT_COLUMNS = RESTAURANT_FIELDS + ('types', 'cuisines')
+
+
+def chunked(queryset, fields, chunk_size=CHUNK_SIZE):
+    """ Yields lists of value tuples in primary key order, one short query
+    per chunk continuing after the last key seen. Unlike a single cursor
+    this holds no long running query or transaction open, and it needs no
+    server-side cursor support from the database.
+    """
+    queryset = queryset.order_by('pk').values_list(*fields)
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(page[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1][0]
+
+def _linked_names(through, name, restaurant_ids):
+    names = dict((pk, []) for pk in restaurant_ids)
+    for pk, value in through.objects.filter(restaurant_id__in=restaurant_ids).values_list('restaurant_id', name):
+        names[pk].append(value)
+    return names
+
+def restaurant_rows(queryset, chunk_size=CHUNK_SIZE):
+    for rows in chunked(queryset, RESTAURANT_FIELDS, chunk_size):
+        ids = [row[0] for row in rows]
+        types = _linked_names(Restaurant.types.through, 'type__name', ids)
+        cuisines = _linked_names(Restaurant.cuisines.through, 'cuisine__name', ids)
+        for row in rows:
+            yield row + (';'.join(types[row[0]]), ';'.join(cuisines[row[0]]))
+
+def booking_rows(queryset, chunk_size=CHUNK_SIZE):
+    for rows in chunked(queryset, BOOKING_FIELDS, chunk_size):
+        for row in rows:
+            yield row
+
+# name: (columns, rows of a queryset, base queryset, filter to an owner)
+DATASETS = {
+    'restaurants': (RESTAURANT_COLUMNS, restaurant_rows, Restaurant.objects, 'users'),
+    'bookings': (BOOKING_FIELDS, booking_rows, Booking.objects, 'restaurant__users'),
+    'archived_bookings': (BOOKING_FIELDS, booking_rows, BookingArchive.objects, 'restaurant__users'),
+}
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return six.text_type(value)
+
+
+class _Echo(object):
+    """ File-like object handing back what the csv writer writes
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(_Echo())
+    if six.PY2:
+        encode = lambda values: [_text(value).encode('utf-8') for value in values]
+        yield writer.writerow(encode(columns))
+        for row in rows:
+            yield writer.writerow(encode(row))
+    else:
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow([_text(value) for value in row])
+
+def ndjson_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson; charset=utf-8'),
+}
+
+
+def export(dataset, fmt, owner=None, chunk_size=CHUNK_SIZE):
+    """ Lines of the dataset in the format, generated chunk by chunk as they
+    are consumed. With an owner only their restaurants and bookings are
+    exported.
+    """
+    columns, rows, queryset, owner_filter = DATASETS[dataset]
+    queryset = queryset.all()
+    if owner is not None:
+        queryset = queryset.filter(**{owner_filter: owner})
+    lines, _ = FORMATS[fmt]
+    return lines(columns, rows(queryset, chunk_size))
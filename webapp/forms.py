@@ -1,27 +1,68 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import re
+
 from django.template.loader import render_to_string
-from django.forms import ModelForm, SelectMultiple, ModelMultipleChoiceField
-from django.forms import CharField, EmailField
+from django.urls import reverse
+from django.forms import ModelForm, SelectMultiple, ModelMultipleChoiceField, HiddenInput
+from django.forms import CharField, EmailField, IntegerField, ValidationError
+from django.core.validators import RegexValidator
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.utils import six
 
 from .models import Restaurant, Type, Cuisine, Food, Booking
+from .taxonomy import CachedChoices, inline_limit
+
+ID_RE = re.compile(r'^[0-9]+$')
+
+_popups = {}
+
+def popup_link(name):
+    # Only depends on the field name, rendered once per process
+    if name not in _popups:
+        _popups[name] = render_to_string("webapp/popupplus.html", {'field': name})
+    return _popups[name]
 
 class MultipleSelectWithPop(SelectMultiple):
-    def render(self, name, *args, **kwargs):
-        html = super(MultipleSelectWithPop, self).render(name, *args, **kwargs)
-        popupplus = render_to_string("webapp/popupplus.html", {'field': name})
-        return html+popupplus
+    """ Select with a link adding an entry in a popup. Past
+    TAXONOMY_INLINE_CHOICES choices only the selected ones are rendered,
+    the others are looked up as the user types (see taxonomy_choices).
+    """
+    def render(self, name, value, attrs=None, renderer=None):
+        if isinstance(self.choices, CachedChoices) and len(self.choices) > inline_limit():
+            attrs = dict(attrs or {}, **{'data-choices-url': reverse('webapp:taxonomy_choices', args=(name,))})
+            selected = []
+            for pk in value or []:
+                label = self.choices.label(int(pk)) if ID_RE.match(six.text_type(pk)) else None
+                if label is not None:
+                    selected.append((pk, label))
+            self.choices = selected
+        html = super(MultipleSelectWithPop, self).render(name, value, attrs, renderer)
+        return html + popup_link(name)
+
+class TaxonomyChoiceField(ModelMultipleChoiceField):
+    """ Choices come from webapp.taxonomy's process cache instead of a query
+    per render, submitted values are still checked against the database
+    """
+    def _get_choices(self):
+        return CachedChoices(self.queryset.model)
+
+    choices = property(_get_choices, ModelMultipleChoiceField._set_choices)
 
 class RestaurantForm(ModelForm):
-    types = ModelMultipleChoiceField(Type.objects, widget=MultipleSelectWithPop) 
-    cuisines = ModelMultipleChoiceField(Cuisine.objects, widget=MultipleSelectWithPop) 
+    types = TaxonomyChoiceField(Type.objects, widget=MultipleSelectWithPop)
+    cuisines = TaxonomyChoiceField(Cuisine.objects, widget=MultipleSelectWithPop)
+    capacity = IntegerField(min_value=1, required=False, help_text='Seats per booking slot')
 
     class Meta:
         model = Restaurant
-        fields = ['name', 'description', 'state', 'city', 'street', 'longitude', 'latitude', 'telephone', 'website', 'types', 'cuisines']
+        fields = ['name', 'description', 'state', 'city', 'street', 'longitude', 'latitude', 'telephone', 'website', 'types', 'cuisines', 'capacity']
+
+    def clean_capacity(self):
+        # Left blank keeps the current (or default) capacity
+        return self.cleaned_data['capacity'] or self.instance.capacity
 
 class TypeForm(ModelForm):
     class Meta:
@@ -48,6 +89,18 @@ class SignUpForm(UserCreationForm):
         fields = ('username', 'first_name', 'last_name', 'email', 'password1', 'password2',)
 
 class BookingForm(ModelForm):
+    # Rendered with the empty form, a resubmitted form reuses it, see
+    # webapp.booking.submit_booking. Limited to the characters the
+    # booking_status URL accepts
+    idempotency_key = CharField(max_length=64, required=False, widget=HiddenInput,
+                                validators=[RegexValidator(r'^[0-9A-Za-z_-]+$')])
+
     class Meta:
         model = Booking
         fields = ['restaurant', 'booking_date', 'number_of_people', 'special_message']
+
+    def clean_number_of_people(self):
+        number_of_people = self.cleaned_data['number_of_people']
+        if number_of_people < 1:
+            raise ValidationError('Book for at least one person.')
+        return number_of_people
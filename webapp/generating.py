@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import bisect
+import datetime
+import itertools
+import random
+from array import array
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import autocomplete, booking, caching, geo, search, taxonomy
+from .models import Restaurant, Type, Cuisine, Booking, BookingSlot
+
+BATCH_SIZE = 5000
+# Generated customers cannot log in, their names stand apart from real users
+USERNAME_PREFIX = 'generated-user-'
+# (latitude, longitude, city, state, weight): restaurants cluster around
+# cities, bigger cities get more of them
+CITIES = (
+    (40.7128, -74.0060, 'New York', 'NY', 20), (34.0522, -118.2437, 'Los Angeles', 'CA', 10),
+    (41.8781, -87.6298, 'Chicago', 'IL', 7), (29.7604, -95.3698, 'Houston', 'TX', 6),
+    (37.7749, -122.4194, 'San Francisco', 'CA', 5), (47.6062, -122.3321, 'Seattle', 'WA', 3),
+    (51.5074, -0.1278, 'London', 'England', 15), (48.8566, 2.3522, 'Paris', 'Ile-de-France', 12),
+    (52.5200, 13.4050, 'Berlin', 'Berlin', 6), (40.4168, -3.7038, 'Madrid', 'Madrid', 5),
+    (41.9028, 12.4964, 'Rome', 'Lazio', 5), (52.3676, 4.9041, 'Amsterdam', 'North Holland', 3),
+    (35.6762, 139.6503, 'Tokyo', 'Tokyo', 18), (34.6937, 135.5023, 'Osaka', 'Osaka', 6),
+    (22.3193, 114.1694, 'Hong Kong', 'Hong Kong', 6), (1.3521, 103.8198, 'Singapore', 'Singapore', 4),
+    (13.7563, 100.5018, 'Bangkok', 'Bangkok', 6), (27.7172, 85.3240, 'Kathmandu', 'Bagmati', 2),
+    (19.0760, 72.8777, 'Mumbai', 'Maharashtra', 10), (-33.8688, 151.2093, 'Sydney', 'NSW', 4),
+    (-23.5505, -46.6333, 'Sao Paulo', 'SP', 8), (19.4326, -99.1332, 'Mexico City', 'CDMX', 8),
+)
+ADJECTIVES = ('Golden', 'Little', 'Royal', 'Blue', 'Old', 'Happy', 'Spicy', 'Green', 'Silver', 'Lucky',
+              'Red', 'Grand', 'Rustic', 'Urban', 'Hidden', 'Sunny', 'Wild', 'Humble', 'Crispy', 'Smoky')
+NOUNS = ('Dragon', 'Garden', 'Kitchen', 'Table', 'Spoon', 'Lantern', 'Oven', 'Harbor', 'Orchard', 'Fork',
+         'Bistro', 'Tavern', 'Corner', 'House', 'Grill', 'Noodle', 'Pepper', 'Olive', 'Lotus', 'Market')
+STREETS = ('Main', 'High', 'Park', 'Oak', 'Pine', 'Maple', 'Cedar', 'Elm', 'Lake', 'Hill', 'Church', 'Station')
+TYPES = ('Restaurant', 'Cafe', 'Bar', 'Bistro', 'Diner', 'Pub', 'Fast Food', 'Food Truck', 'Buffet',
+         'Bakery', 'Brasserie', 'Trattoria', 'Steakhouse', 'Tea House', 'Wine Bar', 'Food Court')
+CUISINES = ('Italian', 'Chinese', 'Japanese', 'Indian', 'Mexican', 'French', 'Thai', 'American',
+            'Nepali', 'Spanish', 'Greek', 'Korean', 'Vietnamese', 'Turkish', 'Lebanese', 'Ethiopian',
+            'Brazilian', 'Peruvian', 'German', 'Moroccan', 'Caribbean', 'Indonesian', 'Persian', 'Russian')
+# Relative weight of a booking at each hour of the day: lunch and dinner peaks
+HOURS = ((11, 3), (12, 10), (13, 9), (14, 3), (15, 1), (16, 1), (17, 3), (18, 7), (19, 10), (20, 9),
+         (21, 4))
+# Relative weight of each weekday, Monday first
+WEEKDAYS = (5, 5, 6, 7, 10, 10, 7)
+PARTY_SIZES = ((1, 8), (2, 40), (3, 12), (4, 22), (5, 6), (6, 7), (8, 3), (10, 2))
+
+
+class WeightedChoice(object):
+    """ Picks values in proportion to their weights in O(log n)
+    """
+
+    def __init__(self, values, weights):
+        self.values = list(values)
+        self.totals = []
+        total = 0
+        for weight in weights:
+            total += weight
+            self.totals.append(total)
+
+    def __call__(self, rng):
+        return self.values[bisect.bisect(self.totals, rng.random() * self.totals[-1])]
+
+    def sample(self, rng, count):
+        """ Up to count distinct values
+        """
+        picked = []
+        for _ in range(count * 3):
+            value = self(rng)
+            if value not in picked:
+                picked.append(value)
+                if len(picked) == count:
+                    break
+        return picked
+
+
+def zipf_weights(count, exponent=1.0):
+    """ Weight of each rank, the first entries are by far the most popular
+    """
+    return [1.0 / (rank ** exponent) for rank in range(1, count + 1)]
+
+def names(base, count):
+    """ count distinct names, the base names first then numbered variants
+    """
+    return [base[i % len(base)] + (' %d' % (i // len(base) + 1) if i >= len(base) else '')
+            for i in range(count)]
+
+
+def next_id(model):
+    return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+# Generated times fall on quarter hours, few distinct values to convert
+_adapted_times = {}
+
+
+def _adapt_datetime(value):
+    adapted = _adapted_times.get(value)
+    if adapted is None:
+        if len(_adapted_times) > 500000:
+            _adapted_times.clear()
+        adapted = _adapted_times[value] = connection.ops.adapt_datetimefield_value(value)
+    return adapted
+
+def _adapter(field):
+    """ Converts generated values of the field for the database driver, the
+    plain Python values (ints, strings, booleans, None) are passed as is
+    """
+    kind = field.get_internal_type()
+    if kind == 'DateTimeField':
+        return _adapt_datetime
+    if kind == 'DecimalField':
+        return lambda value: connection.ops.adapt_decimalfield_value(value, field.max_digits,
+                                                                      field.decimal_places)
+    return None
+
+def insert_rows(model, columns, rows):
+    """ Inserts value tuples of the model's columns with one executemany,
+    skipping the model instances and the per-object work of bulk_create.
+    Rows carry their primary key so that other rows can refer to them
+    without reading them back.
+    """
+    if not rows:
+        return
+    fields = [model._meta.get_field(column) for column in columns]
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        quote(model._meta.db_table), ', '.join(quote(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)))
+    adapters = [(i, adapter) for i, adapter in enumerate(_adapter(field) for field in fields) if adapter]
+    if adapters:
+        rows = [list(row) for row in rows]
+        for row in rows:
+            for i, adapter in adapters:
+                if row[i] is not None:
+                    row[i] = adapter(row[i])
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+def reset_sequences(models):
+    """ Moves the id sequences past the ids given explicitly (PostgreSQL,
+    Oracle; the other backends keep track by themselves)
+    """
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+class Generator(object):
+    """ Seeded synthetic data: the same options and seed give the same rows
+    on an empty database. Every table is written in batches of batch_size
+    rows, each in its own transaction.
+    """
+
+    def __init__(self, seed=0, batch_size=BATCH_SIZE, progress=None):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.progress = progress
+        self.written = {}
+        self.now = timezone.now().replace(microsecond=0)
+
+    def report(self, table, count):
+        """ Adds count rows to the total of the table, passed to progress
+        """
+        self.written[table] = self.written.get(table, 0) + count
+        if self.progress is not None:
+            self.progress(table, self.written[table])
+
+    def write(self, model, columns, rows, table=None):
+        """ Inserts the rows of an iterable batch by batch, returns how many
+        """
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                with transaction.atomic():
+                    insert_rows(model, columns, batch)
+                count += len(batch)
+                self.report(table or model._meta.db_table, len(batch))
+                del batch[:]
+        if batch:
+            with transaction.atomic():
+                insert_rows(model, columns, batch)
+            count += len(batch)
+            self.report(table or model._meta.db_table, len(batch))
+        return count
+
+    def taxonomy(self, model, base, count):
+        """ Ids of count entries of a taxonomy model and a chooser picking
+        them by Zipf popularity
+        """
+        first = next_id(model)
+        ids = list(range(first, first + count))
+        self.write(model, ('id', 'name', 'created_at', 'updated_at'),
+                   ((pk, name, self.now, self.now) for pk, name in zip(ids, names(base, count))))
+        return WeightedChoice(ids, zipf_weights(count))
+
+    def users(self, count):
+        """ Customers generated-user-<id> with unusable passwords. Returns the
+        id range.
+        """
+        first = next_id(User)
+        password = make_password(None)
+        group, _ = Group.objects.get_or_create(name='customer')
+        ids = range(first, first + count)
+        self.write(User, ('id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+                          'is_staff', 'is_active', 'date_joined'),
+                   ((pk, password, False, USERNAME_PREFIX + str(pk), '', '', '%s%d@example.com' % (USERNAME_PREFIX, pk),
+                     False, True,
+                     self.now - datetime.timedelta(days=self.rng.randint(0, 1000))) for pk in ids))
+        through = User.groups.through
+        self.write(through, ('user', 'group'), ((pk, group.pk) for pk in ids), through._meta.db_table)
+        return first, first + count
+
+    def restaurants(self, count, types, cuisines):
+        """ Restaurants scattered around the cities, with one to three types
+        and cuisines each. Returns the first id and the seat capacities.
+        """
+        rng = self.rng
+        city = WeightedChoice(CITIES, [weight for _, _, _, _, weight in CITIES])
+        first = next_id(Restaurant)
+        capacities = array('H')
+        type_links = []
+        cuisine_links = []
+
+        def rows():
+            for pk in range(first, first + count):
+                lat, lng, city_name, state, _ = city(rng)
+                # Dense centres thinning out over about ten kilometres
+                lat = max(-90.0, min(90.0, lat + rng.gauss(0, 0.05)))
+                lng = max(-180.0, min(180.0, lng + rng.gauss(0, 0.07)))
+                # Hashed from the stored values, as Restaurant.save does
+                latitude, longitude = Decimal('%.6f' % lat), Decimal('%.6f' % lng)
+                capacity = rng.choice((20, 30, 40, 40, 50, 60, 80, 120))
+                capacities.append(capacity)
+                kind = types.sample(rng, rng.randint(1, 2))
+                food = cuisines.sample(rng, rng.choice((1, 1, 2, 3)))
+                type_links.extend((pk, type_id) for type_id in kind)
+                cuisine_links.extend((pk, cuisine_id) for cuisine_id in food)
+                name = '%s %s' % (rng.choice(ADJECTIVES), rng.choice(NOUNS))
+                created = self.now - datetime.timedelta(minutes=rng.randint(0, 5 * 365 * 24 * 60))
+                yield (pk, name, 'Serving guests in %s since %d.' % (city_name, rng.randint(1950, 2017)),
+                       state, city_name, '%d %s Street' % (rng.randint(1, 999), rng.choice(STREETS)),
+                       longitude, latitude, '555-%07d' % pk, 'http://restaurant%d.example.com' % pk,
+                       capacity, geo.encode(float(latitude), float(longitude)),
+                       created, created)
+
+        columns = ('id', 'name', 'description', 'state', 'city', 'street', 'longitude', 'latitude',
+                   'telephone', 'website', 'capacity', 'geohash', 'created_at', 'updated_at')
+        source = rows()
+        for _ in range(0, count, self.batch_size):
+            self.write(Restaurant, columns, itertools.islice(source, self.batch_size))
+            # The through rows of the batch just written
+            for through, column, links in ((Restaurant.types.through, 'type', type_links),
+                                           (Restaurant.cuisines.through, 'cuisine', cuisine_links)):
+                self.write(through, ('restaurant', column), links, through._meta.db_table)
+                del links[:]
+        return first, capacities
+
+    def bookings(self, count, restaurants, users, days_back=730, days_ahead=60):
+        """ About count bookings spread over the restaurants by a heavy tailed
+        popularity, at lunch and dinner peaks, busier on weekends. Upcoming
+        bookings hold seats in slots the way webapp.booking takes them and
+        never overbook a slot.
+        """
+        rng = self.rng
+        first_restaurant, capacities = restaurants
+        first_user, last_user = users
+        hour = WeightedChoice([h for h, _ in HOURS], [w for _, w in HOURS])
+        party = WeightedChoice([size for size, _ in PARTY_SIZES], [w for _, w in PARTY_SIZES])
+        today = self.now.replace(hour=0, minute=0, second=0)
+        days = [today + datetime.timedelta(days=offset) for offset in range(-days_back, days_ahead + 1)]
+        day = WeightedChoice(days, [WEEKDAYS[d.weekday()] for d in days])
+        # Pareto(1.5) popularity has a mean of 3
+        share = float(count) / len(capacities) / 3
+        first_booking = next_id(Booking)
+        next_slot = [next_id(BookingSlot)]
+        slots = []
+        booking_ids = itertools.count(first_booking)
+
+        def restaurant_bookings(restaurant_id, capacity):
+            taken = {}
+            rows = []
+            for _ in range(int(share * rng.paretovariate(1.5) + rng.random())):
+                when = day(rng).replace(hour=hour(rng), minute=rng.choice((0, 15, 30, 45)))
+                seats = party(rng)
+                slot_id = None
+                if when > self.now:
+                    start = booking.slot_start(when)
+                    slot = taken.get(start)
+                    if slot is None:
+                        slot = taken[start] = [next_slot[0], 0]
+                        next_slot[0] += 1
+                    if slot[1] + seats > capacity:
+                        continue
+                    slot[1] += seats
+                    slot_id = slot[0]
+                created = min(self.now, when - datetime.timedelta(minutes=15 * rng.randint(4, 4 * 24 * 30)))
+                rows.append((next(booking_ids), 'Booking on %s' % created, restaurant_id,
+                             rng.randrange(first_user, last_user), when, seats, '', slot_id, created, created))
+            slots.extend((slot_id, restaurant_id, start, capacity, booked)
+                         for start, (slot_id, booked) in taken.items())
+            return rows
+
+        def rows():
+            for offset, capacity in enumerate(capacities):
+                for row in restaurant_bookings(first_restaurant + offset, capacity):
+                    yield row
+                if len(slots) >= self.batch_size:
+                    self.write_slots(slots)
+
+        columns = ('id', 'name', 'restaurant', 'user', 'booking_date', 'number_of_people', 'special_message',
+                   'slot', 'created_at', 'updated_at')
+        # Slots are written before the bookings of their batch refer to them
+        written = 0
+        source = rows()
+        while True:
+            batch = list(itertools.islice(source, self.batch_size))
+            self.write_slots(slots)
+            if not batch:
+                return written
+            written += self.write(Booking, columns, batch, 'webapp_booking')
+
+    def write_slots(self, slots):
+        self.write(BookingSlot, ('id', 'restaurant', 'start', 'capacity', 'booked'), slots)
+        del slots[:]
+
+
+def generate(restaurants, users, bookings, types=len(TYPES), cuisines=len(CUISINES), seed=0,
+             batch_size=BATCH_SIZE, index=True, progress=None):
+    """ Adds generated taxonomy, customers, restaurants and bookings to the
+    database. Returns {table: rows written}.
+
+    Rows are inserted without model signals, so the search index is built
+    for the new restaurants here (unless index is False, then run
+    rebuild_search_index later) and the caches depending on restaurants
+    are invalidated.
+    """
+    generator = Generator(seed, batch_size, progress)
+    counts = {}
+    try:
+        type_choice = generator.taxonomy(Type, TYPES, types)
+        cuisine_choice = generator.taxonomy(Cuisine, CUISINES, cuisines)
+        user_ids = generator.users(users)
+        first, capacities = generator.restaurants(restaurants, type_choice, cuisine_choice)
+        counts.update(types=types, cuisines=cuisines, users=users, restaurants=restaurants)
+        counts['bookings'] = (generator.bookings(bookings, (first, capacities), user_ids)
+                              if users and restaurants else 0)
+        if index:
+            ids = range(first, first + restaurants)
+            for start in range(0, restaurants, batch_size):
+                with transaction.atomic():
+                    search.reindex(ids[start:start + batch_size])
+                generator.report('search index', len(ids[start:start + batch_size]))
+    finally:
+        reset_sequences([Type, Cuisine, User, Restaurant, BookingSlot, Booking])
+        for namespace in (search.CACHE_NAMESPACE, caching.RESTAURANTS_NAMESPACE,
+                          autocomplete.CACHE_NAMESPACE, taxonomy.CACHE_NAMESPACE):
+            caching.bump_version(namespace)
+    return counts
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+MAX_PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+
+def encode(latitude, longitude, precision=MAX_PRECISION):
+    """ Geohash of the point, nearby points share a common prefix
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value, interval = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+def cell_size(precision):
+    """ (latitude, longitude) span in degrees of a cell at the precision
+    """
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+def precision_for_radius(latitude, radius_km):
+    """ Longest precision whose cells are at least radius_km across, so the
+    cell of a point and its eight neighbours cover the whole circle. None if
+    even the coarsest cells are too small.
+    """
+    # Cells narrow towards the poles, measure them at the circle's edge
+    edge_latitude = min(abs(latitude) + radius_km / KM_PER_DEGREE, 90.0)
+    lng_scale = max(math.cos(math.radians(edge_latitude)), 1e-6)
+    for precision in range(MAX_PRECISION, 0, -1):
+        lat_span, lng_span = cell_size(precision)
+        if min(lat_span * KM_PER_DEGREE, lng_span * KM_PER_DEGREE * lng_scale) >= radius_km:
+            return precision
+    return None
+
+def bounding_box(latitude, longitude, radius_km):
+    """ (south, north, [(west, east)]) in degrees, enclosing the circle.
+    Longitudes are split in two ranges across the antimeridian, and cover
+    the whole parallel when the circle reaches a pole.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    south, north = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+    # Widest at the latitude closest to the pole
+    edge = max(abs(south), abs(north))
+    if edge >= 90.0:
+        return south, north, [(-180.0, 180.0)]
+    lng_delta = lat_delta / math.cos(math.radians(edge))
+    west, east = longitude - lng_delta, longitude + lng_delta
+    if lng_delta >= 180.0:
+        return south, north, [(-180.0, 180.0)]
+    if west < -180.0:
+        return south, north, [(west + 360.0, 180.0), (-180.0, east)]
+    if east > 180.0:
+        return south, north, [(west, 180.0), (-180.0, east - 360.0)]
+    return south, north, [(west, east)]
+
+def covering_cells(latitude, longitude, precision):
+    """ Geohash of the cell containing the point and of its neighbours
+    """
+    lat_span, lng_span = cell_size(precision)
+    cells = set()
+    for i in (-1, 0, 1):
+        lat = min(max(latitude + i * lat_span, -90.0), 90.0)
+        for j in (-1, 0, 1):
+            lng = (longitude + j * lng_span + 180.0) % 360.0 - 180.0
+            cells.add(encode(lat, lng, precision))
+    return sorted(cells)
+
+def haversine(lat1, lng1, lat2, lng2):
+    """ Great circle distance in kilometres
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
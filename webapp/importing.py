@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import six, timezone
+
+from . import authz, autocomplete, caching, geo, search, taxonomy
+from .models import Restaurant, Type, Cuisine, BookingSlot
+
+FIELDS = ('name', 'description', 'state', 'city', 'street', 'longitude', 'latitude',
+          'telephone', 'website', 'capacity')
+# Rows with the same name, city and street are the same restaurant
+KEY_FIELDS = ('name', 'city', 'street')
+BATCH_SIZE = 500
+
+
+class RowError(ValueError):
+    """ Row that cannot be imported, carries its line number
+    """
+
+    def __init__(self, line, message):
+        super(RowError, self).__init__('line %d: %s' % (line, message))
+        self.line = line
+
+
+def read_csv(path):
+    """ (line, row) of a CSV file with a header line, types and cuisines are
+    separated by semicolons
+    """
+    if six.PY2:
+        with open(path, 'rb') as source:
+            for line, row in enumerate(csv.DictReader(source), 2):
+                yield line, dict((key.decode('utf-8'), (value or b'').decode('utf-8'))
+                                 for key, value in row.items() if key is not None)
+    else:
+        with io.open(path, encoding='utf-8', newline='') as source:
+            for line, row in enumerate(csv.DictReader(source), 2):
+                yield line, row
+
+def read_jsonl(path):
+    """ (line, row) of a file holding one JSON object per line, types and
+    cuisines may be lists
+    """
+    with io.open(path, encoding='utf-8') as source:
+        for line, text in enumerate(source, 1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except ValueError:
+                yield line, None
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def _names(value):
+    # None when the row has no such column: its links are left as they are
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        names = value
+    else:
+        names = (value or '').split(';')
+    return [name.strip()[:100] for name in names if name.strip()]
+
+def clean_row(line, row):
+    """ Restaurant field values, type names and cuisine names of an input row,
+    the names are None when the input has no types or cuisines column
+    """
+    if not isinstance(row, dict):
+        raise RowError(line, 'not a JSON object')
+    values = {}
+    for field in FIELDS:
+        value = row.get(field)
+        if value is None or value == '':
+            continue
+        if field in ('longitude', 'latitude', 'capacity'):
+            values[field] = value
+        else:
+            max_length = Restaurant._meta.get_field(field).max_length
+            values[field] = six.text_type(value).strip()[:max_length]
+    if not values.get('name'):
+        raise RowError(line, 'name is required')
+    try:
+        for field in ('longitude', 'latitude'):
+            values[field] = Decimal(six.text_type(values.get(field, 0))).quantize(Decimal('0.000001'))
+        if 'capacity' in values:
+            values['capacity'] = int(values['capacity'])
+    except (InvalidOperation, ValueError):
+        raise RowError(line, 'longitude, latitude and capacity must be numbers')
+    if not (-90 <= values['latitude'] <= 90 and -180 <= values['longitude'] <= 180):
+        raise RowError(line, 'latitude or longitude out of range')
+    if values.get('capacity', 1) < 1:
+        raise RowError(line, 'capacity must be at least 1')
+    values['geohash'] = geo.encode(float(values['latitude']), float(values['longitude']))
+    return values, _names(row.get('types')), _names(row.get('cuisines'))
+
+def _taxonomy_ids(model, names):
+    """ Ids of the named entries, creating the missing ones
+    """
+    ids = dict(model.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        model.objects.bulk_create(model(name=name) for name in missing)
+        ids.update(model.objects.filter(name__in=missing).values_list('name', 'id'))
+    return ids
+
+def _existing(keys):
+    """ {key: stored field values} of the restaurants matching the keys
+    """
+    existing = {}
+    names, cities, streets = [set(column) for column in zip(*keys)]
+    rows = (Restaurant.objects.filter(name__in=names, city__in=cities, street__in=streets)
+            .order_by('id').values('id', 'geohash', *FIELDS))
+    keys = set(keys)
+    for row in rows:
+        key = tuple(row[field] for field in KEY_FIELDS)
+        if key in keys:
+            existing.setdefault(key, row)
+    return existing
+
+def _link(through, column, links):
+    """ Makes the through table rows of the restaurants in links, a dict of
+    restaurant id to the set of ids to link it to, match it. Returns the ids
+    of the restaurants whose links changed.
+    """
+    current = dict((restaurant_id, set()) for restaurant_id in links)
+    for restaurant_id, pk in (through.objects.filter(restaurant_id__in=list(links))
+                              .values_list('restaurant_id', column)):
+        current[restaurant_id].add(pk)
+    changed = [restaurant_id for restaurant_id, ids in links.items() if ids != current[restaurant_id]]
+    through.objects.filter(restaurant_id__in=changed).delete()
+    through.objects.bulk_create(through(**{'restaurant_id': restaurant_id, column: pk})
+                                for restaurant_id in changed for pk in links[restaurant_id])
+    return changed
+
+def import_batch(rows, owner=None):
+    """ Upserts a batch of cleaned rows in one transaction: restaurants are
+    matched on name, city and street, new ones are bulk inserted, types,
+    cuisines and owner links are written straight into the through tables.
+    Rows matching what is stored are not written again. Returns the ids of
+    the restaurants imported.
+
+    Bulk writes send no model signals, the search index is updated here and
+    the caches depending on restaurants are invalidated by import_rows.
+    """
+    # The last row for a restaurant wins
+    rows = list(dict((tuple(values.get(field, '') for field in KEY_FIELDS), (values, types, cuisines))
+                     for values, types, cuisines in rows).items())
+    now = timezone.now()
+    with transaction.atomic():
+        type_ids = _taxonomy_ids(Type, set(name for _, (_, types, _) in rows for name in types or ()))
+        cuisine_ids = _taxonomy_ids(Cuisine, set(name for _, (_, _, cuisines) in rows for name in cuisines or ()))
+        existing = _existing([key for key, _ in rows])
+        new = []
+        new_keys = set()
+        changed = set()
+        for key, (values, _, _) in rows:
+            stored = existing.get(key)
+            if stored is None:
+                new.append(Restaurant(**values))
+                new_keys.add(key)
+            elif any(stored[field] != value for field, value in values.items()):
+                changed.add(stored['id'])
+                Restaurant.objects.filter(pk=stored['id']).update(updated_at=now, **values)
+                if values.get('capacity', stored['capacity']) != stored['capacity']:
+                    # As webapp.signals does for saved restaurants
+                    (BookingSlot.objects.filter(restaurant_id=stored['id'], start__gte=now)
+                     .exclude(capacity=values['capacity']).update(capacity=values['capacity']))
+        if new:
+            # Only PostgreSQL hands back the ids of bulk inserted rows
+            Restaurant.objects.bulk_create(new)
+            existing = _existing([key for key, _ in rows])
+        ids = dict((key, row['id']) for key, row in existing.items())
+        changed.update(_link(Restaurant.types.through, 'type_id',
+                             dict((ids[key], set(type_ids[name] for name in types))
+                                  for key, (_, types, _) in rows if types is not None)))
+        changed.update(_link(Restaurant.cuisines.through, 'cuisine_id',
+                             dict((ids[key], set(cuisine_ids[name] for name in cuisines))
+                                  for key, (_, _, cuisines) in rows if cuisines is not None)))
+        if owner is not None:
+            through = Restaurant.users.through
+            linked = set(through.objects.filter(user_id=owner.pk, restaurant_id__in=list(ids.values()))
+                         .values_list('restaurant_id', flat=True))
+            through.objects.bulk_create(through(restaurant_id=pk, user_id=owner.pk)
+                                        for pk in set(ids.values()) - linked)
+        search.reindex(changed | set(ids[key] for key in new_keys))
+    return list(ids.values())
+
+def import_rows(rows, batch_size=BATCH_SIZE, owner=None, errors=None, progress=None):
+    """ Imports (line, row) pairs batch by batch, holding one batch in memory
+    at a time. Rows that cannot be imported are passed to errors, progress
+    is called with the number of rows imported after each batch. Returns
+    the number of rows imported.
+    """
+    imported = 0
+    batch = []
+
+    def flush():
+        import_batch(batch, owner)
+        del batch[:]
+        if progress is not None:
+            progress(imported)
+
+    try:
+        for line, row in rows:
+            try:
+                batch.append(clean_row(line, row))
+            except RowError as e:
+                if errors is not None:
+                    errors(e)
+                continue
+            imported += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    finally:
+        if imported:
+            for namespace in (search.CACHE_NAMESPACE, caching.RESTAURANTS_NAMESPACE,
+                              autocomplete.CACHE_NAMESPACE, taxonomy.CACHE_NAMESPACE):
+                caching.bump_version(namespace)
+            if owner is not None:
+                authz.forget_user(owner.pk)
+    return imported
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from webapp import booking
+
+
+class Command(BaseCommand):
+    help = 'Moves bookings older than the archive horizon out of the booking table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'BOOKING_ARCHIVE_DAYS', 365),
+                            help='Archive bookings dated more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of bookings moved per transaction')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        count = booking.archive_bookings(before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Archived %d bookings dated before %s' % (count, before.date())))
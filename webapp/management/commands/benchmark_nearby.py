@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import bisect
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from webapp import geo
+from webapp.search import nearby_restaurants
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the geohash cell lookup behind the nearby endpoint against '
+            'computing the distance to every restaurant')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=1000000,
+                            help='Number of synthetic restaurants (in-memory mode)')
+        parser.add_argument('--queries', type=int, default=200,
+                            help='Number of nearby lookups timed')
+        parser.add_argument('--scan-queries', type=int, default=3,
+                            help='Number of full scans timed, they are slow')
+        parser.add_argument('--radius', type=float, default=5.0, help='Search radius in km')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--database', action='store_true',
+                            help='Time webapp.search.nearby_restaurants against the configured '
+                                 'database instead of synthetic in-memory data')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # Restaurants cluster around cities, so do the synthetic ones
+        cities = [(rng.uniform(-60, 70), rng.uniform(-180, 180)) for _ in range(500)]
+
+        def random_point():
+            lat, lng = rng.choice(cities)
+            return lat + rng.gauss(0, 0.2), lng + rng.gauss(0, 0.2)
+
+        centers = [random_point() for _ in range(options['queries'])]
+        radius = options['radius']
+
+        if options['database']:
+            self.report('database cell lookup', self.time_queries(
+                lambda lat, lng: len(nearby_restaurants(lat, lng, radius)), centers))
+            return
+
+        count = options['restaurants']
+        self.stdout.write('Generating %d restaurants...' % count)
+        points = [random_point() for _ in range(count)]
+        # Sorted geohashes stand in for the B-tree index on Restaurant.geohash
+        index = sorted((geo.encode(lat, lng), i) for i, (lat, lng) in enumerate(points))
+        hashes = [entry[0] for entry in index]
+
+        def full_scan(lat, lng):
+            return sum(1 for p_lat, p_lng in points if geo.haversine(lat, lng, p_lat, p_lng) <= radius)
+
+        def cell_lookup(lat, lng):
+            precision = geo.precision_for_radius(lat, radius)
+            if precision is None:
+                return full_scan(lat, lng)
+            found = 0
+            for cell in geo.covering_cells(lat, lng, precision):
+                start = bisect.bisect_left(hashes, cell)
+                end = bisect.bisect_left(hashes, cell + '~')
+                for _, i in index[start:end]:
+                    if geo.haversine(lat, lng, points[i][0], points[i][1]) <= radius:
+                        found += 1
+            return found
+
+        cell_timings = self.time_queries(cell_lookup, centers)
+        scan_timings = self.time_queries(full_scan, centers[:options['scan_queries']])
+        self.report('geohash cell lookup', cell_timings)
+        self.report('full haversine scan', scan_timings)
+        # Both approaches must find the same restaurants
+        for (lat, lng), (cell_found, _), (scan_found, _) in zip(centers, cell_timings, scan_timings):
+            if cell_found != scan_found:
+                self.stderr.write('Mismatch at %f,%f: %d vs %d' % (lat, lng, cell_found, scan_found))
+
+    def time_queries(self, lookup, centers):
+        timings = []
+        for lat, lng in centers:
+            start = time.time()
+            found = lookup(lat, lng)
+            timings.append((found, (time.time() - start) * 1000))
+        return timings
+
+    def report(self, label, timings):
+        if not timings:
+            return
+        durations = sorted(duration for _, duration in timings)
+        mean = sum(durations) / len(durations)
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        found = sum(found for found, _ in timings) / float(len(timings))
+        self.stdout.write('%-22s queries=%-5d mean=%9.3f ms  p95=%9.3f ms  results/query=%.1f'
+                          % (label, len(durations), mean, p95, found))
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import six
+
+from webapp import exporting
+
+
+class Command(BaseCommand):
+    help = 'Streams restaurants or bookings as CSV or NDJSON, a chunk of rows at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(exporting.DATASETS))
+        parser.add_argument('--format', choices=sorted(exporting.FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write, standard output by default')
+        parser.add_argument('--owner', help='Only export the restaurants (bookings) of this user')
+        parser.add_argument('--chunk-size', type=int, default=exporting.CHUNK_SIZE,
+                            help='Number of rows read per query')
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['owner']:
+            try:
+                owner = User.objects.get(username=options['owner'])
+            except User.DoesNotExist:
+                raise CommandError('No user named %s' % options['owner'])
+        lines = exporting.export(options['dataset'], options['format'], owner, options['chunk_size'])
+        if options['output']:
+            output = io.open(options['output'], 'wb')
+        else:
+            output = sys.stdout if six.PY2 else sys.stdout.buffer
+        count = -1 if options['format'] == 'csv' else 0
+        try:
+            for line in lines:
+                output.write(line.encode('utf-8') if isinstance(line, six.text_type) else line)
+                count += 1
+        finally:
+            if options['output']:
+                output.close()
+        self.stderr.write('Exported %d rows' % count)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp import generating
+
+
+class Command(BaseCommand):
+    help = ('Adds seeded synthetic restaurants, types, cuisines, customers and bookings to the '
+            'database, written with bulk inserts')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=1000, help='Number of customers')
+        parser.add_argument('--bookings', type=int, default=100000,
+                            help='Approximate number of bookings, spread over the restaurants')
+        parser.add_argument('--types', type=int, default=len(generating.TYPES))
+        parser.add_argument('--cuisines', type=int, default=len(generating.CUISINES))
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+        parser.add_argument('--batch-size', type=int, default=generating.BATCH_SIZE,
+                            help='Number of rows written per insert and transaction')
+        parser.add_argument('--no-index', action='store_false', dest='index',
+                            help='Leave the search index to a later rebuild_search_index')
+        parser.add_argument('--allow', action='store_true',
+                            help='Write to the configured database with DEBUG off')
+
+    def handle(self, *args, **options):
+        if not (settings.DEBUG or options['allow']):
+            raise CommandError('Generated data goes to the configured database, run with DEBUG on '
+                               'or pass --allow')
+        for option in ('restaurants', 'users', 'bookings'):
+            if options[option] < 0:
+                raise CommandError('--%s cannot be negative' % option)
+        for option in ('types', 'cuisines', 'batch_size'):
+            if options[option] < 1:
+                raise CommandError('--%s must be at least 1' % option.replace('_', '-'))
+        start = time.time()
+        shown = {}
+
+        def progress(table, count):
+            # One line every few seconds per table
+            now = time.time()
+            if now - shown.get(table, 0) >= 5:
+                shown[table] = now
+                self.stdout.write('%s: %d rows, %.0f s' % (table, count, now - start))
+
+        counts = generating.generate(options['restaurants'], options['users'], options['bookings'],
+                                     options['types'], options['cuisines'], options['seed'],
+                                     options['batch_size'], options['index'], progress)
+        elapsed = max(time.time() - start, 1e-6)
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS('Generated %s in %.1f s (%.0f rows/s)' % (
+            ', '.join('%d %s' % (counts[name], name) for name in
+                      ('restaurants', 'types', 'cuisines', 'users', 'bookings')),
+            elapsed, total / elapsed)))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp import importing
+
+
+class Command(BaseCommand):
+    help = ('Creates or updates restaurants, their types and cuisines from a CSV or JSON lines '
+            'file, matching restaurants on name, city and street')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header line, or JSON lines file')
+        parser.add_argument('--format', choices=sorted(importing.READERS),
+                            help='Input format, guessed from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=importing.BATCH_SIZE,
+                            help='Number of rows written per transaction')
+        parser.add_argument('--owner', help='Username of the owner of the imported restaurants')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        owner = None
+        if options['owner']:
+            try:
+                owner = User.objects.get(username=options['owner'])
+            except User.DoesNotExist:
+                raise CommandError('No user named %s' % options['owner'])
+        start = time.time()
+        skipped = [0]
+
+        def error(e):
+            skipped[0] += 1
+            self.stderr.write('Skipped %s' % e)
+
+        def progress(imported):
+            self.stdout.write('%d rows, %.0f rows/s' % (imported, imported / max(time.time() - start, 1e-6)))
+
+        try:
+            imported = importing.import_rows(importing.READERS[fmt](path), options['batch_size'],
+                                             owner, error, progress)
+        except IOError as e:
+            raise CommandError(e)
+        elapsed = max(time.time() - start, 1e-6)
+        self.stdout.write(self.style.SUCCESS('Imported %d rows in %.1f s (%.0f rows/s), skipped %d'
+                                             % (imported, elapsed, imported / elapsed, skipped[0])))
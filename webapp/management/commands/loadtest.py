@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.utils import six, timezone
+from django.utils.crypto import get_random_string
+from django.utils.six.moves import http_client, socketserver
+from django.utils.six.moves.http_cookies import SimpleCookie
+from django.utils.six.moves.urllib.parse import urlencode
+
+from webapp import importing
+from webapp.models import Restaurant
+
+CUSTOMER_PREFIX = 'loadtest-customer-'
+CSRF_RE = re.compile(r"""name=['"]csrfmiddlewaretoken['"] value=['"]([A-Za-z0-9]+)""")
+KEY_RE = re.compile(r"""name=['"]idempotency_key['"][^>]*value=['"]([0-9a-f]+)|value=['"]([0-9a-f]+)['"][^>]*name=['"]idempotency_key""")
+WORDS = ('pizza', 'sushi', 'burger', 'curry', 'noodle', 'taco', 'grill', 'bistro', 'garden', 'royal')
+CITIES = ((51.5074, -0.1278, 'London'), (48.8566, 2.3522, 'Paris'), (52.52, 13.405, 'Berlin'),
+          (40.4168, -3.7038, 'Madrid'), (41.9028, 12.4964, 'Rome'))
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpClient(object):
+    """ One browser: a connection to the server and its cookies
+    """
+
+    def __init__(self, host, port):
+        self.connection = http_client.HTTPConnection(host, port, timeout=60)
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join('%s=%s' % item for item in self.cookies.items())
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (http_client.HTTPException, IOError):
+            # The server closed a kept alive connection, retry on a new one
+            self.connection.close()
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        if six.PY2:
+            set_cookies = response.msg.getheaders('Set-Cookie')
+        else:
+            set_cookies = response.msg.get_all('Set-Cookie') or []
+        for header in set_cookies:
+            cookie = SimpleCookie()
+            cookie.load(str(header))
+            for name, morsel in cookie.items():
+                if morsel['max-age'] == '0' or morsel.value == '':
+                    self.cookies.pop(name, None)
+                else:
+                    self.cookies[name] = morsel.value
+        return response.status, content.decode('utf-8', 'replace')
+
+
+class Recorder(object):
+    """ Latencies and errors per route, shared by the client threads
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, route, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, elapsed):
+        def summary(latencies, errors):
+            latencies = sorted(latencies)
+
+            def percentile(p):
+                return round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100.0))] * 1000, 2)
+
+            return {
+                'requests': len(latencies),
+                'errors': errors,
+                'rps': round(len(latencies) / elapsed, 2),
+                'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+                'p50_ms': percentile(50),
+                'p95_ms': percentile(95),
+                'p99_ms': percentile(99),
+                'max_ms': round(latencies[-1] * 1000, 2),
+            }
+
+        routes = dict((route, summary(latencies, self.errors.get(route, 0)))
+                      for route, latencies in self.latencies.items())
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        total = summary(everything, sum(self.errors.values())) if everything else None
+        return routes, total
+
+
+class Command(BaseCommand):
+    help = ('Serves the site from a local WSGI server and drives concurrent anonymous and '
+            'logged in clients through it, reporting latency percentiles and requests per '
+            'second per route')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8, help='Number of concurrent clients')
+        parser.add_argument('--customers', type=float, default=0.25,
+                            help='Share of the clients that log in and book')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds of traffic')
+        parser.add_argument('--seed', action='store_true',
+                            help='Add generated restaurants and customers to the configured database first')
+        parser.add_argument('--restaurants', type=int, default=1000,
+                            help='Number of restaurants added by --seed')
+        parser.add_argument('--random-seed', type=int, default=42)
+        parser.add_argument('--output', help='JSON file the results are written to')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+        parser.add_argument('--allow', action='store_true',
+                            help='Run with DEBUG off: the run adds bookings and sets the passwords of '
+                                 'the load test customers in the configured database')
+
+    def handle(self, *args, **options):
+        if not (settings.DEBUG or options['allow']):
+            raise CommandError('The load test writes to the configured database, run it with DEBUG on '
+                               'or pass --allow')
+        rng = random.Random(options['random_seed'])
+        customers = int(round(options['clients'] * options['customers']))
+        if options['seed']:
+            self.seed(rng, options['restaurants'], customers)
+        restaurants = list(Restaurant.objects.values_list('id', 'latitude', 'longitude')[:10000])
+        if not restaurants:
+            raise CommandError('No restaurants to request, run with --seed')
+        usernames = [CUSTOMER_PREFIX + str(i) for i in range(customers)]
+        if User.objects.filter(username__in=usernames).count() < customers:
+            raise CommandError('Not enough load test customers, run with --seed')
+        # A password of this run only, unusable again once it is over
+        password = get_random_string(32)
+        User.objects.filter(username__in=usernames).update(password=make_password(password))
+
+        server = make_server('127.0.0.1', 0, get_wsgi_application(),
+                             server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        host, port = server.server_address[:2]
+        self.stdout.write('Serving on %s:%d, %d clients (%d customers) for %.0f s'
+                          % (host, port, options['clients'], customers, options['duration']))
+
+        recorder = Recorder()
+        deadline = time.time() + options['duration']
+        threads = []
+        for i in range(options['clients']):
+            username = usernames[i] if i < customers else None
+            thread = threading.Thread(target=self.run_client, args=(
+                HttpClient(host, port), recorder, deadline, random.Random(rng.random()), restaurants,
+                username, password))
+            thread.daemon = True
+            threads.append(thread)
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        server.shutdown()
+        User.objects.filter(username__in=usernames).update(password=make_password(None))
+
+        routes, total = recorder.report(elapsed)
+        result = {
+            'started': timezone.now().isoformat(),
+            'duration': round(elapsed, 2),
+            'clients': options['clients'],
+            'customers': customers,
+            'restaurants': Restaurant.objects.count(),
+            'routes': routes,
+            'total': total,
+        }
+        self.print_report(result, self.load(options['compare']) if options['compare'] else None)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(result, output, indent=2, sort_keys=True)
+
+    def seed(self, rng, count, customers):
+        def rows():
+            for i in range(count):
+                lat, lng, city = rng.choice(CITIES)
+                name = '%s %s %d' % (rng.choice(WORDS).title(), rng.choice(WORDS).title(), i)
+                yield i, {'name': name, 'city': city, 'street': 'Load test street %d' % i,
+                          'state': city, 'description': ' '.join(rng.sample(WORDS, 4)),
+                          'latitude': lat + rng.gauss(0, 0.05), 'longitude': lng + rng.gauss(0, 0.05),
+                          'telephone': '555-%04d' % i, 'website': 'http://example.com/%d' % i,
+                          'types': rng.choice(WORDS), 'cuisines': rng.choice(WORDS)}
+
+        importing.import_rows(rows())
+        group, _ = Group.objects.get_or_create(name='customer')
+        for i in range(customers):
+            user, created = User.objects.get_or_create(username=CUSTOMER_PREFIX + str(i))
+            if created:
+                # Given a password of the run's own while it lasts
+                user.set_unusable_password()
+                user.save()
+                user.groups.add(group)
+        self.stdout.write('Seeded %d restaurants and %d customers' % (count, customers))
+
+    def run_client(self, client, recorder, deadline, rng, restaurants, username, password):
+        def call(route, method, path, data=None, expect=(200,)):
+            start = time.time()
+            try:
+                status, content = client.request(method, path, data)
+            except Exception:
+                recorder.record(route, time.time() - start, False)
+                return None
+            recorder.record(route, time.time() - start, status in expect)
+            return content
+
+        def post_form(route, path, data, page):
+            token = CSRF_RE.search(page or '')
+            if token:
+                data['csrfmiddlewaretoken'] = token.group(1)
+            return call(route, 'POST', path, data, expect=(200, 302))
+
+        if username:
+            page = call('login', 'GET', '/login/')
+            post_form('login', '/login/', {'username': username, 'password': password}, page)
+
+        while time.time() < deadline:
+            restaurant_id, lat, lng = rng.choice(restaurants)
+            call('webapp:index', 'GET', '/restaurant/')
+            call('webapp:detail', 'GET', '/restaurant/%d/' % restaurant_id)
+            call('webapp:search_listing', 'GET', '/restaurant/search/%s/' % rng.choice(WORDS))
+            call('webapp:autocomplete', 'GET', '/restaurant/autocomplete/?q=%s' % rng.choice(WORDS)[:2])
+            call('webapp:nearby', 'GET', '/restaurant/nearby/?lat=%s&lng=%s' % (lat, lng))
+            call('webapp:availability', 'GET', '/restaurant/%d/availability/' % restaurant_id)
+            if username:
+                call('webapp:profile', 'GET', '/user/profile/')
+                page = call('webapp:booking_create', 'GET', '/restaurant/%d/booking/' % restaurant_id)
+                key = KEY_RE.search(page or '')
+                when = timezone.now() + datetime.timedelta(days=rng.randint(1, 30))
+                when = when.replace(hour=rng.choice((12, 13, 19, 20)), minute=0, second=0, microsecond=0)
+                post_form('webapp:booking_create (POST)', '/restaurant/%d/booking/' % restaurant_id, {
+                    'restaurant': restaurant_id, 'number_of_people': rng.randint(1, 4),
+                    'booking_date': when.strftime('%Y-%m-%d %H:%M:%S'), 'next': '/user/profile/',
+                    'idempotency_key': (key.group(1) or key.group(2)) if key else uuid.uuid4().hex,
+                }, page)
+
+    def load(self, path):
+        try:
+            with open(path) as previous:
+                return json.load(previous)
+        except (IOError, ValueError) as e:
+            raise CommandError('Cannot read %s: %s' % (path, e))
+
+    def print_report(self, result, previous=None):
+        self.stdout.write('%-32s %8s %7s %8s %9s %9s %9s' % ('route', 'requests', 'errors', 'rps',
+                                                            'p50 ms', 'p95 ms', 'p99 ms'))
+        rows = sorted(result['routes'].items())
+        if result['total']:
+            rows.append(('total', result['total']))
+        for route, stats in rows:
+            line = '%-32s %8d %7d %8.1f %9.1f %9.1f %9.1f' % (
+                route, stats['requests'], stats['errors'], stats['rps'],
+                stats['p50_ms'], stats['p95_ms'], stats['p99_ms'])
+            if previous is not None:
+                before = previous['routes'].get(route) if route != 'total' else previous.get('total')
+                if before:
+                    line += '   p95 %+.1f%%  rps %+.1f%%' % (
+                        (stats['p95_ms'] - before['p95_ms']) * 100.0 / max(before['p95_ms'], 0.01),
+                        (stats['rps'] - before['rps']) * 100.0 / max(before['rps'], 0.01))
+            self.stdout.write(line)
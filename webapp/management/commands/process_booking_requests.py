@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from webapp import booking, metrics
+
+
+class Command(BaseCommand):
+    help = ('Places the bookings queued by the booking form when BOOKING_QUEUE is set, '
+            'several workers can run side by side')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of requests processed between idle checks')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue and exit instead of waiting for more')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = booking.process_pending(batch_size=options['batch_size'])
+            total += processed
+            metrics.maybe_flush()
+            if processed:
+                self.stdout.write('Processed %d booking requests' % processed)
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
+                # Reconnects if the connection went stale while idle
+                close_old_connections()
+        self.stdout.write(self.style.SUCCESS('Processed %d booking requests in total' % total))
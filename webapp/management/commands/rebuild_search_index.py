@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from webapp import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the restaurant search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=search.INDEX_BATCH_SIZE,
+                            help='Number of restaurants indexed per transaction')
+
+    def handle(self, *args, **options):
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Indexed %d restaurants' % count))
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import atexit
+import bisect
+import errno
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from django.conf import settings
+from django.utils import six
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Values of one process: its pid, then a token telling it apart from an
+# earlier process that had the same pid
+FILE_PATTERN = 'metrics-%d-%s.json'
+FILE_GLOB = 'metrics-*-*.json'
+# Totals of the processes that exited, and the lock taken to update them
+ARCHIVE_NAME = 'archive.json'
+LOCK_NAME = 'archive.lock'
+REGISTRY = []
+_lock = threading.Lock()
+# Process the values were counted in and when they were last written out
+_state = {'pid': os.getpid(), 'token': uuid.uuid4().hex[:12], 'flushed': 0.0}
+
+
+def _reset_after_fork():
+    # A forked worker starts from zero, not from its parent's values
+    if _state['pid'] != os.getpid():
+        for metric in REGISTRY:
+            metric.values.clear()
+        _state.update(pid=os.getpid(), token=uuid.uuid4().hex[:12], flushed=0.0)
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in zip(names, values))
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else '%d' % value
+
+
+class Metric(object):
+    """ Values of a metric in this process, one per combination of label
+    values
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        return tuple(six.text_type(labels[name]) for name in self.labels)
+
+    def update(self, labels, change):
+        key = self.key(labels)
+        with _lock:
+            _reset_after_fork()
+            self.values[key] = change(self.values.get(key))
+
+    def render(self, values):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.kind)]
+        for key in sorted(values):
+            lines.extend(self.samples(key, values[key]))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self.update(labels, lambda value: (value or 0) + amount)
+
+    def merge(self, value, other):
+        return value + other
+
+    def samples(self, key, value):
+        yield '%s%s %s' % (self.name, _labels(self.labels, key), _number(value))
+
+
+class Histogram(Metric):
+    """ Counts of observations per bucket upper bound, with their sum
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=()):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, amount, **labels):
+        index = bisect.bisect_left(self.buckets, amount)
+
+        def change(value):
+            # Observations per bucket (the last one unbounded), then their sum
+            value = value or [0] * (len(self.buckets) + 1) + [0]
+            value[index] += 1
+            value[-1] += amount
+            return value
+        self.update(labels, change)
+
+    def merge(self, value, other):
+        return [a + b for a, b in zip(value, other)]
+
+    def samples(self, key, value):
+        labels = self.labels + ('le',)
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value):
+            total += count
+            yield '%s_bucket%s %d' % (self.name, _labels(labels, key + (_number(bound),)), total)
+        yield '%s_sum%s %s' % (self.name, _labels(self.labels, key), _number(value[-1]))
+        yield '%s_count%s %d' % (self.name, _labels(self.labels, key), total)
+
+
+REQUEST_SECONDS = Histogram('rhub_http_request_duration_seconds', 'Time to serve a request per URL name.',
+                            ('view', 'method'),
+                            (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUESTS = Counter('rhub_http_requests_total', 'Requests served per URL name and status.',
+                   ('view', 'method', 'status'))
+REQUEST_QUERIES = Histogram('rhub_db_queries_per_request', 'Database queries run by a request per URL name.',
+                            ('view',), (0, 1, 2, 5, 10, 20, 50, 100))
+BOOKINGS = Counter('rhub_bookings_total', 'Bookings created, updated and deleted, and attempts refused '
+                   'for lack of seats.', ('action', 'outcome'))
+CACHE_LOOKUPS = Counter('rhub_cache_lookups_total', 'Cache lookups per cache, hits and misses.',
+                        ('cache', 'result'))
+
+
+def cache_lookup(name, hit):
+    CACHE_LOOKUPS.inc(cache=name, result='hit' if hit else 'miss')
+
+def observe_request(view, method, status, seconds, queries):
+    view = view or 'unmatched'
+    REQUEST_SECONDS.observe(seconds, view=view, method=method)
+    REQUESTS.inc(view=view, method=method, status=status)
+    REQUEST_QUERIES.observe(queries, view=view)
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', '')
+
+def snapshot():
+    """ {metric name: [(label values, value)]} counted in this process
+    """
+    with _lock:
+        _reset_after_fork()
+        return dict((metric.name, [(list(key), list(value) if isinstance(value, list) else value)
+                                   for key, value in metric.values.items()])
+                    for metric in REGISTRY)
+
+def process_file(directory):
+    return os.path.join(directory, FILE_PATTERN % (_state['pid'], _state['token']))
+
+def flush():
+    """ Writes this process' values to its file in METRICS_DIR, replacing
+    the previous ones in one rename so readers never see half a file
+    """
+    directory = metrics_dir()
+    if not directory:
+        return
+    values = snapshot()
+    handle, path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+    with os.fdopen(handle, 'w') as output:
+        json.dump(values, output)
+    os.rename(path, process_file(directory))
+    _state['flushed'] = time.time()
+
+def maybe_flush():
+    """ Flushes at most every METRICS_FLUSH_SECONDS, called after each request
+    """
+    if metrics_dir() and time.time() - _state['flushed'] >= getattr(settings, 'METRICS_FLUSH_SECONDS', 1):
+        flush()
+
+atexit.register(flush)
+
+def clear(directory=None):
+    """ Removes the files of an earlier server from METRICS_DIR, called by
+    the gunicorn on_starting hook (gunicorn.conf.py)
+    """
+    directory = directory or metrics_dir()
+    if not directory or not os.path.isdir(directory):
+        return
+    for pattern in (FILE_GLOB, '.metrics-*', ARCHIVE_NAME):
+        for path in glob.glob(os.path.join(directory, pattern)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        # Running under another user
+        return error.errno == errno.EPERM
+    return True
+
+def _load(path):
+    try:
+        with open(path) as source:
+            return json.load(source)
+    except (IOError, ValueError):
+        # Removed meanwhile
+        return None
+
+def _add(merged, values):
+    """ Adds {metric name: [(label values, value)]} to merged, {metric name:
+    {label values: value}}
+    """
+    metrics = dict((metric.name, metric) for metric in REGISTRY)
+    for name, rows in values.items():
+        if name not in metrics:
+            continue
+        for key, value in rows:
+            key = tuple(key)
+            current = merged[name].get(key)
+            merged[name][key] = value if current is None else metrics[name].merge(current, value)
+
+def _archive(directory):
+    """ Adds the files of exited processes to the archive and removes them,
+    so that their totals keep counting without their files piling up.
+    Returns the archived values. The archive lists the files it took in
+    until they are gone: a file is never added twice, even when removing
+    it failed.
+    """
+    archive = _load(os.path.join(directory, ARCHIVE_NAME)) or {'merged': [], 'values': {}}
+    present = set(os.listdir(directory))
+    merged = [name for name in archive['merged'] if name in present]
+    exited = []
+    for path in glob.glob(os.path.join(directory, FILE_GLOB)):
+        name = os.path.basename(path)
+        if name not in merged and not _alive(int(name.split('-')[1])):
+            exited.append(name)
+    if exited:
+        totals = dict((metric.name, {}) for metric in REGISTRY)
+        _add(totals, archive['values'])
+        for name in exited:
+            _add(totals, _load(os.path.join(directory, name)) or {})
+        archive = {'merged': merged + exited,
+                   'values': dict((name, [(list(key), value) for key, value in rows.items()])
+                                  for name, rows in totals.items())}
+        handle, path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        with os.fdopen(handle, 'w') as output:
+            json.dump(archive, output)
+        os.rename(path, os.path.join(directory, ARCHIVE_NAME))
+    for name in merged + exited:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+    return archive['values']
+
+def collect():
+    """ Values of every process: this one's current values added to those
+    the other processes (gunicorn workers, the booking worker) last wrote to
+    METRICS_DIR and to the archive of the exited ones, under a lock so that
+    concurrent scrapes archive each file once
+    """
+    merged = dict((metric.name, {}) for metric in REGISTRY)
+    _add(merged, snapshot())
+    directory = metrics_dir()
+    if directory:
+        with open(os.path.join(directory, LOCK_NAME), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            _add(merged, _archive(directory))
+            own = process_file(directory)
+            for path in glob.glob(os.path.join(directory, FILE_GLOB)):
+                if path != own:
+                    _add(merged, _load(path) or {})
+    return merged
+
+def render():
+    """ Prometheus text exposition of every metric of every process
+    """
+    merged = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(merged[metric.name]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 10:29
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Terms and weights of webapp.search when the index was added, kept here so
+# later changes to it do not change what this migration does
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 100
+BATCH_SIZE = 500
+NAME_WEIGHT = 10
+TAXONOMY_WEIGHT = 5
+CITY_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+def build_search_index(apps, schema_editor):
+    Restaurant = apps.get_model('webapp', 'Restaurant')
+    SearchTerm = apps.get_model('webapp', 'SearchTerm')
+    queryset = Restaurant.objects.order_by('pk').only('name', 'city', 'description')
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            return
+        last_pk = batch[-1].pk
+        taxonomy = dict((restaurant.pk, []) for restaurant in batch)
+        for through, name in ((Restaurant.types.through, 'type__name'),
+                              (Restaurant.cuisines.through, 'cuisine__name')):
+            for pk, value in through.objects.filter(restaurant_id__in=list(taxonomy)).values_list('restaurant_id', name):
+                taxonomy[pk].append(value)
+        entries = []
+        for restaurant in batch:
+            fields = [(restaurant.name, NAME_WEIGHT),
+                      (restaurant.city, CITY_WEIGHT),
+                      (restaurant.description, DESCRIPTION_WEIGHT)]
+            fields += [(name, TAXONOMY_WEIGHT) for name in taxonomy[restaurant.pk]]
+            terms = {}
+            for text, weight in fields:
+                for term in set(tokenize(text)):
+                    terms[term] = terms.get(term, 0) + weight
+            entries.extend(SearchTerm(restaurant_id=restaurant.pk, term=term, weight=weight)
+                           for term, weight in terms.items())
+        SearchTerm.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0004_booking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=100)),
+                ('weight', models.IntegerField()),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='webapp.Restaurant')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchterm',
+            unique_together=set([('restaurant', 'term')]),
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
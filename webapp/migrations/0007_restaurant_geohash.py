@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode(latitude, longitude, precision=12):
+    """ Geohash of the point, as webapp.geo.encode
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value, interval = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+def fill_geohash(apps, schema_editor):
+    Restaurant = apps.get_model('webapp', 'Restaurant')
+    for restaurant in Restaurant.objects.only('latitude', 'longitude').iterator():
+        Restaurant.objects.filter(pk=restaurant.pk).update(
+            geohash=encode(float(restaurant.latitude), float(restaurant.longitude)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0006_restaurant_listing_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='geohash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=12),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
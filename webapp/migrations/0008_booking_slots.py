@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 10:41
+from __future__ import unicode_literals
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def slot_start(when):
+    """ Start of the slot the time falls in, as webapp.booking.slot_start
+    """
+    length = getattr(settings, 'BOOKING_SLOT_MINUTES', 30) * 60
+    seconds = int((when - EPOCH).total_seconds())
+    return EPOCH + datetime.timedelta(seconds=seconds - seconds % length)
+
+def assign_slots(apps, schema_editor):
+    """ Upcoming bookings hold their seats from the start
+    """
+    Booking = apps.get_model('webapp', 'Booking')
+    BookingSlot = apps.get_model('webapp', 'BookingSlot')
+    slots = {}
+    for booking in Booking.objects.filter(booking_date__gte=timezone.now()).select_related('restaurant'):
+        key = (booking.restaurant_id, slot_start(booking.booking_date))
+        if key not in slots:
+            slots[key] = BookingSlot.objects.create(restaurant_id=key[0], start=key[1],
+                                                    capacity=booking.restaurant.capacity)
+        slot = slots[key]
+        slot.booked += booking.number_of_people
+        # Bookings taken before capacities existed are honoured
+        slot.capacity = max(slot.capacity, slot.booked)
+        slot.save()
+        Booking.objects.filter(pk=booking.pk).update(slot=slot)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0007_restaurant_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingSlot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(verbose_name='slot start')),
+                ('capacity', models.PositiveIntegerField()),
+                ('booked', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='capacity',
+            field=models.PositiveIntegerField(default=40, verbose_name='seat capacity'),
+        ),
+        migrations.AddField(
+            model_name='bookingslot',
+            name='restaurant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='webapp.Restaurant'),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='slot',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='webapp.BookingSlot'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookingslot',
+            unique_together=set([('restaurant', 'start')]),
+        ),
+        migrations.RunPython(assign_slots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 10:45
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('webapp', '0008_booking_slots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, verbose_name='idempotency key')),
+                ('booking_date', models.DateTimeField(verbose_name='Time to Book')),
+                ('number_of_people', models.IntegerField()),
+                ('special_message', models.TextField(blank=True, verbose_name='Special Message')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('error', models.CharField(blank=True, max_length=250)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created date')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='last modified')),
+                ('booking', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='webapp.Booking')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='webapp.Restaurant')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookingrequest',
+            unique_together=set([('user', 'key')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='bookingrequest',
+            index_together=set([('status', 'id')]),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 10:47
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('webapp', '0009_booking_requests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingArchive',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=250)),
+                ('booking_date', models.DateTimeField(verbose_name='Time to Book')),
+                ('number_of_people', models.IntegerField()),
+                ('special_message', models.TextField(blank=True, verbose_name='Special Message')),
+                ('created_at', models.DateTimeField(verbose_name='created date')),
+                ('updated_at', models.DateTimeField(verbose_name='last modified')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='archived date')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='webapp.Restaurant')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='booking',
+            index_together=set([('restaurant', 'booking_date'), ('user', 'booking_date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='bookingarchive',
+            index_together=set([('user', 'booking_date')]),
+        ),
+    ]
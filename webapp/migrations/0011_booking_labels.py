@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# The booking field labels changed in the model without a migration, this
+# records them. Labels only, no column changes (SQLite still copies the
+# table, as it does for any AlterField).
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0010_booking_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='booking_date',
+            field=models.DateTimeField(verbose_name='Time to Book'),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='special_message',
+            field=models.TextField(blank=True, verbose_name='Special Message'),
+        ),
+    ]
@@ -5,6 +5,8 @@ from django.db import models
 from django.utils.encoding import python_2_unicode_compatible
 from django.contrib.auth.models import User
 
+from . import geo
+
 # Create your models here.
 @python_2_unicode_compatible
 class Type(models.Model):
@@ -40,10 +42,35 @@ class Restaurant(models.Model):
     created_at = models.DateTimeField('created date', auto_now_add=True)
     updated_at = models.DateTimeField('last modified', auto_now=True)
     users = models.ManyToManyField(User)
+    capacity = models.PositiveIntegerField('seat capacity', default=40)
+    geohash = models.CharField(max_length=geo.MAX_PRECISION, db_index=True, editable=False)
+
+    class Meta:
+        # Ordering key of the keyset paginated listings
+        indexes = [models.Index(fields=['created_at', 'id'])]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.geohash = geo.encode(float(self.latitude), float(self.longitude))
+        super(Restaurant, self).save(*args, **kwargs)
+
+@python_2_unicode_compatible
+class SearchTerm(models.Model):
+    """ Inverted index entry: one row per distinct term of a restaurant,
+    weighted by the fields the term was found in (see webapp.search)
+    """
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=100, db_index=True)
+    weight = models.IntegerField()
+
+    class Meta:
+        unique_together = ('restaurant', 'term')
+
+    def __str__(self):
+        return self.term
+
 @python_2_unicode_compatible
 class Food(models.Model):
     name = models.CharField(max_length=100)
@@ -54,6 +81,23 @@ class Food(models.Model):
     def __str__(self):
         return self.name
 
+@python_2_unicode_compatible
+class BookingSlot(models.Model):
+    """ Seats of a restaurant for one time slot, see webapp.booking.
+    booked never exceeds capacity: seats are taken by a conditional update
+    of this row.
+    """
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='slots')
+    start = models.DateTimeField('slot start')
+    capacity = models.PositiveIntegerField()
+    booked = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('restaurant', 'start')
+
+    def __str__(self):
+        return "%s, Slot: %s (%d/%d)" % (self.restaurant_id, self.start.strftime('%Y-%m-%d %H:%M'), self.booked, self.capacity)
+
 @python_2_unicode_compatible
 class Booking(models.Model):
     name = models.CharField(max_length=250)
@@ -62,8 +106,68 @@ class Booking(models.Model):
     booking_date = models.DateTimeField('Time to Book')
     number_of_people = models.IntegerField()
     special_message = models.TextField('Special Message', blank=True)
+    slot = models.ForeignKey(BookingSlot, on_delete=models.SET_NULL, null=True, editable=False)
     created_at = models.DateTimeField('created date', auto_now_add=True)
     updated_at = models.DateTimeField('last modified', auto_now=True)
 
+    class Meta:
+        index_together = [('restaurant', 'booking_date'), ('user', 'booking_date')]
+
+    def __str__(self):
+        return self.restaurant.name + ", Time: " + self.booking_date.strftime('%Y-%m-%d %H:%M:%S')
+
+
+@python_2_unicode_compatible
+class BookingArchive(models.Model):
+    """ Booking older than BOOKING_ARCHIVE_DAYS, moved out of the Booking
+    table by the archive_bookings command. Keeps the booking's id and
+    timestamps.
+    """
+    id = models.IntegerField(primary_key=True)
+    name = models.CharField(max_length=250)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE)
+    booking_date = models.DateTimeField('Time to Book')
+    number_of_people = models.IntegerField()
+    special_message = models.TextField('Special Message', blank=True)
+    created_at = models.DateTimeField('created date')
+    updated_at = models.DateTimeField('last modified')
+    archived_at = models.DateTimeField('archived date', auto_now_add=True)
+
+    class Meta:
+        index_together = [('user', 'booking_date')]
+
+    def __str__(self):
+        return self.restaurant.name + ", Time: " + self.booking_date.strftime('%Y-%m-%d %H:%M:%S')
+
+@python_2_unicode_compatible
+class BookingRequest(models.Model):
+    """ Submitted booking form, see webapp.booking.submit_booking. A user
+    submitting the same idempotency key again gets this request's outcome
+    instead of a second booking. Pending requests are queued for the
+    process_booking_requests worker.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = ((PENDING, 'Pending'), (DONE, 'Done'), (FAILED, 'Failed'))
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField('idempotency key', max_length=64)
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE)
+    booking_date = models.DateTimeField('Time to Book')
+    number_of_people = models.IntegerField()
+    special_message = models.TextField('Special Message', blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    booking = models.ForeignKey(Booking, on_delete=models.SET_NULL, null=True, blank=True)
+    error = models.CharField(max_length=250, blank=True)
+    created_at = models.DateTimeField('created date', auto_now_add=True)
+    updated_at = models.DateTimeField('last modified', auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+        # The worker takes pending requests oldest first
+        index_together = ('status', 'id')
+
     def __str__(self):
-        return self.restaurant.name + ", Time: " + self.booking_date.strftime('%Y-%m-%d %H:%M:%S')
\ No newline at end of file
+        return "%s, Request: %s (%s)" % (self.user_id, self.key, self.status)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import binascii
+import json
+
+from django.db.models import Q
+from django.core.exceptions import ValidationError
+from django.utils.encoding import force_bytes, force_text
+from django.utils.functional import cached_property
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPaginator(object):
+    """ Pages through a queryset by seeking past the ordering key of the last
+    row shown instead of using OFFSET, so every page costs the same as the
+    first one. Cursors are opaque tokens holding that key; no COUNT query is
+    run unless `count` is asked for.
+    """
+
+    def __init__(self, object_list, per_page, ordering=('-created_at', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [f.lstrip('-') for f in self.ordering]
+
+    @cached_property
+    def count(self):
+        return self.object_list.count()
+
+    def page(self, cursor=None):
+        """ Returns the page the cursor points to, the first page for a
+        missing or malformed cursor
+        """
+        try:
+            key, backwards = self.decode_cursor(cursor) if cursor else (None, False)
+        except InvalidCursor:
+            key, backwards = None, False
+        return CursorPage(self, key, backwards)
+
+    def encode_cursor(self, obj, backwards=False):
+        key = [self._field(name).value_to_string(obj) for name in self.fields]
+        data = json.dumps({'k': key, 'b': backwards}, separators=(',', ':'))
+        return force_text(urlsafe_base64_encode(force_bytes(data)))
+
+    def decode_cursor(self, cursor):
+        try:
+            data = json.loads(force_text(urlsafe_base64_decode(cursor)))
+            if not isinstance(data['k'], list) or len(data['k']) != len(self.fields):
+                raise InvalidCursor(cursor)
+            key = [self._field(name).to_python(value) for name, value in zip(self.fields, data['k'])]
+            backwards = bool(data['b'])
+        except (binascii.Error, ValueError, TypeError, KeyError, ValidationError):
+            raise InvalidCursor(cursor)
+        # Decodable but not made by encode_cursor: every field has a value
+        if any(value is None for value in key):
+            raise InvalidCursor(cursor)
+        return key, backwards
+
+    def _field(self, name):
+        return self.object_list.model._meta.get_field(name)
+
+    def _seek(self, key, backwards):
+        """ Lexicographic "comes after key" filter over the ordering fields
+        """
+        query = Q()
+        for i, ordering in enumerate(self.ordering):
+            descending = ordering.startswith('-') != backwards
+            lookup = '%s__%s' % (self.fields[i], 'lt' if descending else 'gt')
+            equal = dict(zip(self.fields[:i], key[:i]))
+            equal[lookup] = key[i]
+            query |= Q(**equal)
+        return query
+
+    def fetch(self, key, backwards):
+        ordering = self.ordering
+        if backwards:
+            ordering = [f[1:] if f.startswith('-') else '-' + f for f in ordering]
+        queryset = self.object_list.order_by(*ordering)
+        if key is not None:
+            queryset = queryset.filter(self._seek(key, backwards))
+        # One extra row tells whether there is a page beyond this one
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        return rows, more
+
+
+class CursorPage(object):
+    """ Page of a KeysetPaginator, rows are only fetched when first used so a
+    page whose rendering is cached costs no query
+    """
+
+    def __init__(self, paginator, key, backwards):
+        self.paginator = paginator
+        self.key = key
+        self.backwards = backwards
+
+    @cached_property
+    def _rows(self):
+        return self.paginator.fetch(self.key, self.backwards)
+
+    @property
+    def object_list(self):
+        return self._rows[0]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return '<CursorPage of %d>' % len(self)
+
+    def has_next(self):
+        if self.backwards:
+            return self.key is not None
+        return self._rows[1]
+
+    def has_previous(self):
+        if self.backwards:
+            return self._rows[1]
+        return self.key is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    @property
+    def next_cursor(self):
+        if self.has_next() and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous() and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0], backwards=True)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+# Most queries a request to each view may run, whatever the number of rows
+# it shows. Counted for a logged in user allowed to use the view, with the
+# caches empty: session, user and permission queries included. Checked by
+# QueryBudgetTests for every view of webapp.urls with the query_budget
+# helper of webapp.testutils, logged by RequestTimingMiddleware when a request goes over.
+BUDGETS = {
+    'webapp:index': 5,
+    'webapp:detail': 7,
+    'webapp:search': 0,
+    'webapp:search_listing': 7,
+    'webapp:nearby': 1,
+    'webapp:autocomplete': 3,
+    'webapp:restaurant_create': 6,
+    'webapp:restaurant_update': 10,
+    'webapp:type_create': 4,
+    'webapp:cuisine_create': 4,
+    'webapp:taxonomy_choices': 1,
+    'webapp:profile': 7,
+    'webapp:export': 6,
+    'webapp:booking_create': 6,
+    'webapp:availability': 2,
+    'webapp:booking_update': 7,
+    'webapp:booking_delete': 8,
+    'webapp:booking_status': 6,
+    'webapp:metrics': 0,
+}
+
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'rhub_primary'
+_local = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+def pin_primary():
+    """ Sends the reads of this thread to the primary until the request ends
+    """
+    _local.pinned = True
+
+def is_pinned():
+    return getattr(_local, 'pinned', False)
+
+@contextmanager
+def primary_reads():
+    """ Sends the reads of the block to the primary. For data cached under
+    the current version stamp: read from a lagging replica right after a
+    write, it would be stored as current.
+    """
+    pinned = is_pinned()
+    _local.pinned = True
+    try:
+        yield
+    finally:
+        _local.pinned = pinned
+
+
+class PrimaryReplicaRouter(object):
+    """ Writes go to the primary (default database), reads to a random
+    replica of DATABASE_REPLICAS. Reads follow a write to the primary for
+    the rest of the request and, through ReadYourWritesMiddleware, for
+    READ_YOUR_WRITES_SECONDS after it, so users see their own changes
+    before they have reached the replicas.
+    """
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or is_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        pin_primary()
+        _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        aliases = set(replicas()) | {DEFAULT_DB_ALIAS}
+        return obj1._state.db in aliases and obj2._state.db in aliases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReadYourWritesMiddleware(object):
+    """ Pins requests to the primary while the client holds the cookie set
+    after its last write, and for the whole of unsafe (POST...) requests
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.pinned = PIN_COOKIE in request.COOKIES or request.method not in ('GET', 'HEAD', 'OPTIONS')
+        _local.wrote = False
+        try:
+            response = self.get_response(request)
+            if _local.wrote:
+                response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'READ_YOUR_WRITES_SECONDS', 10),
+                                    httponly=True)
+        finally:
+            _local.pinned = _local.wrote = False
+        return response
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import re
+
+from django.core.cache import cache
+from django.core.paginator import Paginator, Page, EmptyPage
+from django.db import transaction
+from django.db.models import Q, Sum, Count, Value, CharField
+from django.utils.encoding import force_bytes
+
+from . import caching, geo, metrics
+from .routers import primary_reads
+from .models import Restaurant, SearchTerm
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = SearchTerm._meta.get_field('term').max_length
+INDEX_BATCH_SIZE = 500
+
+# Version namespace of the cached search pages, bumped by webapp.signals
+# whenever a change can alter a listing
+CACHE_NAMESPACE = 'search'
+CACHE_TIMEOUT = 300
+# Search text listing every restaurant, matched as given: "ALL" or " all "
+# search for the term. Normalized to a form no search text takes.
+ALL = "all"
+ALL_NORMALIZED = "*"
+
+# Terms found in several fields get the sum of the field weights, so a
+# restaurant named after the search text ranks above one mentioning it
+# in its description.
+NAME_WEIGHT = 10
+TAXONOMY_WEIGHT = 5
+CITY_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+
+def tokenize(text):
+    """ Splits text into lowercased index terms, single characters are dropped
+    """
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+def restaurant_terms(restaurant, taxonomy=None):
+    """ Returns {term: weight} for every distinct term of the restaurant,
+    taxonomy holds its type and cuisine names when already known
+    """
+    if taxonomy is None:
+        taxonomy = [t.name for t in restaurant.types.all()] + [c.name for c in restaurant.cuisines.all()]
+    fields = [(restaurant.name, NAME_WEIGHT),
+              (restaurant.city, CITY_WEIGHT),
+              (restaurant.description, DESCRIPTION_WEIGHT)]
+    fields += [(name, TAXONOMY_WEIGHT) for name in taxonomy]
+    terms = {}
+    for text, weight in fields:
+        for term in set(tokenize(text)):
+            terms[term] = terms.get(term, 0) + weight
+    return terms
+
+def taxonomy_names(restaurant_ids, restaurant_model=Restaurant):
+    """ {restaurant id: type and cuisine names}, read straight from the
+    through tables: two queries whatever the number of restaurants
+    """
+    names = dict((pk, []) for pk in restaurant_ids)
+    for through, name in ((restaurant_model.types.through, 'type__name'),
+                          (restaurant_model.cuisines.through, 'cuisine__name')):
+        for pk, value in through.objects.filter(restaurant_id__in=list(names)).values_list('restaurant_id', name):
+            names[pk].append(value)
+    return names
+
+def index_restaurants(restaurants, term_model=SearchTerm, taxonomy=None):
+    """ Replaces the index entries of the given restaurants, taxonomy maps
+    their ids to their type and cuisine names when already known
+    """
+    restaurants = list(restaurants)
+    entries = []
+    for restaurant in restaurants:
+        names = taxonomy[restaurant.pk] if taxonomy is not None else None
+        for term, weight in restaurant_terms(restaurant, names).items():
+            entries.append(term_model(restaurant_id=restaurant.pk, term=term, weight=weight))
+    with transaction.atomic():
+        term_model.objects.filter(restaurant_id__in=[r.pk for r in restaurants]).delete()
+        term_model.objects.bulk_create(entries, batch_size=INDEX_BATCH_SIZE)
+
+def _index_batch(restaurants, restaurant_model, term_model):
+    restaurants = list(restaurants)
+    index_restaurants(restaurants, term_model, taxonomy_names([r.pk for r in restaurants], restaurant_model))
+    return restaurants
+
+def reindex(restaurant_ids):
+    """ Reindexes the restaurants with the given ids, removed ids are dropped
+    from the index by the foreign key cascade
+    """
+    restaurant_ids = list(restaurant_ids)
+    queryset = Restaurant.objects.only('name', 'city', 'description')
+    for start in range(0, len(restaurant_ids), INDEX_BATCH_SIZE):
+        batch = restaurant_ids[start:start + INDEX_BATCH_SIZE]
+        _index_batch(queryset.filter(pk__in=batch), Restaurant, SearchTerm)
+
+def rebuild_index(batch_size=INDEX_BATCH_SIZE, restaurant_model=Restaurant, term_model=SearchTerm):
+    """ Drops the whole index and builds it again, returns the number of
+    restaurants indexed
+    """
+    term_model.objects.all().delete()
+    queryset = restaurant_model.objects.order_by('pk').only('name', 'city', 'description')
+    last_pk = 0
+    count = 0
+    while True:
+        batch = _index_batch(queryset.filter(pk__gt=last_pk)[:batch_size], restaurant_model, term_model)
+        if not batch:
+            return count
+        count += len(batch)
+        last_pk = batch[-1].pk
+
+def _term_match(terms, prefix=''):
+    match = Q()
+    for term in terms:
+        match |= Q(**{prefix + 'term__startswith': term})
+    return match
+
+def search_restaurants(search_text):
+    """ Restaurants having a term starting with any word of the search text,
+    best matches first. Prefix lookups on the indexed term column avoid
+    scanning the restaurant table.
+    """
+    terms = tokenize(search_text)
+    if not terms:
+        return Restaurant.objects.none()
+    return (Restaurant.objects.filter(_term_match(terms, 'search_terms__'))
+            .annotate(score=Sum('search_terms__weight')).order_by('-score', 'id'))
+
+def matching_restaurants(search_text):
+    """ Unranked restaurants matching the search text, for listings with their
+    own ordering. The id subquery avoids DISTINCT over the term join.
+    """
+    terms = tokenize(search_text)
+    if not terms:
+        return Restaurant.objects.none()
+    return Restaurant.objects.filter(pk__in=SearchTerm.objects.filter(_term_match(terms)).values('restaurant_id'))
+
+def normalize(search_text):
+    """ Canonical form of the search text, texts searching the same terms
+    share their cached pages
+    """
+    if search_text == ALL:
+        return ALL_NORMALIZED
+    return " ".join(tokenize(search_text))
+
+def filter_facets(restaurants, type_ids=(), cuisine_ids=()):
+    """ Restaurants having all the given types and cuisines
+    """
+    for type_id in type_ids:
+        restaurants = restaurants.filter(pk__in=Restaurant.types.through.objects.filter(type_id=type_id).values('restaurant_id'))
+    for cuisine_id in cuisine_ids:
+        restaurants = restaurants.filter(pk__in=Restaurant.cuisines.through.objects.filter(cuisine_id=cuisine_id).values('restaurant_id'))
+    return restaurants
+
+def facet_counts(restaurants):
+    """ Number of the restaurants having each type and cuisine, counted by a
+    single grouped query over both through tables
+    """
+    ids = restaurants.values('pk')
+    types = (Restaurant.types.through.objects.filter(restaurant_id__in=ids)
+             .values_list('type_id', 'type__name')
+             .annotate(count=Count('restaurant_id'), facet=Value('types', CharField())))
+    cuisines = (Restaurant.cuisines.through.objects.filter(restaurant_id__in=ids)
+                .values_list('cuisine_id', 'cuisine__name')
+                .annotate(count=Count('restaurant_id'), facet=Value('cuisines', CharField())))
+    facets = {'types': [], 'cuisines': []}
+    for pk, name, count, facet in types.union(cuisines, all=True):
+        facets[facet].append({'id': pk, 'name': name, 'count': count})
+    for values in facets.values():
+        values.sort(key=lambda value: (-value['count'], value['name']))
+    return facets
+
+def unordered_listing(search_text, type_ids=(), cuisine_ids=()):
+    """ Unordered restaurants listed for the normalized search text and facet
+    filters
+    """
+    if search_text == ALL_NORMALIZED:
+        restaurants = Restaurant.objects.all()
+    else:
+        restaurants = matching_restaurants(search_text)
+    return filter_facets(restaurants, type_ids, cuisine_ids)
+
+def listing(search_text, type_ids=(), cuisine_ids=()):
+    if search_text == ALL_NORMALIZED:
+        restaurants = Restaurant.objects.order_by('-created_at', '-id')
+    else:
+        restaurants = search_restaurants(search_text)
+    return filter_facets(restaurants, type_ids, cuisine_ids)
+
+def search_page(search_text, page, per_page, type_ids=(), cuisine_ids=()):
+    """ Page of the search listing with the facet counts of the whole result
+    as (page, facets). Pages are cached by normalized search text, facet
+    filters and page number as the ordered ids of the restaurants shown with
+    the version stamp they were computed at, so only the restaurants
+    themselves are loaded on a hit.
+    """
+    normalized = normalize(search_text)
+    type_ids, cuisine_ids = sorted(set(type_ids)), sorted(set(cuisine_ids))
+    try:
+        number = int(page)
+    except (TypeError, ValueError):
+        number = 1
+    query = '%s|%s|%s' % (normalized, type_ids, cuisine_ids)
+    key = 'webapp:search:%s:%d:%d' % (hashlib.md5(force_bytes(query)).hexdigest(), per_page, number)
+    version = caching.get_version(CACHE_NAMESPACE)
+    paginator = Paginator(listing(normalized, type_ids, cuisine_ids), per_page)
+    cached = cache.get(key)
+    if cached is not None and cached['version'] == version:
+        restaurants = Restaurant.objects.in_bulk(cached['ids'])
+        # Rows can vanish without a signal (raw deletes), recompute then
+        if len(restaurants) == len(cached['ids']):
+            metrics.cache_lookup('search', True)
+            paginator.count = cached['count']
+            result = Page([restaurants[pk] for pk in cached['ids']], cached['number'], paginator)
+            return result, cached['facets']
+    metrics.cache_lookup('search', False)
+    with primary_reads():
+        try:
+            result = paginator.page(number)
+        except EmptyPage:
+            result = paginator.page(paginator.num_pages)
+        facets = facet_counts(unordered_listing(normalized, type_ids, cuisine_ids))
+    cache.set(key, {'version': version,
+                    'ids': [restaurant.pk for restaurant in result.object_list],
+                    'count': paginator.count,
+                    'number': result.number,
+                    'facets': facets}, CACHE_TIMEOUT)
+    return result, facets
+
+def nearby_restaurants(latitude, longitude, radius_km, limit=None):
+    """ Restaurants within radius_km of the point as (distance, restaurant)
+    pairs, closest first. Only the rows in the geohash cells covering the
+    circle are read, the exact distance is computed for those alone. Near
+    the poles, where even the coarsest cells are too narrow, the rows in
+    the circle's bounding box are read instead.
+    """
+    precision = geo.precision_for_radius(latitude, radius_km)
+    candidates = Restaurant.objects.all()
+    if precision is not None:
+        cells = Q()
+        for cell in geo.covering_cells(latitude, longitude, precision):
+            cells |= Q(geohash__startswith=cell)
+        candidates = candidates.filter(cells)
+    else:
+        south, north, longitudes = geo.bounding_box(latitude, longitude, radius_km)
+        box = Q()
+        for west, east in longitudes:
+            box |= Q(longitude__range=(west, east))
+        candidates = candidates.filter(box, latitude__range=(south, north))
+    results = []
+    for restaurant in candidates.only('name', 'latitude', 'longitude'):
+        distance = geo.haversine(latitude, longitude, float(restaurant.latitude), float(restaurant.longitude))
+        if distance <= radius_km:
+            results.append((distance, restaurant))
+    results.sort(key=lambda result: (result[0], result[1].pk))
+    return results[:limit]
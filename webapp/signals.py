@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth.models import User, Group
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import authz, autocomplete, caching, search, taxonomy
+from .models import Restaurant, Type, Cuisine, BookingSlot
+
+
+def restaurants_changed(restaurant_ids):
+    """ Keeps the search index and the cached search pages in step with
+    the restaurants
+    """
+    search.reindex(restaurant_ids)
+    caching.bump_version(search.CACHE_NAMESPACE)
+
+@receiver(post_save, sender=Restaurant)
+def restaurant_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        restaurants_changed([instance.pk])
+        caching.bump_version(caching.RESTAURANTS_NAMESPACE)
+        # Upcoming slots follow the restaurant's capacity
+        (BookingSlot.objects.filter(restaurant=instance, start__gte=timezone.now())
+         .exclude(capacity=instance.capacity).update(capacity=instance.capacity))
+
+@receiver(post_delete, sender=Restaurant)
+def restaurant_deleted(sender, instance, **kwargs):
+    # Its index entries go with it through the foreign key cascade
+    caching.bump_version(search.CACHE_NAMESPACE)
+    caching.bump_version(caching.RESTAURANTS_NAMESPACE)
+
+@receiver(post_save, sender=Type)
+@receiver(post_save, sender=Cuisine)
+def taxonomy_saved(sender, instance, created=False, raw=False, **kwargs):
+    # A new Type or Cuisine has no restaurants yet
+    if not raw and not created:
+        restaurants_changed(instance.restaurant_set.values_list('pk', flat=True))
+
+@receiver(pre_delete, sender=Type)
+@receiver(pre_delete, sender=Cuisine)
+def collect_taxonomy_restaurants(sender, instance, **kwargs):
+    # The through rows are gone by the time post_delete is sent
+    instance._restaurant_ids = list(instance.restaurant_set.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Type)
+@receiver(post_delete, sender=Cuisine)
+def taxonomy_deleted(sender, instance, **kwargs):
+    restaurants_changed(getattr(instance, '_restaurant_ids', []))
+
+@receiver(m2m_changed, sender=Restaurant.types.through)
+@receiver(m2m_changed, sender=Restaurant.cuisines.through)
+def restaurant_taxonomy_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            restaurants_changed([instance.pk])
+    elif action == 'pre_clear':
+        instance._restaurant_ids = list(instance.restaurant_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        restaurants_changed(instance._restaurant_ids)
+    elif action in ('post_add', 'post_remove'):
+        restaurants_changed(pk_set)
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_save, sender=Type)
+@receiver(post_save, sender=Cuisine)
+def autocomplete_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.add(sender._meta.model_name, instance.pk, instance.name)
+
+@receiver(post_delete, sender=Restaurant)
+@receiver(post_delete, sender=Type)
+@receiver(post_delete, sender=Cuisine)
+def autocomplete_deleted(sender, instance, **kwargs):
+    autocomplete.remove(sender._meta.model_name, instance.pk)
+
+@receiver(post_save, sender=Type)
+@receiver(post_save, sender=Cuisine)
+@receiver(post_delete, sender=Type)
+@receiver(post_delete, sender=Cuisine)
+def taxonomy_choices_changed(sender, raw=False, **kwargs):
+    if not raw:
+        caching.bump_version(taxonomy.CACHE_NAMESPACE)
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=Restaurant.users.through)
+def authorization_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if isinstance(instance, User):
+        authz.forget_user(instance.pk)
+    elif action == 'post_clear':
+        # The users are unknown once the rows are gone
+        authz.forget_all()
+    else:
+        for user_id in pk_set:
+            authz.forget_user(user_id)
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def groups_changed(sender, **kwargs):
+    # Group names decide who is a customer
+    authz.forget_all()
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # is_active and is_superuser decide the permissions as well, logins
+    # only touch last_login
+    if not raw and not created and update_fields != frozenset(['last_login']):
+        authz.forget_user(instance.pk)
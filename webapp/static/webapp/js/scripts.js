@@ -10,4 +10,69 @@ function AddPopUp(element) {
         $('#overlay').empty().append($.parseHTML(data));
         overlay();
     });
-}
\ No newline at end of file
+}
+
+// Search box suggestions, at most one request in flight per typing pause
+$(function() {
+    let field = $('#search_field');
+    let suggestions = {};
+    let timer = null;
+    field.off('input.suggest').on('input.suggest', function() {
+        let query = field.val();
+        if (suggestions[query]) {
+            window.location = suggestions[query];
+            return;
+        }
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            $.getJSON(field.data('autocomplete-url'), {q: query}, function(data) {
+                let list = $('#search_suggestions').empty();
+                suggestions = {};
+                $.each(data.results, function(i, result) {
+                    suggestions[result.label] = result.url;
+                    list.append($('<option>').attr('value', result.label));
+                });
+            });
+        }, 150);
+    });
+});
+// Queued bookings, reload the status page once the worker has processed them
+$(function() {
+    let status = $('.booking_status[data-pending]');
+    if (!status.length) {
+        return;
+    }
+    let poll = function() {
+        $.getJSON(status.data('status-url'), function(data) {
+            if (data.status == 'pending') {
+                setTimeout(poll, 1000);
+            } else {
+                window.location.reload();
+            }
+        });
+    };
+    setTimeout(poll, 1000);
+});
+
+// Large type and cuisine selects only hold the selected options, the others
+// are fetched matching what is typed in the filter box above them
+$(function() {
+    $('select[data-choices-url]').each(function() {
+        let select = $(this);
+        let filter = $('<input type="text" placeholder="Filter...">').insertBefore(select);
+        let timer = null;
+        filter.on('input', function() {
+            clearTimeout(timer);
+            timer = setTimeout(function() {
+                $.getJSON(select.data('choices-url'), {q: filter.val()}, function(data) {
+                    select.find('option:not(:selected)').remove();
+                    $.each(data.results, function(i, result) {
+                        if (!select.find('option[value="' + result.id + '"]').length) {
+                            select.append($('<option>').attr('value', result.id).text(result.name));
+                        }
+                    });
+                });
+            }, 150);
+        });
+    });
+});
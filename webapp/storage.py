@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """ collectstatic writes every file under a name carrying a hash of its
+    content, listed in the manifest, next to gzip and brotli (with brotlipy
+    installed) variants. WhiteNoise serves hashed names with far-future
+    immutable cache headers and picks the variant the browser accepts.
+
+    Until collectstatic has written a manifest (development, tests) names
+    are served as they are; check --deploy (the release phase of the
+    Procfile) fails on a missing manifest with DEBUG off. Once it has, a
+    name missing from it is an error; the webapp.checks static check
+    catches those in templates.
+    """
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super(StaticFilesStorage, self).stored_name(name)
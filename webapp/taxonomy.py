@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+
+from django.conf import settings
+
+from . import caching, metrics
+from .routers import primary_reads
+from .models import Type, Cuisine
+
+# Version namespace shared by all processes, bumped when a Type or Cuisine
+# changes (see webapp.signals)
+CACHE_NAMESPACE = 'taxonomy'
+# Restaurant form fields and the models they choose from
+FIELDS = {'types': Type, 'cuisines': Cuisine}
+
+
+class ChoiceList(object):
+    """ (id, name) of every entry of a taxonomy model at one version
+    """
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.rows = rows
+        self.labels = dict(rows)
+
+    def search(self, text, limit=20):
+        """ Entries whose name contains the text, names starting with it first
+        """
+        text = text.lower().strip()
+        matches = [(not name.lower().startswith(text), name.lower(), pk, name)
+                   for pk, name in self.rows if text in name.lower()]
+        matches.sort()
+        return [(pk, name) for _, _, pk, name in matches[:limit]]
+
+
+_choices = {}
+_lock = threading.Lock()
+
+
+def get_choices(model):
+    """ Choices of the model held by this process, reloaded when another
+    process changed the taxonomy
+    """
+    version = caching.get_version(CACHE_NAMESPACE)
+    choices = _choices.get(model)
+    metrics.cache_lookup('taxonomy', choices is not None and choices.version == version)
+    if choices is None or choices.version != version:
+        with _lock:
+            choices = _choices.get(model)
+            if choices is None or choices.version != version:
+                with primary_reads():
+                    rows = list(model.objects.order_by('id').values_list('id', 'name'))
+                choices = _choices[model] = ChoiceList(version, rows)
+    return choices
+
+def inline_limit():
+    return getattr(settings, 'TAXONOMY_INLINE_CHOICES', 500)
+
+
+class CachedChoices(object):
+    """ Choices of a form field, resolved from the process cache when the
+    widget is rendered rather than when the form is built
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def __iter__(self):
+        return iter(get_choices(self.model).rows)
+
+    def __len__(self):
+        return len(get_choices(self.model).rows)
+
+    def label(self, pk):
+        return get_choices(self.model).labels.get(pk)
@@ -2,17 +2,80 @@
 from __future__ import unicode_literals
 
 import datetime
-
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from unittest import skipUnless
+from wsgiref.util import setup_testing_defaults
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import HttpResponse
+from django.template import engines
 from django.urls import reverse
-from django.test import TestCase
+from django.test import Client, TestCase as DjangoTestCase, TransactionTestCase, SimpleTestCase
+from django.test import RequestFactory, override_settings
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connection, connections, OperationalError
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils.encoding import force_bytes, force_text
+from django.utils.http import urlsafe_base64_encode
+from django.utils.six import StringIO
 from django.utils import timezone
+from whitenoise.django import DjangoWhiteNoise
 
 import copy
 
 from django.contrib.auth.models import User, Group
 
-from .models import Restaurant, Type, Cuisine, Food, Booking
+from .models import Restaurant, Type, Cuisine, Food, Booking, BookingSlot, BookingRequest, BookingArchive, SearchTerm
 from .views import set_permissions
+from .forms import RestaurantForm
+from . import views
+from .pagination import KeysetPaginator
+from .testutils import QueryBudgetExceeded, query_budget
+from . import authz, autocomplete, caching, checks, generating, geo, metrics, querybudget, routers, search, taxonomy, timing
+from . import booking as booking_engine
+
+
+
+class TestCase(DjangoTestCase):
+	""" Starts every test with an empty cache, cached pages and version
+	stamps must not outlive the test database rows they were built from
+	"""
+
+	def _pre_setup(self):
+		super(TestCase, self)._pre_setup()
+		cache.clear()
+
+
+class capture_logs(object):
+	""" Collects the records of a logger instead of letting them reach the
+	console handler of webapp
+	"""
+
+	def __init__(self, name):
+		self.logger = logging.getLogger(name)
+		self.records = []
+		self.handler = logging.Handler()
+		self.handler.emit = self.records.append
+
+	def __enter__(self):
+		self.propagate = self.logger.propagate
+		self.logger.propagate = False
+		self.logger.addHandler(self.handler)
+		return self.records
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.logger.removeHandler(self.handler)
+		self.logger.propagate = self.propagate
+
 
 CREDENTIIALS = {
 			'name': 'test',
@@ -117,6 +180,86 @@ class IndexViewTests(TestCase):
 								 )
 
 
+class IndexCacheTests(TestCase):
+
+	def test_anonymous_page_served_without_queries(self):
+		""" Repeated anonymous visits of the index page must not hit the database
+		"""
+		create_restaurant("Test Restaurant")
+		self.client.get(reverse('webapp:index'))
+		with self.assertNumQueries(0):
+			response = self.client.get(reverse('webapp:index'))
+		self.assertContains(response, "Test Restaurant")
+
+	def test_unread_query_parameters_share_the_cached_page(self):
+		""" Only the cursor tells cached index pages apart, other query
+		strings must not add entries
+		"""
+		create_restaurant("Test Restaurant")
+		self.client.get(reverse('webapp:index'))
+		with self.assertNumQueries(0):
+			self.client.get(reverse('webapp:index'), {'utm_source': 'mail', 'x': '1'})
+		self.client.get(reverse('webapp:index'), {'cursor': 'abc'})
+		with self.assertNumQueries(0):
+			self.client.get(reverse('webapp:index'), {'cursor': 'abc', 'x': '2'})
+
+	def test_cached_page_invalidated_by_restaurant_changes(self):
+		""" Created, updated and deleted restaurants must show on the next visit
+		"""
+		self.client.get(reverse('webapp:index'))
+		restaurant = create_restaurant("Test Restaurant")
+		self.assertContains(self.client.get(reverse('webapp:index')), "Test Restaurant")
+		restaurant.name = "Renamed Restaurant"
+		restaurant.save()
+		self.assertContains(self.client.get(reverse('webapp:index')), "Renamed Restaurant")
+		restaurant.delete()
+		self.assertContains(self.client.get(reverse('webapp:index')), "No restaurant added")
+
+	def test_cached_page_has_visitor_csrf_token(self):
+		""" Search form of a cached page must post with the visitor's own token
+		"""
+		Client().get(reverse('webapp:index'))
+		client = Client(enforce_csrf_checks=True)
+		response = client.get(reverse('webapp:index'))
+		token = re.search(r"name='csrfmiddlewaretoken' value='(\w+)'", response.content.decode()).group(1)
+		response = client.post(reverse('webapp:search'), {'search_field': 'test', 'csrfmiddlewaretoken': token})
+		self.assertEqual(response.status_code, 302)
+
+	def test_authenticated_user_not_served_cached_page(self):
+		""" Logged in users must get their own page with the user menu
+		"""
+		self.client.get(reverse('webapp:index'))
+		create_owner('Test User', 'test@example.com', 'testpwd')
+		self.client.login(username='Test User', password='testpwd')
+		self.assertContains(self.client.get(reverse('webapp:index')), "Logout")
+
+
+class RestaurantCardTests(TestCase):
+
+	def test_card_fragment_cached_until_restaurant_changes(self):
+		""" Listings must reuse the rendered card of a restaurant until its
+		updated_at changes
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		url = reverse('webapp:search_listing', args=('test',))
+		self.assertContains(self.client.get(url), "Test Restaurant")
+		# No signal, no new updated_at: the card stays as rendered
+		Restaurant.objects.filter(pk=restaurant.pk).update(name="Quietly Renamed")
+		caching.bump_version(search.CACHE_NAMESPACE)
+		response = self.client.get(url)
+		self.assertContains(response, "Test Restaurant")
+		self.assertContains(response, reverse('webapp:booking_create', args=(restaurant.id,)))
+		restaurant.refresh_from_db()
+		restaurant.save()
+		self.assertContains(self.client.get(url), "Quietly Renamed")
+		self.assertContains(self.client.get(reverse('webapp:index')), "Quietly Renamed")
+
+	def test_compiled_templates_reused(self):
+		engine = engines.all()[0].engine
+		self.assertIs(engine.get_template('webapp/restaurant_card.html'),
+					  engine.get_template('webapp/restaurant_card.html'))
+
+
 class DetailViewTests(TestCase):
 
 	def test_no_restaurant(self):
@@ -139,6 +282,356 @@ class DetailViewTests(TestCase):
 		self.assertEqual(
 			response.context['restaurant'].name, 'Test Restaurant')
 
+	def test_query_count(self):
+		""" Detail page must load the restaurant with its types and cuisines
+		in three queries however many of them it has
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		url = reverse('webapp:detail', args=(restaurant.id,))
+		with self.assertNumQueries(3):
+			self.client.get(url)
+		for i in range(5):
+			restaurant.types.create(name="Type %d" % i)
+			restaurant.cuisines.create(name="Cuisine %d" % i)
+		with self.assertNumQueries(3):
+			response = self.client.get(url)
+		self.assertContains(response, "Cuisine 4")
+
+	def test_query_count_for_owner(self):
+		""" Permission checks for the edit link must not add queries per
+		type or cuisine for logged in owners
+		"""
+		owner = create_owner('Test User', 'test@example.com', 'testpwd')
+		self.client.login(username='Test User', password='testpwd')
+		restaurant = create_restaurant("Test Restaurant")
+		restaurant.users.add(owner)
+		url = reverse('webapp:detail', args=(restaurant.id,))
+		# session, user and two permission queries come on top
+		with self.assertNumQueries(7):
+			self.client.get(url)
+		for i in range(5):
+			restaurant.types.create(name="Type %d" % i)
+		# permissions are cached since the first request
+		with self.assertNumQueries(5):
+			response = self.client.get(url)
+		self.assertContains(response, "Edit")
+
+
+class QueryBudgetTests(TestCase):
+	""" Every view of webapp.urls against N then 2N rows: the query count
+	must not grow with the rows and must stay within its budget
+	"""
+	N = 3
+
+	def setUp(self):
+		self.owner = create_owner('Test User', 'test@example.com', 'testpwd')
+		self.customer = User.objects.create_user(username='Customer', password='testpwd')
+		self.customer.groups.add(Group.objects.create(name='customer'))
+		self.restaurants = []
+
+	def populate(self, count):
+		""" Adds count restaurants with types, cuisines and bookings
+		"""
+		for i in range(count):
+			restaurant = create_restaurant('Restaurant %d' % len(self.restaurants))
+			restaurant.users.add(self.owner)
+			for j in range(2):
+				restaurant.types.create(name='Type %d.%d' % (restaurant.id, j))
+				restaurant.cuisines.create(name='Cuisine %d.%d' % (restaurant.id, j))
+			for day in (-1, 1, 2):
+				self.book(restaurant, day)
+			self.restaurants.append(restaurant)
+
+	def book(self, restaurant, day):
+		booking = Booking(user=self.customer, restaurant=restaurant, number_of_people=2,
+						  booking_date=timezone.now() + datetime.timedelta(days=day), name='Booking')
+		booking_engine.place_booking(booking)
+		return booking
+
+	def scenarios(self):
+		""" (view name, user, url) of the requests to measure
+		"""
+		restaurant = self.restaurants[0]
+		booking = Booking.objects.filter(user=self.customer).first()
+		request = BookingRequest.objects.get_or_create(
+			user=self.customer, key='budget', restaurant=restaurant, booking_date=booking.booking_date,
+			number_of_people=2, status=BookingRequest.DONE, booking=booking)[0]
+		return [
+			('webapp:index', None, reverse('webapp:index')),
+			('webapp:index', self.owner, reverse('webapp:index')),
+			('webapp:detail', self.owner, reverse('webapp:detail', args=(restaurant.id,))),
+			('webapp:search', self.owner, reverse('webapp:search')),
+			('webapp:search_listing', self.owner, reverse('webapp:search_listing', args=('restaurant',))),
+			('webapp:search_listing', self.owner,
+			 reverse('webapp:search_listing', args=('restaurant',)) + '?cursor='),
+			('webapp:nearby', self.owner, reverse('webapp:nearby') + '?lat=0&lng=0'),
+			('webapp:autocomplete', self.owner, reverse('webapp:autocomplete') + '?q=re'),
+			('webapp:restaurant_create', self.owner, reverse('webapp:restaurant_create')),
+			('webapp:restaurant_update', self.owner, reverse('webapp:restaurant_update', args=(restaurant.id,))),
+			('webapp:type_create', self.owner, reverse('webapp:type_create')),
+			('webapp:cuisine_create', self.owner, reverse('webapp:cuisine_create')),
+			('webapp:taxonomy_choices', self.owner, reverse('webapp:taxonomy_choices', args=('types',)) + '?q=t'),
+			('webapp:profile', self.owner, reverse('webapp:profile')),
+			('webapp:profile', self.customer, reverse('webapp:profile')),
+			('webapp:export', self.owner, reverse('webapp:export', args=('restaurants', 'csv'))),
+			('webapp:export', self.owner, reverse('webapp:export', args=('bookings', 'ndjson'))),
+			('webapp:booking_create', self.customer, reverse('webapp:booking_create', args=(restaurant.id,))),
+			('webapp:availability', self.customer, reverse('webapp:availability', args=(restaurant.id,))),
+			('webapp:booking_update', self.customer, reverse('webapp:booking_update', args=(booking.id,))),
+			('webapp:booking_delete', self.customer,
+			 reverse('webapp:booking_delete', args=(self.book(restaurant, 3).id,))),
+			('webapp:booking_status', self.customer, reverse('webapp:booking_status', args=(request.key,))),
+			('webapp:metrics', None, reverse('webapp:metrics')),
+		]
+
+	def measure(self):
+		""" {(view name, user, url): query count}, each request made with
+		empty caches by an already logged in client
+		"""
+		clients = {None: Client()}
+		for user in (self.owner, self.customer):
+			clients[user] = Client()
+			clients[user].force_login(user)
+		counts = {}
+		for name, user, url in self.scenarios():
+			cache.clear()
+			with query_budget(querybudget.BUDGETS[name], label=url) as queries:
+				response = clients[user].get(url)
+				if response.streaming:
+					b''.join(response.streaming_content)
+			self.assertIn(response.status_code, (200, 302), url)
+			counts[(name, user and user.username, url.split('/delete/')[0])] = len(queries)
+		return counts
+
+	def test_every_view_has_a_budget(self):
+		""" Views added to webapp.urls must get a budget and a scenario
+		"""
+		from .urls import urlpatterns
+		names = set('webapp:' + pattern.name for pattern in urlpatterns)
+		self.assertEqual(names, set(querybudget.BUDGETS))
+		self.populate(1)
+		self.assertEqual(names, set(name for name, _, _ in self.scenarios()))
+
+	def test_query_count_does_not_grow_with_rows(self):
+		self.populate(self.N)
+		counts = self.measure()
+		self.populate(self.N)
+		self.assertEqual(self.measure(), counts)
+
+	def test_budget_exceeded(self):
+		@query_budget(1)
+		def two_queries():
+			list(Restaurant.objects.all())
+			list(Type.objects.all())
+
+		with self.assertRaises(QueryBudgetExceeded):
+			two_queries()
+		with query_budget(1) as queries:
+			list(Restaurant.objects.all())
+		self.assertEqual(len(queries), 1)
+
+
+class RequestTimingTests(TestCase):
+
+	def test_server_timing_header(self):
+		""" With REQUEST_TIMING on responses must carry the query count and
+		timings in a Server-Timing header and in the timing log
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		with capture_logs('webapp.timing') as records, self.settings(REQUEST_TIMING=True):
+			response = Client().get(reverse('webapp:detail', args=(restaurant.id,)))
+		self.assertRegexpMatches(response['Server-Timing'],
+								 r'^db;desc="3 queries";dur=[0-9.]+, tpl;dur=[0-9.]+, total;dur=[0-9.]+$')
+		self.assertEqual(records[0].queries, 3)
+		self.assertEqual(records[0].view, 'webapp:detail')
+		self.assertEqual(len(records), 1)
+
+	def test_queries_counted_with_full_query_log(self):
+		""" The count must not depend on the room left in the connection's
+		query log
+		"""
+		def view(request):
+			connection.queries_log.extend([{'sql': '', 'time': '0.000'}] * connection.queries_limit)
+			list(Restaurant.objects.all())
+			list(Type.objects.all())
+			return HttpResponse()
+
+		self.addCleanup(connection.queries_log.clear)
+		with capture_logs('webapp.timing') as records, self.settings(REQUEST_TIMING=True):
+			timing.RequestTimingMiddleware(view)(RequestFactory().get('/'))
+		self.assertEqual(records[0].queries, 2)
+
+	def test_over_budget_warning(self):
+		""" Requests running more queries than their view's budget must be
+		logged as warnings
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		budgets = dict(querybudget.BUDGETS)
+		querybudget.BUDGETS['webapp:detail'] = 2
+		try:
+			with capture_logs('webapp.timing') as records, self.settings(REQUEST_TIMING=True):
+				Client().get(reverse('webapp:detail', args=(restaurant.id,)))
+		finally:
+			querybudget.BUDGETS.update(budgets)
+		self.assertEqual(records[1].levelno, logging.WARNING)
+		self.assertEqual((records[1].queries, records[1].budget), (3, 2))
+
+	def test_disabled_by_default(self):
+		""" Without REQUEST_TIMING no header must be added
+		"""
+		response = self.client.get(reverse('webapp:index'))
+		self.assertFalse(response.has_header('Server-Timing'))
+
+
+class MetricsTests(TestCase):
+
+	def setUp(self):
+		for metric in metrics.REGISTRY:
+			metric.values.clear()
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+
+	def scrape(self, **extra):
+		response = self.client.get(reverse('webapp:metrics'), **extra)
+		if response.status_code != 200:
+			return response.status_code, None
+		return response.status_code, response.content.decode('utf-8').splitlines()
+
+	def test_request_metrics(self):
+		""" With METRICS on requests must be counted per URL name, with their
+		latency and query count histograms
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		with self.settings(METRICS=True):
+			Client().get(reverse('webapp:detail', args=(restaurant.id,)))
+		_, lines = self.scrape()
+		self.assertIn('rhub_http_requests_total{view="webapp:detail",method="GET",status="200"} 1', lines)
+		self.assertIn('rhub_db_queries_per_request_bucket{view="webapp:detail",le="2"} 0', lines)
+		self.assertIn('rhub_db_queries_per_request_bucket{view="webapp:detail",le="5"} 1', lines)
+		self.assertIn('rhub_db_queries_per_request_sum{view="webapp:detail"} 3', lines)
+		self.assertIn('rhub_http_request_duration_seconds_count{view="webapp:detail",method="GET"} 1', lines)
+		self.assertIn('# TYPE rhub_http_request_duration_seconds histogram', lines)
+
+	def test_booking_and_cache_counters(self):
+		user = User.objects.create_user(username='Customer', password='testpwd')
+		restaurant = create_restaurant("Test Restaurant")
+		restaurant.capacity = 1
+		restaurant.save()
+		booking = Booking(user=user, restaurant=restaurant, number_of_people=1, booking_date=timezone.now())
+		booking_engine.place_booking(booking)
+		booking_engine.cancel_booking(booking)
+		with self.assertRaises(booking_engine.SlotFull):
+			booking_engine.place_booking(Booking(user=user, restaurant=restaurant, number_of_people=2,
+												 booking_date=timezone.now()))
+		self.client.get(reverse('webapp:index'))
+		self.client.get(reverse('webapp:index'))
+		_, lines = self.scrape()
+		self.assertIn('rhub_bookings_total{action="create",outcome="ok"} 1', lines)
+		self.assertIn('rhub_bookings_total{action="create",outcome="full"} 1', lines)
+		self.assertIn('rhub_bookings_total{action="delete",outcome="ok"} 1', lines)
+		self.assertIn('rhub_cache_lookups_total{cache="page",result="miss"} 1', lines)
+		self.assertIn('rhub_cache_lookups_total{cache="page",result="hit"} 1', lines)
+
+	@skipUnless(hasattr(os, 'fork'), 'needs fork')
+	def test_values_of_all_processes(self):
+		""" The endpoint must add up the values every worker process wrote to
+		METRICS_DIR, a forked worker counting from zero
+		"""
+		metrics.BOOKINGS.inc(action='create', outcome='ok')
+		with self.settings(METRICS_DIR=self.directory):
+			for i in range(2):
+				pid = os.fork()
+				if pid == 0:
+					try:
+						metrics.BOOKINGS.inc(action='create', outcome='ok')
+						metrics.REQUEST_SECONDS.observe(0.2, view='webapp:index', method='GET')
+						metrics.flush()
+					finally:
+						os._exit(0)
+				os.waitpid(pid, 0)
+			_, lines = self.scrape()
+			# The exited workers' files are merged into the archive, once
+			self.assertEqual(sorted(os.listdir(self.directory)), [metrics.ARCHIVE_NAME, metrics.LOCK_NAME])
+			self.assertEqual(self.scrape()[1], lines)
+		self.assertIn('rhub_bookings_total{action="create",outcome="ok"} 3', lines)
+		self.assertIn('rhub_http_request_duration_seconds_bucket{view="webapp:index",method="GET",le="0.1"} 0',
+					  lines)
+		self.assertIn('rhub_http_request_duration_seconds_bucket{view="webapp:index",method="GET",le="0.25"} 2',
+					  lines)
+
+	def test_recycled_pid_keeps_earlier_values(self):
+		""" A process given the pid of an exited one must not replace its
+		values, clear() must remove them all
+		"""
+		earlier = os.path.join(self.directory, metrics.FILE_PATTERN % (os.getpid(), 'earlier'))
+		with open(earlier, 'w') as output:
+			json.dump({metrics.BOOKINGS.name: [[['create', 'ok'], 5]]}, output)
+		metrics.BOOKINGS.inc(action='create', outcome='ok')
+		with self.settings(METRICS_DIR=self.directory):
+			metrics.flush()
+			self.assertEqual(len(os.listdir(self.directory)), 2)
+			self.assertIn('rhub_bookings_total{action="create",outcome="ok"} 6', self.scrape()[1])
+			metrics.clear()
+		self.assertEqual(os.listdir(self.directory), [metrics.LOCK_NAME])
+
+	def test_internal_only(self):
+		""" Other addresses must get a 404 unless they send the token
+		"""
+		self.assertEqual(self.scrape(REMOTE_ADDR='10.1.2.3')[0], 404)
+		with self.settings(METRICS_TOKEN='secret'):
+			self.assertEqual(self.scrape(REMOTE_ADDR='10.1.2.3', HTTP_AUTHORIZATION='Bearer wrong')[0], 404)
+			self.assertEqual(self.scrape(REMOTE_ADDR='10.1.2.3', HTTP_AUTHORIZATION='Bearer secret')[0], 200)
+
+
+class StaticFilesTests(TestCase):
+
+	def test_templates_reference_static_files_by_name(self):
+		""" The check must flag written out static URLs and names of missing
+		files, and find neither in the templates
+		"""
+		self.assertEqual(checks.static_problems(
+			'<link href="{% static \'webapp/css/style.css\' %}">\n'
+			'<script src="/static/webapp/js/scripts.js"></script>\n'
+			'<img src="{% static "webapp/images/missing.svg" %}">'), [
+			(2, '/static/webapp/js/scripts.js is not resolved by {% static %}'),
+			(3, 'static file webapp/images/missing.svg does not exist')])
+		self.assertEqual(checks.check_static_references(), [])
+
+	def test_collectstatic_writes_hashed_compressed_files(self):
+		""" collectstatic must write content hashed names with compressed
+		variants, pages must link them and WhiteNoise must serve them as
+		immutable
+		"""
+		root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, root)
+		with self.settings(STATIC_ROOT=root):
+			call_command('collectstatic', interactive=False, verbosity=0)
+			url = staticfiles_storage.url('webapp/css/style.css')
+			self.assertRegexpMatches(url, r'^/static/webapp/css/style\.[0-9a-f]{12}\.css$')
+			self.assertTrue(os.path.exists(os.path.join(root, url[len('/static/'):] + '.gz')))
+			self.assertContains(self.client.get(reverse('webapp:index')), url)
+
+			application = DjangoWhiteNoise(lambda environ, start_response: [])
+			headers = {}
+			environ = {'PATH_INFO': url, 'HTTP_ACCEPT_ENCODING': 'gzip'}
+			setup_testing_defaults(environ)
+			application(environ, lambda status, response_headers: headers.update(response_headers))
+		self.assertEqual(headers['Content-Encoding'], 'gzip')
+		self.assertIn('immutable', headers['Cache-Control'])
+
+	def test_deploy_check_requires_manifest(self):
+		""" Unhashed names are for development: without DEBUG the deploy
+		check must fail until collectstatic has written the manifest
+		"""
+		root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, root)
+		with self.settings(STATIC_ROOT=root):
+			self.assertEqual([error.id for error in checks.check_static_manifest()], ['webapp.E002'])
+			with self.settings(DEBUG=True):
+				self.assertEqual(checks.check_static_manifest(), [])
+			call_command('collectstatic', interactive=False, verbosity=0)
+			self.assertEqual(checks.check_static_manifest(), [])
+
 
 class SearchViewTests(TestCase):
     def test_search_view_with_get_request(self):
@@ -259,6 +752,655 @@ class SearchViewListingTests(TestCase):
         self.assertQuerysetEqual(response.context['search_list'], ['<Restaurant: Diner Restaurant 3>','<Restaurant: Diner Restaurant 4>'])
 
 
+class KeysetPaginationTests(TestCase):
+
+	def test_index_pages_with_cursor(self):
+		""" Next cursor of the index page must lead to the older restaurants
+		and the previous cursor of that page back to the newest ones
+		"""
+		for i in range(7):
+			create_restaurant("Test Restaurant %d" % i)
+		response = self.client.get(reverse('webapp:index'))
+		first_page = response.context['restaurant_list']
+		self.assertFalse(first_page.has_previous())
+		response = self.client.get(reverse('webapp:index') + "?cursor=" + first_page.next_cursor)
+		second_page = response.context['restaurant_list']
+		self.assertQuerysetEqual(second_page, ['<Restaurant: Test Restaurant 1>', '<Restaurant: Test Restaurant 0>'])
+		self.assertFalse(second_page.has_next())
+		response = self.client.get(reverse('webapp:index') + "?cursor=" + second_page.previous_cursor)
+		self.assertEqual([r.name for r in response.context['restaurant_list']],
+						 [r.name for r in first_page])
+		self.assertFalse(response.context['restaurant_list'].has_previous())
+
+	def test_invalid_cursor_shows_first_page(self):
+		""" Malformed cursor must fall back to the first page
+		"""
+		create_restaurant("Test Restaurant")
+		response = self.client.get(reverse('webapp:index') + "?cursor=garbage")
+		self.assertQuerysetEqual(response.context['restaurant_list'], ['<Restaurant: Test Restaurant>'])
+
+	def test_tampered_cursor_shows_first_page(self):
+		""" Cursors that decode but hold no usable key must fall back to
+		the first page on the index and the search listing
+		"""
+		create_restaurant("Test Restaurant")
+		for data in ('{"k":[null,null],"b":false}', '{"k":["x",1],"b":false}', '{"k":"ab","b":false}',
+					 '{"k":[{}, 1],"b":false}'):
+			cursor = force_text(urlsafe_base64_encode(force_bytes(data)))
+			response = self.client.get(reverse('webapp:index'), {'cursor': cursor})
+			self.assertQuerysetEqual(response.context['restaurant_list'], ['<Restaurant: Test Restaurant>'])
+			response = self.client.get(reverse('webapp:search_listing', args=("test",)), {'cursor': cursor})
+			self.assertQuerysetEqual(response.context['search_list'], ['<Restaurant: Test Restaurant>'])
+
+	def test_search_listing_cursor_mode(self):
+		""" Search listing in cursor mode must page through the matches
+		newest first without counting them
+		"""
+		for i in range(3):
+			create_restaurant("Diner Restaurant %d" % i)
+		create_restaurant("Other")
+		response = self.client.get(reverse('webapp:search_listing', args=("diner",)) + "?cursor=")
+		page = response.context['search_list']
+		self.assertQuerysetEqual(page, ['<Restaurant: Diner Restaurant 2>', '<Restaurant: Diner Restaurant 1>'])
+		response = self.client.get(reverse('webapp:search_listing', args=("diner",)) + "?cursor=" + page.next_cursor)
+		self.assertQuerysetEqual(response.context['search_list'], ['<Restaurant: Diner Restaurant 0>'])
+
+	def test_deep_page_costs_one_query(self):
+		""" Fetching a page through a cursor must run a single query
+		"""
+		for i in range(7):
+			create_restaurant("Test Restaurant %d" % i)
+		paginator = KeysetPaginator(Restaurant.objects.all(), 2)
+		cursor = paginator.encode_cursor(Restaurant.objects.order_by('created_at', 'id')[2])
+		with self.assertNumQueries(1):
+			self.assertEqual(len(paginator.page(cursor)), 2)
+
+
+class SearchIndexTests(TestCase):
+
+	def test_cuisine_and_city_are_searchable(self):
+		""" Restaurants must be found by their cuisines and city
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		restaurant.cuisines.create(name="Nepali")
+		Restaurant.objects.filter(pk=restaurant.pk).update(city="Tampere")
+		search.reindex([restaurant.pk])
+		self.assertQuerysetEqual(search.search_restaurants("nepali"), ['<Restaurant: Test Restaurant>'])
+		self.assertQuerysetEqual(search.search_restaurants("tampere"), ['<Restaurant: Test Restaurant>'])
+
+	def test_name_match_ranks_above_description_match(self):
+		""" Restaurant whose name matches the search text must be listed
+		before the one only mentioning it in the description
+		"""
+		restaurant = create_restaurant("Burger Place")
+		restaurant.description = "Serves pizza too"
+		restaurant.save()
+		create_restaurant("Pizza Place")
+		self.assertQuerysetEqual(search.search_restaurants("pizza"),
+								 ['<Restaurant: Pizza Place>', '<Restaurant: Burger Place>'])
+
+	def test_index_updated_when_type_renamed(self):
+		""" Renaming a type must reindex the restaurants having that type
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		restaurant_type = restaurant.types.create(name="Diner")
+		restaurant_type.name = "Bistro"
+		restaurant_type.save()
+		self.assertQuerysetEqual(search.search_restaurants("diner"), [])
+		self.assertQuerysetEqual(search.search_restaurants("bistro"), ['<Restaurant: Test Restaurant>'])
+
+	def test_index_updated_when_type_deleted(self):
+		""" Deleting a type must remove its terms from the restaurants having it
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		restaurant.types.create(name="Diner").delete()
+		self.assertQuerysetEqual(search.search_restaurants("diner"), [])
+
+	def test_rebuild_search_index_command(self):
+		""" Management command must rebuild the index from scratch
+		"""
+		create_restaurant("Test Restaurant")
+		SearchTerm.objects.all().delete()
+		call_command('rebuild_search_index', stdout=StringIO())
+		self.assertQuerysetEqual(search.search_restaurants("test"), ['<Restaurant: Test Restaurant>'])
+
+
+class SearchCacheTests(TestCase):
+
+	def test_cached_search_loads_only_restaurants(self):
+		""" Repeated search must be answered from the cached id list with
+		a single query loading the restaurants
+		"""
+		create_restaurant("Test Restaurant")
+		url = reverse('webapp:search_listing', args=("test",))
+		self.client.get(url)
+		with self.assertNumQueries(1):
+			response = self.client.get(url)
+		self.assertQuerysetEqual(response.context['search_list'], ['<Restaurant: Test Restaurant>'])
+		self.assertEqual(response.context['search_list'].paginator.num_pages, 1)
+
+	def test_cache_invalidated_on_restaurant_save(self):
+		""" Renamed restaurant must not be listed under its old name
+		"""
+		restaurant = create_restaurant("Tasty Restaurant")
+		url = reverse('webapp:search_listing', args=("tasty",))
+		self.client.get(url)
+		restaurant.name = "Renamed Restaurant"
+		restaurant.save()
+		response = self.client.get(url)
+		self.assertQuerysetEqual(response.context['search_list'], [])
+
+	def test_cache_invalidated_on_restaurant_delete(self):
+		""" Deleted restaurant must disappear from cached listings
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		url = reverse('webapp:search_listing', args=("all",))
+		self.client.get(url)
+		restaurant.delete()
+		response = self.client.get(url)
+		self.assertQuerysetEqual(response.context['search_list'], [])
+
+	def test_cache_invalidated_on_type_change(self):
+		""" Adding a type to a restaurant must make it show up for that type
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		restaurant_type = Type.objects.create(name="Diner")
+		url = reverse('webapp:search_listing', args=("diner",))
+		self.client.get(url)
+		restaurant_type.restaurant_set.add(restaurant)
+		response = self.client.get(url)
+		self.assertQuerysetEqual(response.context['search_list'], ['<Restaurant: Test Restaurant>'])
+
+	def test_search_text_normalized(self):
+		""" Differently cased search texts must share the cached page
+		"""
+		create_restaurant("Test Restaurant")
+		self.client.get(reverse('webapp:search_listing', args=("Test",)))
+		with self.assertNumQueries(1):
+			self.client.get(reverse('webapp:search_listing', args=("test",)))
+
+	def test_only_exact_all_lists_everything(self):
+		""" Search texts normalizing to "all" must search for the term, not
+		list every restaurant
+		"""
+		create_restaurant("Test Restaurant")
+		create_restaurant("All Day Diner")
+		response = self.client.get(reverse('webapp:search_listing', args=("all",)))
+		self.assertEqual(response.context['search_list'].paginator.count, 2)
+		response = self.client.get(reverse('webapp:search_listing', args=("ALL",)))
+		self.assertQuerysetEqual(response.context['search_list'], ['<Restaurant: All Day Diner>'])
+		response = self.client.get(reverse('webapp:search_listing', args=("ALL",)), {'cursor': ''})
+		self.assertEqual([restaurant.name for restaurant in response.context['search_list']], ["All Day Diner"])
+		page, _ = search.search_page(" all ", 1, 2)
+		self.assertEqual([restaurant.name for restaurant in page], ["All Day Diner"])
+
+
+class SearchFacetTests(TestCase):
+
+	def setUp(self):
+		self.pizza = Type.objects.create(name="Pizzeria")
+		self.bar = Type.objects.create(name="Bar")
+		self.italian = Cuisine.objects.create(name="Italian")
+		for i in range(3):
+			restaurant = create_restaurant("Diner Restaurant %d" % i)
+			restaurant.types.add(self.pizza)
+			if i:
+				restaurant.types.add(self.bar)
+				restaurant.cuisines.add(self.italian)
+
+	def test_facet_counts(self):
+		""" Search listing must count the matching restaurants of each type
+		and cuisine
+		"""
+		response = self.client.get(reverse('webapp:search_listing', args=("diner",)))
+		self.assertEqual([(f['name'], f['count']) for f in response.context['type_facets']],
+						 [('Pizzeria', 3), ('Bar', 2)])
+		self.assertEqual([(f['name'], f['count']) for f in response.context['cuisine_facets']],
+						 [('Italian', 2)])
+
+	def test_facet_filter(self):
+		""" Selected facets must narrow both the listing and the counts
+		"""
+		url = reverse('webapp:search_listing', args=("all",))
+		response = self.client.get(url, {'type': self.bar.id, 'cuisine': self.italian.id})
+		self.assertEqual(response.context['search_list'].paginator.count, 2)
+		self.assertEqual([(f['name'], f['count'], f['selected']) for f in response.context['type_facets']],
+						 [('Bar', 2, True), ('Pizzeria', 2, False)])
+		response = self.client.get(url + "?" + response.context['type_facets'][0]['query'])
+		self.assertEqual(response.context['search_list'].paginator.count, 2)
+		self.assertEqual([f['selected'] for f in response.context['type_facets']], [False, False])
+		self.assertEqual([f['selected'] for f in response.context['cuisine_facets']], [True])
+
+	def test_facet_filter_ignores_non_ascii_digits(self):
+		url = reverse('webapp:search_listing', args=("all",))
+		response = self.client.get(url + "?type=%C2%B2&cuisine=abc")
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.context['search_list'].paginator.count, 3)
+
+	def test_facet_filter_ignores_overlong_ids(self):
+		url = reverse('webapp:search_listing', args=("all",))
+		response = self.client.get(url, {'type': '9' * 23, 'cuisine': '1' * 10})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.context['search_list'].paginator.count, 3)
+
+	def test_facet_queries_do_not_grow_with_facet_values(self):
+		""" Counting facets must take the same number of queries however
+		many types and cuisines there are
+		"""
+		url = reverse('webapp:search_listing', args=("diner",))
+		with self.assertNumQueries(3):
+			self.client.get(url)
+		restaurant = Restaurant.objects.get(name="Diner Restaurant 0")
+		for i in range(5):
+			restaurant.types.create(name="Type %d" % i)
+			restaurant.cuisines.create(name="Cuisine %d" % i)
+		with self.assertNumQueries(3):
+			response = self.client.get(url)
+		self.assertEqual(len(response.context['type_facets']), 7)
+
+
+class AutocompleteViewTests(TestCase):
+
+	def suggest(self, query):
+		response = self.client.get(reverse('webapp:autocomplete'), {'q': query})
+		return [(r['kind'], r['label']) for r in response.json()['results']]
+
+	def test_prefix_of_any_word(self):
+		""" Restaurants, types and cuisines must be suggested by the prefix
+		of any word of their name
+		"""
+		create_restaurant("Joe's Pizza")
+		Type.objects.create(name="Pizzeria")
+		Cuisine.objects.create(name="Nepali")
+		self.assertEqual(self.suggest("piz"), [('restaurant', "Joe's Pizza"), ('type', 'Pizzeria')])
+		self.assertEqual(self.suggest("JO"), [('restaurant', "Joe's Pizza")])
+		self.assertEqual(self.suggest("nep"), [('cuisine', 'Nepali')])
+
+	def test_index_follows_changes(self):
+		""" Renamed and deleted restaurants must be reflected in the suggestions
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		self.assertEqual(self.suggest("test"), [('restaurant', 'Test Restaurant')])
+		restaurant.name = "Tasty Restaurant"
+		restaurant.save()
+		self.assertEqual(self.suggest("test"), [])
+		self.assertEqual(self.suggest("tas"), [('restaurant', 'Tasty Restaurant')])
+		restaurant.delete()
+		self.assertEqual(self.suggest("tas"), [])
+
+	def test_answered_without_queries(self):
+		""" Once built the index must answer without touching the database
+		"""
+		create_restaurant("Test Restaurant")
+		self.suggest("te")
+		with self.assertNumQueries(0):
+			self.assertEqual(self.suggest("tes"), [('restaurant', 'Test Restaurant')])
+
+	def test_index_size_bounded(self):
+		""" Index must not grow beyond its configured number of entries
+		"""
+		index = autocomplete.PrefixIndex(max_entries=3)
+		index.load([('restaurant', 1, 'Test Restaurant'), ('restaurant', 2, 'Other Restaurant')])
+		self.assertEqual(len(index), 2)
+		self.assertFalse(index.add('restaurant', 3, 'Third Restaurant'))
+		self.assertEqual(len(index), 2)
+
+	def test_changes_leave_running_lookups_alone(self):
+		""" Changes must swap in a new entry list rather than edit the one
+		lookups may be reading without the lock
+		"""
+		index = autocomplete.PrefixIndex(max_entries=10)
+		index.load([('restaurant', 1, 'Test Restaurant')])
+		entries = index.entries
+		index.add('restaurant', 2, 'Other Restaurant')
+		index.remove('restaurant', 1)
+		self.assertEqual(entries, [('restaurant', 'restaurant', 1, 'Test Restaurant'),
+								   ('test restaurant', 'restaurant', 1, 'Test Restaurant')])
+		self.assertEqual(index.lookup('re'), [('restaurant', 2, 'Other Restaurant')])
+
+	def test_limit_at_least_one(self):
+		for name in ("Test Restaurant", "Test Bistro", "Test Cafe"):
+			create_restaurant(name)
+		for limit in (0, -1):
+			response = self.client.get(reverse('webapp:autocomplete'), {'q': 'test', 'limit': limit})
+			self.assertEqual(len(response.json()['results']), 1)
+
+
+class NearbyViewTests(TestCase):
+
+	def test_geohash_set_on_save(self):
+		""" Restaurant's geohash must follow its coordinates
+		"""
+		restaurant = create_restaurant("Test Restaurant")
+		restaurant.latitude = 57.64911
+		restaurant.longitude = 10.40744
+		restaurant.save()
+		self.assertEqual(Restaurant.objects.get(pk=restaurant.pk).geohash[:11], 'u4pruydqqvj')
+
+	def test_nearby_sorted_by_distance(self):
+		""" Restaurants within the radius must be listed closest first,
+		the ones outside it left out
+		"""
+		create_restaurant_at("Far", 61.4981, 23.8100)
+		create_restaurant_at("Close", 61.4978, 23.7610)
+		create_restaurant_at("Closer", 61.4980, 23.7620)
+		create_restaurant_at("Helsinki", 60.1699, 24.9384)
+		response = self.client.get(reverse('webapp:nearby'), {'lat': 61.4980, 'lng': 23.7621, 'radius': 5})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual([r['name'] for r in response.json()['results']], ['Closer', 'Close', 'Far'])
+
+	def test_nearby_across_cell_boundary(self):
+		""" Restaurant just across a geohash cell boundary must be found
+		"""
+		create_restaurant_at("East", 0.0001, 0.0001)
+		response = self.client.get(reverse('webapp:nearby'), {'lat': -0.0001, 'lng': -0.0001, 'radius': 1})
+		self.assertEqual([r['name'] for r in response.json()['results']], ['East'])
+
+	def test_nearby_close_to_pole(self):
+		""" Where geohash cells are too narrow the bounding box must still
+		find the restaurants in the circle, across the antimeridian too
+		"""
+		create_restaurant_at("Near", 89.6, 10.0)
+		create_restaurant_at("Across", 89.95, -170.0)
+		create_restaurant_at("Opposite", 89.5, 180.0)
+		create_restaurant_at("South", 60.0, 10.0)
+		self.assertIsNone(geo.precision_for_radius(89.8, 50))
+		south, north, longitudes = geo.bounding_box(0.0, 179.95, 11.132)
+		self.assertEqual([(round(west, 2), round(east, 2)) for west, east in longitudes], [(179.85, 180.0), (-180.0, -179.95)])
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual([restaurant.name for _, restaurant in search.nearby_restaurants(89.8, 10.0, 50)],
+							 ['Near', 'Across'])
+		self.assertIn('"latitude" BETWEEN', queries[0]['sql'])
+
+	def test_nearby_invalid_parameters(self):
+		""" Missing or out of range coordinates must be rejected
+		"""
+		self.assertEqual(self.client.get(reverse('webapp:nearby')).status_code, 400)
+		response = self.client.get(reverse('webapp:nearby'), {'lat': 91, 'lng': 0})
+		self.assertEqual(response.status_code, 400)
+
+
+class ImportRestaurantsTests(TestCase):
+
+	def write(self, suffix, content):
+		handle, path = tempfile.mkstemp(suffix=suffix)
+		os.write(handle, content.encode('utf-8'))
+		os.close(handle)
+		self.addCleanup(os.remove, path)
+		return path
+
+	def test_import_creates_then_updates(self):
+		""" Imported rows must create restaurants with their types, cuisines,
+		geohash and search terms, importing again must update them in place
+		"""
+		create_owner('Test User', 'test@example.com', 'testpwd')
+		Type.objects.create(name="Pizzeria")
+		path = self.write('.csv', 'name,city,street,latitude,longitude,types,cuisines\n'
+								  'Luigi,Rome,Via Roma,41.9,12.5,Pizzeria;Trattoria,Italian\n'
+								  'Mario,Rome,Via Appia,41.8,12.6,Pizzeria,\n'
+								  ',Rome,Nowhere,0,0,,\n')
+		call_command('import_restaurants', path, '--batch-size', '1', '--owner', 'Test User',
+					 stdout=StringIO(), stderr=StringIO())
+		luigi = Restaurant.objects.get(name='Luigi')
+		self.assertEqual(Restaurant.objects.count(), 2)
+		self.assertEqual(Type.objects.count(), 2)
+		self.assertEqual(sorted(luigi.types.values_list('name', flat=True)), ['Pizzeria', 'Trattoria'])
+		self.assertEqual(luigi.geohash, geo.encode(41.9, 12.5))
+		self.assertEqual(list(luigi.users.values_list('username', flat=True)), ['Test User'])
+		self.assertEqual([r.name for r in search.search_restaurants('italian')], ['Luigi'])
+		path = self.write('.jsonl', '{"name": "Luigi", "city": "Rome", "street": "Via Roma", '
+									'"latitude": 41.9, "longitude": 12.5, "capacity": 12, "cuisines": ["Roman"]}\n'
+									'not json\n')
+		out = StringIO()
+		call_command('import_restaurants', path, stdout=out, stderr=StringIO())
+		self.assertIn('Imported 1 rows', out.getvalue())
+		self.assertEqual(Restaurant.objects.count(), 2)
+		luigi = Restaurant.objects.get(name='Luigi')
+		self.assertEqual(luigi.capacity, 12)
+		self.assertEqual(list(luigi.cuisines.values_list('name', flat=True)), ['Roman'])
+		self.assertEqual(sorted(luigi.types.values_list('name', flat=True)), ['Pizzeria', 'Trattoria'])
+
+	def test_import_without_taxonomy_columns_keeps_links(self):
+		""" Files without a types or cuisines column must leave the links of
+		the restaurants they update alone, empty values clear them
+		"""
+		path = self.write('.csv', 'name,city,street,latitude,longitude,types,cuisines\n'
+								  'Luigi,Rome,Via Roma,41.9,12.5,Pizzeria,Italian\n')
+		call_command('import_restaurants', path, stdout=StringIO(), stderr=StringIO())
+		path = self.write('.csv', 'name,city,street,latitude,longitude,capacity\n'
+								  'Luigi,Rome,Via Roma,41.9,12.5,12\n')
+		call_command('import_restaurants', path, stdout=StringIO(), stderr=StringIO())
+		luigi = Restaurant.objects.get(name='Luigi')
+		self.assertEqual(luigi.capacity, 12)
+		self.assertEqual(list(luigi.types.values_list('name', flat=True)), ['Pizzeria'])
+		self.assertEqual(list(luigi.cuisines.values_list('name', flat=True)), ['Italian'])
+		path = self.write('.csv', 'name,city,street,latitude,longitude,types\n'
+								  'Luigi,Rome,Via Roma,41.9,12.5,\n')
+		call_command('import_restaurants', path, stdout=StringIO(), stderr=StringIO())
+		self.assertEqual(luigi.types.count(), 0)
+		self.assertEqual(luigi.cuisines.count(), 1)
+
+
+class LoadTestCommandTests(TestCase):
+
+	def test_refuses_without_debug(self):
+		""" The load test writes to the configured database, it must only
+		run there with DEBUG on or when asked to
+		"""
+		with self.assertRaises(CommandError):
+			call_command('loadtest', '--seed', '--duration', '0', stdout=StringIO())
+		self.assertFalse(User.objects.exists())
+
+
+class GenerateDataTests(TestCase):
+
+	def test_generated_data_is_consistent(self):
+		""" Generated restaurants must carry their geohash, taxonomy and search
+		terms, upcoming bookings must hold seats in slots that are not
+		overbooked, and models saved afterwards must get fresh ids
+		"""
+		with self.assertRaises(CommandError):
+			call_command('generate_data', '--restaurants', '1', stdout=StringIO())
+		self.assertFalse(Restaurant.objects.exists())
+		call_command('generate_data', '--restaurants', '30', '--users', '5', '--bookings', '600',
+					 '--types', '3', '--cuisines', '20', '--batch-size', '50', '--allow', stdout=StringIO())
+		self.assertEqual(Restaurant.objects.count(), 30)
+		self.assertEqual(Type.objects.count(), 3)
+		customers = User.objects.filter(groups__name='customer')
+		self.assertEqual(customers.count(), 5)
+		self.assertTrue(all(user.username.startswith(generating.USERNAME_PREFIX) and not user.has_usable_password()
+							for user in customers))
+		self.assertTrue(Booking.objects.count() > 100)
+		restaurant = Restaurant.objects.order_by('id').first()
+		self.assertEqual(restaurant.geohash, geo.encode(float(restaurant.latitude), float(restaurant.longitude)))
+		self.assertTrue(restaurant.cuisines.exists())
+		self.assertIn(restaurant, search.search_restaurants(restaurant.city.split()[0]))
+		# The most popular cuisine comes first
+		top = Cuisine.objects.annotate(n=Count('restaurant')).order_by('-n').first()
+		self.assertEqual(top.name, 'Italian')
+		for slot in BookingSlot.objects.all():
+			seats = sum(slot.booking_set.values_list('number_of_people', flat=True))
+			self.assertEqual(slot.booked, seats)
+			self.assertTrue(seats <= slot.capacity)
+		self.assertFalse(Booking.objects.filter(booking_date__gt=timezone.now(), slot=None).exists())
+		self.assertTrue(create_restaurant('New').pk > restaurant.pk + 29)
+
+
+class ExportTests(TestCase):
+
+	def setUp(self):
+		self.owner = create_owner('Test User', 'test@example.com', 'testpwd')
+		self.restaurant = create_restaurant('Test Restaurant')
+		self.restaurant.users.add(self.owner)
+		self.restaurant.types.add(Type.objects.create(name="Pizzeria"))
+		create_restaurant('Other Restaurant')
+		customer = User.objects.create_user(username='Customer', password='testpwd')
+		for i in range(5):
+			Booking.objects.create(user=customer, restaurant=self.restaurant, number_of_people=i + 1,
+								   booking_date=timezone.now())
+
+	def test_owner_exports_own_restaurants_and_bookings(self):
+		""" Owners must get a streamed export of their restaurants and their
+		bookings only
+		"""
+		self.client.login(username='Test User', password='testpwd')
+		response = self.client.get(reverse('webapp:export', args=('restaurants', 'csv')))
+		self.assertTrue(response.streaming)
+		lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+		self.assertEqual(lines[0].split(',')[-2:], ['types', 'cuisines'])
+		self.assertEqual(len(lines), 2)
+		self.assertIn('Test Restaurant', lines[1])
+		self.assertTrue(lines[1].endswith('Pizzeria,'))
+		response = self.client.get(reverse('webapp:export', args=('bookings', 'ndjson')))
+		rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+		self.assertEqual([row['number_of_people'] for row in rows], [1, 2, 3, 4, 5])
+
+	def test_customers_cannot_export(self):
+		self.client.login(username='Customer', password='testpwd')
+		response = self.client.get(reverse('webapp:export', args=('bookings', 'csv')))
+		self.assertEqual(response.status_code, 403)
+
+	def test_export_command_reads_in_chunks(self):
+		handle, path = tempfile.mkstemp(suffix='.ndjson')
+		os.close(handle)
+		self.addCleanup(os.remove, path)
+		with self.assertNumQueries(3):
+			call_command('export_data', 'bookings', '--format', 'ndjson', '--chunk-size', '2',
+						 '--output', path, stderr=StringIO())
+		with open(path, 'rb') as exported:
+			self.assertEqual(len(exported.read().decode('utf-8').splitlines()), 5)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTests(SimpleTestCase):
+
+	def setUp(self):
+		self.router = routers.PrimaryReplicaRouter()
+		self.factory = RequestFactory()
+
+	def tearDown(self):
+		routers._local.pinned = False
+
+	def respond(self, request, write=False):
+		def get_response(request):
+			self.read_from = self.router.db_for_read(Restaurant)
+			if write:
+				self.router.db_for_write(Restaurant)
+				self.read_after_write = self.router.db_for_read(Restaurant)
+			return HttpResponse()
+		return routers.ReadYourWritesMiddleware(get_response)(request)
+
+	def test_reads_follow_writes_to_the_primary(self):
+		""" Reads must go to a replica, except after the client wrote: then
+		they go to the primary while the pin cookie lasts
+		"""
+		response = self.respond(self.factory.get('/'))
+		self.assertEqual(self.read_from, 'replica1')
+		self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+		response = self.respond(self.factory.get('/'), write=True)
+		self.assertEqual(self.read_after_write, 'default')
+		self.assertIn(routers.PIN_COOKIE, response.cookies)
+		request = self.factory.get('/')
+		request.COOKIES[routers.PIN_COOKIE] = '1'
+		self.respond(request)
+		self.assertEqual(self.read_from, 'default')
+		self.respond(self.factory.post('/'))
+		self.assertEqual(self.read_from, 'default')
+		self.respond(self.factory.get('/'))
+		self.assertEqual(self.read_from, 'replica1')
+
+	def test_migrations_only_run_on_the_primary(self):
+		self.assertTrue(self.router.allow_migrate('default', 'webapp'))
+		self.assertFalse(self.router.allow_migrate('replica1', 'webapp'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaReadTests(TransactionTestCase):
+	""" Against a second SQLite database standing in for a replica that
+	has not caught up with the primary
+	"""
+
+	def setUp(self):
+		cache.clear()
+		handle, path = tempfile.mkstemp(suffix='.sqlite3')
+		os.close(handle)
+		connections.databases['replica1'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+		self.addCleanup(os.remove, path)
+		self.addCleanup(connections.databases.pop, 'replica1')
+		self.addCleanup(lambda: connections['replica1'].close())
+		with connections['replica1'].schema_editor() as editor:
+			editor.create_model(Type)
+		Type.objects.using('replica1').create(name='Stale')
+		Type.objects.create(name='Current')
+		routers._local.pinned = False
+
+	def tearDown(self):
+		routers._local.pinned = False
+
+	def test_reads_go_to_the_replica_unless_pinned(self):
+		self.assertEqual([t.name for t in Type.objects.all()], ['Stale'])
+		with routers.primary_reads():
+			self.assertEqual([t.name for t in Type.objects.all()], ['Current'])
+		routers.pin_primary()
+		self.assertEqual([t.name for t in Type.objects.all()], ['Current'])
+
+	def test_cached_loaders_read_the_primary(self):
+		""" Data cached under the current version stamp must not come from
+		the replica
+		"""
+		self.assertEqual([name for _, name in taxonomy.get_choices(Type).rows], ['Current'])
+		self.assertEqual([label for _, _, label in autocomplete.suggest('c')], ['Current'])
+		self.assertFalse(routers.is_pinned())
+
+
+class TaxonomyChoicesTests(TestCase):
+
+	def test_form_choices_are_cached(self):
+		""" Rendering the restaurant form again must not query types or
+		cuisines, a new type must show up all the same
+		"""
+		Type.objects.create(name="Pizzeria")
+		Cuisine.objects.create(name="Italian")
+		RestaurantForm().as_p()
+		with self.assertNumQueries(0):
+			html = RestaurantForm().as_p()
+		self.assertIn("Pizzeria", html)
+		self.assertEqual(html.count('class="add-another"'), 2)
+		Type.objects.create(name="Trattoria")
+		self.assertIn("Trattoria", RestaurantForm().as_p())
+
+	@override_settings(TAXONOMY_INLINE_CHOICES=1)
+	def test_large_selects_load_choices_lazily(self):
+		""" Past the inline limit only selected choices are rendered, the
+		others come from the choices endpoint
+		"""
+		pizzeria = Type.objects.create(name="Pizzeria")
+		Type.objects.create(name="Pub")
+		Type.objects.create(name="Steakhouse")
+		html = RestaurantForm(initial={'types': [pizzeria.id]}).as_p()
+		self.assertIn('data-choices-url="%s"' % reverse('webapp:taxonomy_choices', args=('types',)), html)
+		self.assertIn("Pizzeria", html)
+		self.assertNotIn("Steakhouse", html)
+		response = self.client.get(reverse('webapp:taxonomy_choices', args=('types',)), {'q': 'p'})
+		self.assertEqual([result['name'] for result in response.json()['results']], ['Pizzeria', 'Pub'])
+
+	def test_choices_limit_at_least_one(self):
+		for name in ("Pizzeria", "Pub", "Patisserie"):
+			Type.objects.create(name=name)
+		for limit in (0, -1):
+			response = self.client.get(reverse('webapp:taxonomy_choices', args=('types',)), {'q': 'p', 'limit': limit})
+			self.assertEqual(len(response.json()['results']), 1)
+
+	@override_settings(TAXONOMY_INLINE_CHOICES=1)
+	def test_large_selects_ignore_non_numeric_values(self):
+		pizzeria = Type.objects.create(name="Pizzeria")
+		Type.objects.create(name="Pub")
+		form = RestaurantForm({'types': [pizzeria.id, '\u00e9', '\u00b2']})
+		html = form['types'].as_widget()
+		self.assertIn("Pizzeria", html)
+		self.assertNotIn("Pub", html)
+
+
 class RestaurantCreateViewTests(TestCase):
 
 	def test_view_loads(self):
@@ -457,6 +1599,317 @@ class UserCreateViewTests(TestCase):
         self.assertRedirects(response, reverse('login'))
 
 
+class BookingCapacityTests(TestCase):
+
+	def setUp(self):
+		self.user = User.objects.create_user(username='Test User', password='testpwd')
+		self.restaurant = create_restaurant('Test Restaurant')
+		self.restaurant.capacity = 4
+		self.restaurant.save()
+		self.booking_date = timezone.now() + datetime.timedelta(days=1)
+
+	def book(self, number_of_people, booking_date=None):
+		booking = Booking(user=self.user, restaurant=self.restaurant, number_of_people=number_of_people,
+						  booking_date=booking_date or self.booking_date)
+		booking_engine.place_booking(booking)
+		return booking
+
+	def test_slot_capacity_not_exceeded(self):
+		""" Booking more seats than are left in the slot must fail and save nothing
+		"""
+		self.book(3)
+		self.assertRaises(booking_engine.SlotFull, self.book, 2)
+		self.book(1)
+		self.assertEqual(Booking.objects.count(), 2)
+		self.assertEqual(BookingSlot.objects.get().booked, 4)
+
+	def test_other_slot_unaffected(self):
+		""" A full slot must not block bookings in the next one
+		"""
+		self.book(4)
+		later = self.booking_date + datetime.timedelta(minutes=booking_engine.slot_minutes())
+		self.book(4, later)
+		self.assertEqual(BookingSlot.objects.count(), 2)
+
+	def test_cancel_and_change_release_seats(self):
+		""" Cancelled and moved bookings must give their seats back
+		"""
+		booking = self.book(4)
+		booking_engine.cancel_booking(booking)
+		self.assertEqual(BookingSlot.objects.get().booked, 0)
+		booking = self.book(4)
+		held = booking.slot_id, booking.number_of_people
+		booking.number_of_people = 2
+		booking_engine.change_booking(booking, *held)
+		self.book(2)
+		self.assertEqual(BookingSlot.objects.get().booked, 4)
+
+	def test_booking_view_rejects_full_slot(self):
+		""" Booking form must report a full slot as a form error
+		"""
+		self.book(4)
+		self.client.login(username='Test User', password='testpwd')
+		booking_credentials = {'restaurant':self.restaurant.id, 'booking_date':self.booking_date.strftime('%Y-%m-%d %H:%M:%S'), 'number_of_people':1, 'next':reverse('webapp:index')}
+		response = self.client.post(reverse('webapp:booking_create', args=(self.restaurant.id,)), booking_credentials)
+		self.assertFormError(response, 'form', 'booking_date', 'Not enough free seats at that time.')
+
+
+class BookingRequestTests(TestCase):
+
+	def setUp(self):
+		self.user = User.objects.create_user(username='Test User', password='testpwd')
+		self.restaurant = create_restaurant('Test Restaurant')
+		self.client.login(username='Test User', password='testpwd')
+		booking_date = timezone.now() + datetime.timedelta(days=1)
+		self.booking_credentials = {'restaurant':self.restaurant.id, 'booking_date':booking_date.strftime('%Y-%m-%d %H:%M:%S'),
+									'number_of_people':2, 'idempotency_key':'abc123', 'next':reverse('webapp:index')}
+
+	def submit(self):
+		return self.client.post(reverse('webapp:booking_create', args=(self.restaurant.id,)), self.booking_credentials)
+
+	def test_form_carries_idempotency_key(self):
+		response = self.client.get(reverse('webapp:booking_create', args=(self.restaurant.id,)))
+		self.assertTrue(response.context['form']['idempotency_key'].value())
+
+	def test_duplicate_submit_books_once(self):
+		""" Submitting the same form twice must return the first outcome
+		without booking again
+		"""
+		first = self.submit()
+		second = self.submit()
+		self.assertRedirects(first, reverse('webapp:index'))
+		self.assertRedirects(second, reverse('webapp:index'))
+		self.assertEqual(Booking.objects.count(), 1)
+		self.assertEqual(BookingSlot.objects.get().booked, 2)
+		self.assertEqual(BookingRequest.objects.get().booking, Booking.objects.get())
+
+	def test_duplicate_of_failed_submit_reports_error(self):
+		self.restaurant.capacity = 1
+		self.restaurant.save()
+		self.submit()
+		response = self.submit()
+		self.assertFormError(response, 'form', 'booking_date', booking_engine.SLOT_FULL_MESSAGE)
+		self.assertEqual(BookingRequest.objects.get().status, BookingRequest.FAILED)
+
+	def test_corrected_submit_after_failure_is_booked(self):
+		""" The form shown after a failed booking must carry a new key so
+		that the corrected submit is booked, not answered with the failure
+		"""
+		self.restaurant.capacity = 3
+		self.restaurant.save()
+		self.booking_credentials['number_of_people'] = 5
+		response = self.submit()
+		self.assertFormError(response, 'form', 'booking_date', booking_engine.SLOT_FULL_MESSAGE)
+		key = response.context['form']['idempotency_key'].value()
+		self.assertNotEqual(key, 'abc123')
+		self.booking_credentials.update(number_of_people=1, idempotency_key=key)
+		self.assertRedirects(self.submit(), reverse('webapp:index'))
+		self.assertEqual(Booking.objects.get().number_of_people, 1)
+
+	@override_settings(BOOKING_QUEUE=True)
+	def test_key_outside_status_url_is_form_error(self):
+		self.booking_credentials['idempotency_key'] = 'a.b'
+		response = self.submit()
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.context['form'].has_error('idempotency_key'))
+		self.assertFalse(BookingRequest.objects.exists())
+
+	@override_settings(BOOKING_QUEUE=True)
+	def test_queued_submit_is_booked_by_worker(self):
+		""" Queued bookings must be pending until the worker processes them,
+		the status endpoint reports the outcome
+		"""
+		status_url = reverse('webapp:booking_status', args=('abc123',))
+		self.assertRedirects(self.submit(), status_url)
+		self.assertRedirects(self.submit(), status_url)
+		self.assertEqual(Booking.objects.count(), 0)
+		self.assertEqual(self.client.get(status_url, {'format': 'json'}).json()['status'], 'pending')
+		call_command('process_booking_requests', '--once', stdout=StringIO())
+		data = self.client.get(status_url, {'format': 'json'}).json()
+		self.assertEqual(data['status'], 'done')
+		self.assertEqual(data['booking'], Booking.objects.get().id)
+		self.assertContains(self.client.get(status_url), 'Booking successful.')
+
+
+class AuthorizationCacheTests(TestCase):
+
+	def test_checks_are_cached_until_changed(self):
+		""" Ownership, customer and permission checks must be answered from
+		the cache and follow changes to groups and owners
+		"""
+		owner = create_owner('Test User', 'test@example.com', 'testpwd')
+		restaurant = create_restaurant('Test Restaurant')
+		user = User.objects.get(pk=owner.pk)
+		self.assertFalse(authz.owns_restaurant(user, restaurant.id))
+		self.assertTrue(user.has_perm('webapp.change_restaurant'))
+		user = User.objects.get(pk=owner.pk)
+		with self.assertNumQueries(0):
+			self.assertFalse(authz.owns_restaurant(user, restaurant.id))
+			self.assertTrue(user.has_perm('webapp.change_restaurant'))
+			self.assertFalse(user.has_perm('webapp.delete_booking'))
+		restaurant.users.add(owner)
+		user = User.objects.get(pk=owner.pk)
+		self.assertTrue(authz.owns_restaurant(user, restaurant.id))
+		self.assertFalse(authz.is_customer(user))
+		owner.groups.add(Group.objects.create(name='customer'))
+		user = User.objects.get(pk=owner.pk)
+		self.assertTrue(authz.is_customer(user))
+		Group.objects.get(name='owner').permissions.clear()
+		user = User.objects.get(pk=owner.pk)
+		self.assertFalse(user.has_perm('webapp.change_restaurant'))
+
+	def test_sessions_of_model_backend_stay_logged_in(self):
+		""" Sessions opened before the cached backend name ModelBackend,
+		they must not be logged out
+		"""
+		user = User.objects.create_user(username='Test User', password='testpwd')
+		self.client.force_login(user, backend='django.contrib.auth.backends.ModelBackend')
+		response = self.client.get(reverse('webapp:profile'))
+		self.assertEqual(response.context['user'], user)
+
+	def test_bookings_of_others_cannot_be_changed(self):
+		restaurant = create_restaurant('Test Restaurant')
+		user = User.objects.create_user(username='Test User', password='testpwd')
+		User.objects.create_user(username='Other User', password='testpwd')
+		booking = Booking.objects.create(user=user, restaurant=restaurant, booking_date=timezone.now(), number_of_people=2)
+		self.client.login(username='Other User', password='testpwd')
+		response = self.client.get(reverse('webapp:booking_update', args=(booking.id,)))
+		self.assertRedirects(response, reverse('webapp:profile'))
+		self.client.get(reverse('webapp:booking_delete', args=(booking.id,)))
+		self.assertTrue(Booking.objects.filter(pk=booking.pk).exists())
+
+
+class BookingArchiveTests(TestCase):
+
+	def test_archive_moves_old_bookings(self):
+		""" Bookings past the horizon must move to the archive in batches,
+		keeping their id and dates, and stay listed in the archived profile
+		"""
+		user = User.objects.create_user(username='Test User', password='testpwd')
+		user.groups.add(Group.objects.create(name='customer'))
+		restaurant = create_restaurant('Test Restaurant')
+		now = timezone.now()
+		old = [Booking.objects.create(user=user, restaurant=restaurant, number_of_people=2,
+									  booking_date=now - datetime.timedelta(days=400 + i)) for i in range(3)]
+		recent = Booking.objects.create(user=user, restaurant=restaurant, number_of_people=2,
+										booking_date=now - datetime.timedelta(days=10))
+		call_command('archive_bookings', '--days', '365', '--batch-size', '2', stdout=StringIO())
+		self.assertQuerysetEqual(Booking.objects.all(), [repr(recent)])
+		archived = BookingArchive.objects.order_by('id')
+		self.assertEqual([booking.id for booking in archived], [booking.id for booking in old])
+		self.assertEqual(archived[0].created_at, old[0].created_at)
+		self.client.login(username='Test User', password='testpwd')
+		response = self.client.get(reverse('webapp:profile'))
+		self.assertQuerysetEqual(response.context['context_list'], [repr(recent)])
+		response = self.client.get(reverse('webapp:profile'), {'archived': 1})
+		self.assertEqual(len(response.context['context_list']), 3)
+		self.assertNotContains(response, 'edit_btn')
+
+	def test_archive_drops_old_slots_in_batches(self):
+		restaurant = create_restaurant('Test Restaurant')
+		now = timezone.now()
+		for i in range(5):
+			BookingSlot.objects.create(restaurant=restaurant, capacity=4,
+									   start=booking_engine.slot_start(now - datetime.timedelta(days=400 + i)))
+		recent = BookingSlot.objects.create(restaurant=restaurant, capacity=4, start=booking_engine.slot_start(now))
+		booking_engine.archive_bookings(now - datetime.timedelta(days=365), batch_size=2)
+		self.assertQuerysetEqual(BookingSlot.objects.all(), [repr(recent)])
+
+
+class AvailabilityViewTests(TestCase):
+
+	def test_availability_lists_free_seats_per_slot(self):
+		""" Availability must give the free seats of every slot of each day
+		of the range from a single slot query
+		"""
+		restaurant = create_restaurant('Test Restaurant')
+		restaurant.capacity = 4
+		restaurant.save()
+		day = timezone.now().date() + datetime.timedelta(days=1)
+		opening, closing = booking_engine.opening_hours()
+		booking_date = timezone.make_aware(datetime.datetime.combine(day, datetime.time(opening, 0)))
+		user = User.objects.create_user(username='Test User', password='testpwd')
+		booking_engine.place_booking(Booking(user=user, restaurant=restaurant, number_of_people=3, booking_date=booking_date))
+		url = reverse('webapp:availability', args=(restaurant.id,))
+		with self.assertNumQueries(2):
+			response = self.client.get(url, {'start': day.isoformat(), 'days': 3})
+		data = response.json()
+		slots = (closing - opening) * 60 // booking_engine.slot_minutes()
+		self.assertEqual(sorted(data['free']), [(day + datetime.timedelta(days=i)).isoformat() for i in range(3)])
+		self.assertEqual(data['free'][day.isoformat()], [1] + [4] * (slots - 1))
+		next_day = (day + datetime.timedelta(days=1)).isoformat()
+		self.assertEqual(data['free'][next_day], [4] * slots)
+
+	def test_availability_of_impossible_date_starts_today(self):
+		restaurant = create_restaurant('Test Restaurant')
+		response = self.client.get(reverse('webapp:availability', args=(restaurant.id,)), {'start': '2026-02-30', 'days': 1})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(list(response.json()['free']), [timezone.now().date().isoformat()])
+
+	def test_availability_start_kept_within_horizon(self):
+		""" Past start dates must start today, far ones at the booking
+		horizon
+		"""
+		restaurant = create_restaurant('Test Restaurant')
+		url = reverse('webapp:availability', args=(restaurant.id,))
+		today = timezone.now().date()
+		response = self.client.get(url, {'start': '0001-01-01', 'days': 1})
+		self.assertEqual(list(response.json()['free']), [today.isoformat()])
+		response = self.client.get(url, {'start': '9999-12-30', 'days': 31})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(min(response.json()['free']),
+						 (today + datetime.timedelta(days=booking_engine.horizon_days())).isoformat())
+
+	def test_availability_of_unknown_restaurant(self):
+		response = self.client.get(reverse('webapp:availability', args=(1,)))
+		self.assertEqual(response.status_code, 404)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+
+	def test_concurrent_bookings_never_exceed_capacity(self):
+		""" Hundreds of simultaneous bookings of one slot must never take more
+		seats than it has
+		"""
+		if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+			self.skipTest("Threads do not share SQLite in-memory test databases")
+		user = User.objects.create_user(username='Test User')
+		restaurant = create_restaurant('Test Restaurant')
+		restaurant.capacity = 50
+		restaurant.save()
+		booking_date = timezone.now() + datetime.timedelta(days=1)
+		outcomes = []
+
+		def book():
+			try:
+				for attempt in range(100):
+					try:
+						booking_engine.place_booking(Booking(user=user, restaurant=restaurant, booking_date=booking_date,
+															 number_of_people=2))
+						outcomes.append('booked')
+						return
+					except booking_engine.SlotFull:
+						outcomes.append('full')
+						return
+					except OperationalError:
+						# SQLite reports its database lock as busy, try again
+						time.sleep(0.01)
+				outcomes.append('error')
+			finally:
+				connection.close()
+
+		threads = [threading.Thread(target=book) for _ in range(200)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		slot = BookingSlot.objects.get()
+		self.assertLessEqual(slot.booked, slot.capacity)
+		self.assertEqual(slot.booked, 2 * Booking.objects.count())
+		self.assertEqual(Booking.objects.count(), outcomes.count('booked'))
+		self.assertEqual(outcomes.count('full'), 200 - slot.capacity // 2)
+
+
 class UserProfileViewTests(TestCase):
 
 	def test_user_profile_view_loads(self):
@@ -489,6 +1942,33 @@ class UserProfileViewTests(TestCase):
 		restaurant.users.add(owner)
 		response = self.client.get(reverse('webapp:profile'))
 		self.assertQuerysetEqual(response.context['context_list'], ['<Restaurant: Test Restaurant>'])
+
+	def test_user_profile_query_count_does_not_grow(self):
+		""" Profile page must cost the same queries with few or many bookings,
+		and list one page of them
+		"""
+		user = User.objects.create_user(username='Test User', password='testpwd')
+		user.groups.add(Group.objects.create(name='customer'))
+		self.client.login(username='Test User', password='testpwd')
+		booking_date = timezone.now()
+
+		def profile_queries(bookings):
+			for i in range(bookings):
+				restaurant = create_restaurant('Restaurant %d' % i)
+				Booking.objects.create(user=user, restaurant=restaurant, booking_date=booking_date, number_of_people=2)
+			with CaptureQueriesContext(connection) as queries:
+				response = self.client.get(reverse('webapp:profile'))
+			return len(queries), response
+
+		# Authorization is cached after the first request
+		profile_queries(0)
+		few, _ = profile_queries(3)
+		many, response = profile_queries(40)
+		self.assertEqual(few, many)
+		self.assertEqual(len(response.context['context_list']), views.PROFILE_PAGE_SIZE)
+		response = self.client.get(reverse('webapp:profile'), {'page': 3})
+		self.assertEqual(response.context['context_list'].number, 3)
+		self.assertEqual(len(response.context['context_list']), 3)
 	
 
 class BookingViewTests(TestCase):
@@ -635,6 +2115,13 @@ def create_restaurant(restaurant_name):
 									 telephone="test",
 									 website="test.com")
 
+def create_restaurant_at(restaurant_name, latitude, longitude):
+	restaurant = create_restaurant(restaurant_name)
+	restaurant.latitude = latitude
+	restaurant.longitude = longitude
+	restaurant.save()
+	return restaurant
+
 def create_owner(username, email, password):
 	user = User.objects.create_user(username=username, email=email, password=password)
 	group = Group.objects.create(name='owner')
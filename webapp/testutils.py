@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.decorators import ContextDecorator
+
+
+class QueryBudgetExceeded(AssertionError):
+    """ More queries ran than the budget allows
+    """
+
+
+class query_budget(ContextDecorator):
+    """ Fails with QueryBudgetExceeded when the block or decorated function
+    runs more than budget queries on the database. As a context manager it
+    gives the captured queries:
+
+        with query_budget(querybudget.BUDGETS['webapp:detail']) as queries:
+            client.get(url)
+        len(queries)
+    """
+
+    def __init__(self, budget, label=''):
+        self.budget = budget
+        self.label = label
+        self.captured = None
+
+    def __enter__(self):
+        self.captured = CaptureQueriesContext(connection)
+        return self.captured.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.captured.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and len(self.captured) > self.budget:
+            raise QueryBudgetExceeded('%s%d queries over a budget of %d:\n%s' % (
+                '%s: ' % self.label if self.label else '', len(self.captured), self.budget,
+                '\n'.join(query['sql'] for query in self.captured.captured_queries)))
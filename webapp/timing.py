@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+from django.template.backends.django import DjangoTemplates
+
+from . import metrics
+from .querybudget import BUDGETS
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+class RequestTimer(object):
+    """ Query count, DB time, template render time and total time of the
+    request being served by this thread
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.total = 0.0
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.rendering = 0
+
+    def server_timing(self):
+        return 'db;desc="%d queries";dur=%.2f, tpl;dur=%.2f, total;dur=%.2f' % (
+            self.queries, self.db * 1000, self.template * 1000, self.total * 1000)
+
+
+def current_timer():
+    return getattr(_local, 'timer', None)
+
+
+class TimedCursor(CursorWrapper):
+    """ Adds the queries run through the cursor Django made, debug or not,
+    and their time to the request timer
+    """
+
+    def __init__(self, cursor, db, timer):
+        super(TimedCursor, self).__init__(cursor, db)
+        self.timer = timer
+
+    def timed(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            self.timer.queries += 1
+            self.timer.db += time.time() - start
+
+    def execute(self, sql, params=None):
+        return self.timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self.timed(self.cursor.executemany, sql, param_list)
+
+
+def time_cursors(connection, timer):
+    """ Makes the connection wrap its new cursors in a TimedCursor, returns
+    the function undoing it
+    """
+    previous = dict((name, connection.__dict__.get(name)) for name in ('make_cursor', 'make_debug_cursor'))
+    for name in previous:
+        make = getattr(connection, name)
+        setattr(connection, name, lambda cursor, make=make: TimedCursor(make(cursor), connection, timer))
+
+    def restore():
+        for name, method in previous.items():
+            if method is None:
+                del connection.__dict__[name]
+            else:
+                setattr(connection, name, method)
+    return restore
+
+
+class TimedTemplate(object):
+    """ Backend template adding its render time to the current request timer,
+    templates rendered while another one renders are counted once
+    """
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        timer = current_timer()
+        if timer is None:
+            return self.template.render(context, request)
+        timer.rendering += 1
+        start = time.time()
+        try:
+            return self.template.render(context, request)
+        finally:
+            timer.rendering -= 1
+            if not timer.rendering:
+                timer.template += time.time() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+
+    def from_string(self, template_code):
+        return TimedTemplate(super(TimedDjangoTemplates, self).from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super(TimedDjangoTemplates, self).get_template(template_name))
+
+
+class RequestTimingMiddleware(object):
+    """ Records query count, DB time, template render time and total time
+    of every request. With the REQUEST_TIMING setting they are sent in a
+    Server-Timing header and logged to the webapp.timing logger, with a
+    warning for GET requests running more queries than the view's budget
+    (see webapp.querybudget). With METRICS they go to the request metrics
+    of webapp.metrics. Without either Django drops the middleware at
+    startup.
+    """
+
+    def __init__(self, get_response):
+        self.timing = getattr(settings, 'REQUEST_TIMING', False)
+        self.metrics = getattr(settings, 'METRICS', False)
+        if not (self.timing or self.metrics):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _local.timer = RequestTimer()
+        # Counted by the cursors of this request, whatever the query log holds
+        restores = [time_cursors(connection, timer) for connection in connections.all()]
+        try:
+            response = self.get_response(request)
+        finally:
+            _local.timer = None
+            for restore in restores:
+                restore()
+            timer.total = time.time() - timer.start
+        view = request.resolver_match.view_name if getattr(request, 'resolver_match', None) else ''
+        if self.metrics:
+            metrics.observe_request(view, request.method, response.status_code, timer.total, timer.queries)
+            metrics.maybe_flush()
+        if self.timing:
+            self.log(request, response, view, timer)
+        return response
+
+    def log(self, request, response, view, timer):
+        response['Server-Timing'] = timer.server_timing()
+        logger.info('method=%s path=%s view=%s status=%d queries=%d db_ms=%.2f template_ms=%.2f total_ms=%.2f',
+                    request.method, request.path, view, response.status_code, timer.queries,
+                    timer.db * 1000, timer.template * 1000, timer.total * 1000,
+                    extra={'view': view, 'status': response.status_code, 'queries': timer.queries,
+                           'db_ms': timer.db * 1000, 'template_ms': timer.template * 1000,
+                           'total_ms': timer.total * 1000})
+        budget = BUDGETS.get(view)
+        if request.method == 'GET' and budget is not None and timer.queries > budget:
+            logger.warning('view=%s path=%s queries=%d over its query budget of %d',
+                           view, request.path, timer.queries, budget,
+                           extra={'view': view, 'queries': timer.queries, 'budget': budget})
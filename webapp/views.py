@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import datetime
+import re
+import uuid
+
+from django.conf import settings
 from django.http import Http404
 from django.shortcuts import get_object_or_404, render, render_to_response
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, JsonResponse, QueryDict
+from django.http import HttpResponseForbidden, StreamingHttpResponse
 from django.urls import reverse
-from django.db.models import Q
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
@@ -13,18 +18,41 @@ from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.utils.datastructures import MultiValueDictKeyError
 from django.contrib import messages
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_date
 
-from .models import Restaurant, Cuisine, Type, Booking
+from .models import Restaurant, Cuisine, Type, Booking, BookingRequest
+from .search import search_page, normalize, unordered_listing, facet_counts, nearby_restaurants
+from . import caching, exporting, metrics as app_metrics, taxonomy
+from .autocomplete import suggest
+from .authz import can_manage_booking, is_customer, owns_any_restaurant, owns_restaurant
+from .booking import submit_booking, change_booking, cancel_booking, SlotFull, SLOT_FULL_MESSAGE
+from .booking import availability as booking_availability, horizon_days, opening_hours, slot_minutes
+from .caching import cache_anonymous_page
+from .pagination import KeysetPaginator
 from .forms import RestaurantForm, CuisineForm, TypeForm, SignUpForm, BookingForm
 
+MAX_NEARBY_RADIUS = 100
+MAX_AVAILABILITY_DAYS = 31
+PROFILE_PAGE_SIZE = 20
+# ASCII digits only, str.isdigit() also accepts digits int() rejects. At
+# most 9 of them: longer ids overflow the database integer (a 500 on SQLite)
+ID_RE = re.compile(r'^[0-9]{1,9}$')
+
+@cache_anonymous_page(caching.RESTAURANTS_NAMESPACE, 600, params=('cursor',))
 def index(request):
-    restaurant_list = Restaurant.objects.order_by('-created_at') [:5]
-    context = { 'restaurant_list': restaurant_list }
+    paginator = KeysetPaginator(Restaurant.objects.all(), 5)
+    cursor = request.GET.get('cursor', '')
+    # The page is only fetched when the cached card fragment is missing
+    restaurant_list = paginator.page(cursor)
+    context = { 'restaurant_list': restaurant_list, 'cursor': cursor,
+                'restaurants_version': caching.get_version(caching.RESTAURANTS_NAMESPACE) }
     return render(request, 'webapp/index.html', context)
 
 def detail(request, restaurant_id):
     try:
-        restaurant = get_object_or_404(Restaurant, pk=restaurant_id)
+        # Types and cuisines come with the restaurant: three queries in all
+        restaurant = get_object_or_404(Restaurant.objects.prefetch_related('types', 'cuisines'), pk=restaurant_id)
         return render(request, 'webapp/detail.html', {'restaurant':restaurant})
     except Http404:
         messages.set_level(request, messages.DEBUG)
@@ -42,20 +70,108 @@ def search(request):
     return HttpResponseRedirect(reverse('webapp:search_listing', args=(search_text,)))
 
 def search_listing(request, search_text):
-    if search_text == "all":
-        search_list = Restaurant.objects.all()
+    type_ids = facet_filter(request, 'type')
+    cuisine_ids = facet_filter(request, 'cuisine')
+    if 'cursor' in request.GET:
+        # Keyset pagination, newest first, page N costs the same as page 1
+        search_list = unordered_listing(normalize(search_text), type_ids, cuisine_ids)
+        restaurant_list = KeysetPaginator(search_list, 2).page(request.GET['cursor'])
+        facets = facet_counts(search_list)
     else:
-        search_list = Restaurant.objects.filter(Q(name__icontains=search_text) | Q(types__name__icontains=search_text)).distinct()
-    paginator = Paginator(search_list, 2)
-    page = request.GET.get('page')
+        restaurant_list, facets = search_page(search_text, request.GET.get('page'), 2, type_ids, cuisine_ids)
+    context = {'search_list':restaurant_list, 'search_text':search_text, 'cursor_mode':'cursor' in request.GET}
+    context.update(facet_links(facets, type_ids, cuisine_ids))
+    return render(request, 'webapp/search_result.html', context)
+
+def facet_filter(request, name):
+    return sorted(set(int(value) for value in request.GET.getlist(name) if ID_RE.match(value)))
+
+def facet_links(facets, type_ids, cuisine_ids):
+    """ Facet values for the template, each with the query string
+    that toggles it as a filter
+    """
+    def query_string(type_ids, cuisine_ids):
+        query = QueryDict(mutable=True)
+        query.setlist('type', sorted(type_ids))
+        query.setlist('cuisine', sorted(cuisine_ids))
+        return query.urlencode()
+
+    def links(values, selected, toggle):
+        return [dict(value, selected=value['id'] in selected, query=toggle(set(selected) ^ {value['id']}))
+                for value in values]
+
+    return {
+        'facet_query': query_string(type_ids, cuisine_ids),
+        'type_facets': links(facets['types'], type_ids, lambda ids: query_string(ids, cuisine_ids)),
+        'cuisine_facets': links(facets['cuisines'], cuisine_ids, lambda ids: query_string(type_ids, ids)),
+    }
+
+def autocomplete(request):
     try:
-        restaurant_list = paginator.page(page)
-    except PageNotAnInteger:
-        restaurant_list = paginator.page(1)
-    except EmptyPage:
-        restaurant_list = paginator.page(paginator.num_pages)
-    return render(request, 'webapp/search_result.html', {'search_list':restaurant_list, 'search_text':search_text})
-    
+        limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    except ValueError:
+        limit = 10
+    results = []
+    for kind, pk, label in suggest(request.GET.get('q', ''), limit):
+        if kind == 'restaurant':
+            url = reverse('webapp:detail', args=(pk,))
+        else:
+            url = reverse('webapp:search_listing', args=("all",)) + '?%s=%d' % (kind, pk)
+        results.append({'label': label, 'kind': kind, 'url': url})
+    return JsonResponse({'results': results})
+
+@login_required
+def export(request, dataset, fmt):
+    """ Staff export every restaurant or booking, owners those of their
+    restaurants
+    """
+    owner = None if request.user.is_staff else request.user
+    if owner is not None and not owns_any_restaurant(owner):
+        return HttpResponseForbidden("Only restaurant owners can export data.")
+    _, content_type = exporting.FORMATS[fmt]
+    response = StreamingHttpResponse(exporting.export(dataset, fmt, owner), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (dataset, fmt)
+    return response
+
+def metrics(request):
+    """ Metrics of all worker processes in the Prometheus text format, for
+    the addresses in METRICS_ALLOWED_IPS or a bearer METRICS_TOKEN only
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    allowed = (request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ())
+               or (token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''),
+                                                   'Bearer ' + token)))
+    if not allowed:
+        raise Http404
+    return HttpResponse(app_metrics.render(), content_type=app_metrics.CONTENT_TYPE)
+
+def taxonomy_choices(request, field):
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 20)), 100))
+    except ValueError:
+        limit = 20
+    matches = taxonomy.get_choices(taxonomy.FIELDS[field]).search(request.GET.get('q', ''), limit)
+    return JsonResponse({'results': [{'id': pk, 'name': name} for pk, name in matches]})
+
+def nearby(request):
+    try:
+        latitude = float(request.GET['lat'])
+        longitude = float(request.GET['lng'])
+        radius = float(request.GET.get('radius', 5))
+        limit = int(request.GET.get('limit', 20))
+    except (MultiValueDictKeyError, ValueError):
+        return JsonResponse({'error': 'lat and lng are required, radius (km) and limit must be numbers'}, status=400)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and 0 < radius <= MAX_NEARBY_RADIUS and 0 < limit <= 100):
+        return JsonResponse({'error': 'lat, lng, radius or limit out of range'}, status=400)
+    results = [{'id': restaurant.id,
+                'name': restaurant.name,
+                'latitude': float(restaurant.latitude),
+                'longitude': float(restaurant.longitude),
+                'distance': round(distance, 3),
+                'url': reverse('webapp:detail', args=(restaurant.id,))}
+               for distance, restaurant in nearby_restaurants(latitude, longitude, radius, limit)]
+    return JsonResponse({'results': results})
+
 @login_required
 @permission_required('webapp.add_restaurant')
 def restaurant_create(request):
@@ -76,7 +192,7 @@ def restaurant_create(request):
 @login_required
 @permission_required('webapp.change_restaurant')
 def restaurant_update(request, restaurant_id):
-    if not int(restaurant_id) in [restaurant.id for restaurant in request.user.restaurant_set.all()]:
+    if not owns_restaurant(request.user, restaurant_id):
         # raise Http404('You dont have permission to edit this Restaurant.')
         messages.set_level(request, messages.DEBUG)
         messages.debug(request, "You dont have permission to edit this Restaurant")
@@ -163,13 +279,25 @@ def set_permissions(grp_obj, app_name, model_name):
         grp_obj.permissions.add(perms)
 
 def user_profile(request):
-    if request.user.groups.filter(name__icontains='customer'):
-        context_list = request.user.booking_set.all()
+    archived = request.GET.get('archived') == '1'
+    if is_customer(request.user):
+        # Booking names the restaurant, fetch it in the same query
+        bookings = request.user.bookingarchive_set if archived else request.user.booking_set
+        context_list = bookings.select_related('restaurant').order_by('-booking_date', '-id')
         customer = True
     else:
-        context_list = request.user.restaurant_set.all()
+        context_list = request.user.restaurant_set.order_by('-created_at', '-id')
         customer = False
-    return render(request, 'webapp/user_profile.html', {'context_list':context_list, 'customer':customer})
+    paginator = Paginator(context_list, PROFILE_PAGE_SIZE)
+    page = request.GET.get('page')
+    try:
+        context_list = paginator.page(page)
+    except PageNotAnInteger:
+        context_list = paginator.page(1)
+    except EmptyPage:
+        context_list = paginator.page(paginator.num_pages)
+    context = {'context_list':context_list, 'customer':customer, 'archived':archived}
+    return render(request, 'webapp/user_profile.html', context)
 
 def booking_create(request, restaurant_id):
     if request.method == "POST":
@@ -181,26 +309,85 @@ def booking_create(request, restaurant_id):
             new_booking = form.save(commit=False)
             new_booking.user = request.user
             new_booking.name = "Booking on " + str(timezone.now())
-            new_booking.save()
-            messages.success(request, "Booking successful.")
-            next = request.POST.get('next', '/')
-            return HttpResponseRedirect(next)
+            key = form.cleaned_data['idempotency_key'] or uuid.uuid4().hex
+            booking_request, created = submit_booking(new_booking, key)
+            if booking_request.status == BookingRequest.FAILED:
+                form.add_error('booking_date', booking_request.error)
+                # The failed outcome stays recorded under the used key, the
+                # corrected form is a new submit
+                form.data = form.data.copy()
+                form.data['idempotency_key'] = uuid.uuid4().hex
+            elif booking_request.status == BookingRequest.PENDING:
+                if created:
+                    messages.info(request, "Booking received, it will be confirmed shortly.")
+                return HttpResponseRedirect(reverse('webapp:booking_status', args=(booking_request.key,)))
+            else:
+                if created:
+                    messages.success(request, "Booking successful.")
+                next = request.POST.get('next', '/')
+                return HttpResponseRedirect(next)
     else:
-        form = BookingForm(initial={'restaurant': Restaurant.objects.get(pk=restaurant_id)})
+        form = BookingForm(initial={'restaurant': Restaurant.objects.get(pk=restaurant_id),
+                                    'idempotency_key': uuid.uuid4().hex})
     context = {'form':form, 'restaurant_id':restaurant_id}
     return render(request, 'webapp/booking_form.html', context=context)
 
+@login_required
+def booking_status(request, key):
+    booking_request = get_object_or_404(BookingRequest, user=request.user, key=key)
+    if request.is_ajax() or request.GET.get('format') == 'json':
+        return JsonResponse({'status': booking_request.status, 'booking': booking_request.booking_id,
+                             'error': booking_request.error})
+    return render(request, 'webapp/booking_status.html', {'booking_request': booking_request})
+
+def availability(request, restaurant_id):
+    today = timezone.now().date()
+    try:
+        first_day = parse_date(request.GET.get('start', ''))
+    except ValueError:
+        # Well formed but not a date, 2026-02-30
+        first_day = None
+    # From today to the booking horizon, far dates would overflow the range
+    first_day = min(max(first_day or today, today), today + datetime.timedelta(days=horizon_days()))
+    try:
+        days = int(request.GET.get('days', 7))
+    except ValueError:
+        days = 7
+    days = min(max(days, 1), MAX_AVAILABILITY_DAYS)
+    restaurant = get_object_or_404(Restaurant.objects.only('capacity'), pk=restaurant_id)
+    opening, closing = opening_hours()
+    return JsonResponse({
+        'restaurant': restaurant.id,
+        'slot_minutes': slot_minutes(),
+        'opens': '%02d:00' % opening,
+        'free': dict((day.isoformat(), free) for day, free in booking_availability(restaurant, first_day, days)),
+    })
+
+def booking_forbidden(request):
+    messages.set_level(request, messages.DEBUG)
+    messages.debug(request, "You dont have permission to change this Booking")
+    messages.set_level(request, None)
+    return HttpResponseRedirect(reverse('webapp:profile'))
+
 @login_required
 def booking_update(request, booking_id):
     try:
         booking = get_object_or_404(Booking, pk=booking_id)
+        if not can_manage_booking(request.user, booking):
+            return booking_forbidden(request)
         if request.method == "POST":
+            # The form writes the posted values into the instance
+            held_slot_id, held_seats = booking.slot_id, booking.number_of_people
             form = BookingForm(request.POST, instance=booking)
             if form.is_valid():
-                booking = form.save()
-                messages.success(request, "Booking updated successfully.")
-                next = request.POST.get('next', '/')
-                return HttpResponseRedirect(next)
+                try:
+                    change_booking(form.save(commit=False), held_slot_id, held_seats)
+                except SlotFull:
+                    form.add_error('booking_date', SLOT_FULL_MESSAGE)
+                else:
+                    messages.success(request, "Booking updated successfully.")
+                    next = request.POST.get('next', '/')
+                    return HttpResponseRedirect(next)
         else:
             form = BookingForm(instance=booking)
         context = {'form':form, 'restaurant_id':booking.restaurant.id, 'booking_id':booking_id}
@@ -221,7 +408,9 @@ def booking_delete(request, booking_id):
         messages.debug(request, "Booking doesnot exists..")
         messages.set_level(request, None)
     else:
-        booking.delete() 
+        if not can_manage_booking(request.user, booking):
+            return booking_forbidden(request)
+        cancel_booking(booking)
         messages.set_level(request, messages.DEBUG)
         messages.debug(request, "Booking removed.")
         messages.set_level(request, None)